@@ -6,6 +6,8 @@ Created on Mon Nov  7 17:27:49 2022
 @author: adam
 """
 
+import os
+import sys
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
@@ -13,9 +15,16 @@ import matplotlib.ticker as mticker
 import matplotlib.dates as mdates
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
-import pyproj
 from pyproj import Proj
 
+# Merged solutions are loaded with gnss/ppp_store.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "gnss"))
+from ppp_coverage import CoverageIndex
+from ppp_daily import reduce_chunks
+from ppp_projection import steps, to_enu
+from ppp_stats import position_stats
+from ppp_store import iter_station, load_station
+
 # -----------------------------------------------------------------------------
 # Configuration
 # -----------------------------------------------------------------------------
@@ -67,10 +76,10 @@ path_figures = "/Users/adam/Desktop/gnss/figures/"
 # -----------------------------------------------------------------------------
 # Load and prepare data
 # -----------------------------------------------------------------------------
-df = pd.read_csv(path_data + "lowell_upper.csv", index_col=False)
-df = pd.read_csv(path_data + "lowell_corner.csv", index_col=False)
-df = pd.read_csv(path_data + "belcher_upper.csv", index_col=False)
-df = pd.read_csv(path_data + "belcher_lower.csv", index_col=False)
+df = load_station(path_data + "lowell_upper.csv")
+df = load_station(path_data + "lowell_corner.csv")
+df = load_station(path_data + "belcher_upper.csv")
+df = load_station(path_data + "belcher_lower.csv")
 
 
 # -----------------------------------------------------------------------------
@@ -85,53 +94,20 @@ df2 = calc_stats(path_data, "lowell_corner")
 calc_stats(path_data, "belcher_upper")
 calc_stats(path_data, "belcher_lower")
 
-def calc_stats(path_data, filename):
-    
-    # Load concatenated CSV file
-    df1 = pd.read_csv(("{}{}.csv".format(path_data, filename)), index_col=False)
+def calc_stats(path_data, filename, mode="last"):
     
-    # Add date
-    df1["date"] = pd.to_datetime(df1["year"] * 1000 + df1["day_of_year"], format="%Y%j")
+    # Reduce concatenated CSV file (from its Parquet store if it has one) to one row per day, a week at a time
+    daily = reduce_chunks(iter_station("{}{}.csv".format(path_data, filename)))
+    daily.to_csv("{}{}_daily.csv".format(path_stats, filename), index=False)
 
-    # Create empty dataframe
-    df2 = pd.DataFrame()
-    
-    # Group by date and select last row of each day
-    df2 = df1.groupby("date").tail(1)
-    
-    '''
-    # Group by date and calculate mean position
-    stats = df.groupby("date").agg(latitude_decimal_degree=("latitude_decimal_degree", "mean"),
-                                   longitude_decimal_degree=("longitude_decimal_degree", "mean"))
-    '''
-    # Reset index
-    df2 = df2.reset_index()
-    
-    # Initialize pyproj with appropriate ellipsoid
-    geodesic = pyproj.Geod(ellps="WGS84")
-        
-    # Calculate forward azimuth and great circle distance between modelled coordinates
-    df2["direction"], back_azimuth, df2["distance"] = geodesic.inv(df2["longitude_decimal_degree"].shift().tolist(), 
-                                                                   df2["latitude_decimal_degree"].shift().tolist(),
-                                                                   df2["longitude_decimal_degree"].tolist(), 
-                                                                   df2["latitude_decimal_degree"].tolist())
-    
-    # Convert distance from metres to centimenters
-    df2["distance"] = df2["distance"]
-    
-    # Calculate cumulative distance traveled
-    df2["distance_csum"] = df2["distance"].cumsum()
-    
-    # Convert azimuth from (-180° to 180°) to (0° to 360°)
-    df2["direction"] = (df2["direction"] + 360) % 360
-    
-    # Calculate speed
-    df2["speed"] = df2["distance"] / 24
+    # Daily direction (°), distance and cumulative distance (m) and speed (m/h) of the daily position
+    # mode: "last" position of each day, "mean", "median" or "robust" (sigma-clipped mean)
+    df2 = position_stats({filename: daily}, mode)
     
     output_file = "{}{}_stats_new.csv".format(path_stats, filename)
     
     # Output file
-    df2.to_csv(output_file)
+    df2.to_csv(output_file, index=False)
 
     print("Processed: {}".format(output_file))
     
@@ -151,11 +127,11 @@ df1 = pd.read_csv(path_stats + "lowell_upper_stats.csv", index_col=False)
 df2 = pd.read_csv(path_stats + "lowell_corner_stats_new.csv", index_col=False)
 
 # Find max and min displacements
-df1[df1.distance == df1.distance.max()]
-df1[df1.distance == df1.distance.min()]
+df1[df1.distance_m == df1.distance_m.max()]
+df1[df1.distance_m == df1.distance_m.min()]
 
-df2[df2.distance == df2.distance.max()]
-df2[df2.distance == df2.distance.min()]
+df2[df2.distance_m == df2.distance_m.max()]
+df2[df2.distance_m == df2.distance_m.min()]
 
 
 # Belcher Glacier
@@ -166,12 +142,7 @@ df2 = pd.read_csv(path_stats + "belcher_lower_stats.csv", index_col=False)
 df1["date"] = pd.to_datetime(df1["date"].astype(str), format="%Y-%m-%d")
 df2["date"] = pd.to_datetime(df2["date"].astype(str), format="%Y-%m-%d")
 
-# Convert distance to metres
-df1["distance"] = df1["distance"] / 100
-df1["distance_csum"] = df1["distance_csum"] / 100
-
-df2["distance"] = df2["distance"] / 100
-df2["distance_csum"] = df2["distance_csum"] / 100
+# Distances are in metres (distance_m, distance_csum_m)
 
 # Optional:
     
@@ -179,9 +150,9 @@ df2["distance_csum"] = df2["distance_csum"] / 100
 df1 = df1.set_index("date")
 df2 = df2.set_index("date")
 
-# Find missing dates
-pd.date_range(start="2021-07-19", end="2021-12-28").difference(df1.index)
-pd.date_range(start="2021-08-31", end="2022-05-27").difference(df2.index)
+# Find missing dates (from the coverage index written at ingest; freq="h" for hours)
+with CoverageIndex("/Users/adam/Desktop/gnss/data/ppp_coverage.sqlite") as coverage:
+    data_gaps = coverage.gaps(["belcher_upper", "belcher_lower"])
 
 new= df1 - df2
 
@@ -192,8 +163,8 @@ new= df1 - df2
 # Daily displacement
 fig, ax = plt.subplots(figsize=(10,5))
 ax.grid(ls="dotted")
-sns.lineplot(x="date", y="distance", data=df1, color="#0173b2", errorbar=None, label="Milne Glacier 2")
-#sns.lineplot(x="date", y="distance", data=df2, color="#de8f05", errorbar=None, label="Lowell Corner")
+sns.lineplot(x="date", y="distance_m", data=df1, color="#0173b2", errorbar=None, label="Milne Glacier 2")
+#sns.lineplot(x="date", y="distance_m", data=df2, color="#de8f05", errorbar=None, label="Lowell Corner")
 ax.set(xlabel=None, ylabel="Daily Displacement (m)")
 plt.xticks(rotation=45, horizontalalignment="center")
 ax.xaxis.set_major_locator(mdates.MonthLocator(interval=interval))
@@ -204,8 +175,8 @@ plt.savefig(path_figures + "milne_displacement.png", dpi=dpi, transparent=False,
 # Cumulative Distance
 fig, ax = plt.subplots(figsize=(10,5))
 ax.grid(ls="dotted")
-sns.lineplot(x="date", y="distance_csum", data=df1, color="#0173b2", errorbar=None, label="Lowell Upper")
-sns.lineplot(x="date", y="distance_csum", data=df2, color="#de8f05", errorbar=None ,label="Lowell Corner")
+sns.lineplot(x="date", y="distance_csum_m", data=df1, color="#0173b2", errorbar=None, label="Lowell Upper")
+sns.lineplot(x="date", y="distance_csum_m", data=df2, color="#de8f05", errorbar=None ,label="Lowell Corner")
 ax.set(xlabel=None, ylabel="Cumulative Distance (m)")
 plt.xticks(rotation=45, horizontalalignment="center")
 ax.xaxis.set_major_locator(mdates.MonthLocator(interval=interval))
@@ -322,14 +293,11 @@ d = {"lat": [df1["latitude_decimal_degree"].iloc[-1], df2["latitude_decimal_degr
      "lon": [df1["longitude_decimal_degree"].iloc[-1], df2["longitude_decimal_degree"].iloc[-1]]}
 df = pd.DataFrame(data=d)
 
-# Initialize pyproj with appropriate ellipsoid
-geodesic = pyproj.Geod(ellps="WGS84")
+# Project to local east, north (m) about the kinematic position
+east, north, up = to_enu(df["lat"], df["lon"])
     
-# Calculate forward azimuth and great circle distance between modelled coordinates
-direction, back_azimuth, df["distance"] = geodesic.inv(df["lon"].shift().tolist(), 
-                                                       df["lat"].shift().tolist(),
-                                                       df["lon"].tolist(), 
-                                                       df["lat"].tolist())
+# Calculate direction and horizontal distance between modelled coordinates
+df["distance"], direction = steps(east, north)
 delta = df["distance"].iloc[-1]
 
 
@@ -1,30 +1,18 @@
-import subprocess
-import os
-import time
-import glob
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch submission of RINEX files to CSRS-PPP.
 
-# Set paths
-input_path = "/tank/SCRATCH/agarbo/gnss/belcher_upper/RINEX/"
-output_path = "/tank/SCRATCH/agarbo/gnss/belcher_upper/ppp/"
+Kept for existing invocations; runs the batch engine in gnss/csrs_ppp_batch.py
+(see python3 gnss/csrs_ppp_batch.py --help for the options).
+"""
 
-# Search for all RINEX .obs files
-files = sorted(glob.glob(input_path + "*.obs", recursive=True))
+import os
+import sys
 
-# Set number of concurrent processes
-processes = set()
-max_processes = 4
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "gnss"))
 
-# Loop through and process each RINEX .obs file
-for file in files:
-    command = "python3 csrs_ppp_auto.py --user_name adam.garbo@carleton.ca --epoch 2010-01-01 --mode Static --output_pdf lite --get_max 180 --results_dir {} --rnx {}".format(output_path, file)
-    print(command)
-    processes.add(subprocess.Popen([command],shell=True))
-    if len(processes) >= max_processes:
-        os.wait()
-        processes.difference_update(
-            [p for p in processes if p.poll() is not None])
+from csrs_ppp_batch import main  # noqa: E402
 
-# Check if all child processes were closed
-for p in processes:
-    if p.poll() is None:
-        p.wait()
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
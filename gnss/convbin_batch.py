@@ -4,31 +4,193 @@
 Created on Mon Nov  7 15:25:13 2022
 
 @author: adam
+
+Convert u-blox logs to RINEX with convbin (RTKLIB).
+
+Logs are searched recursively and converted on a process pool sized to the
+number of cores, either by convbin or, with --engine native, by the built-in
+converter of ubx2rinex.py (no RTKLIB installation or process spawn per
+file). RINEX files are written to a tree mirroring the station subfolders of
+input_path. Files whose .obs output is newer than the log are skipped, so
+re-running after new data arrives only converts the new logs.
+The time and outcome of each conversion are appended to a JSON Lines file.
+
+Example:
+
+    python3 convbin_batch.py --input_path /tank/SCRATCH/agarbo/GNSS/belcher_lower/ --jobs 32
+    python3 convbin_batch.py --input_path /tank/SCRATCH/agarbo/GNSS/belcher_lower/ --engine native --interval 30
 """
 
+import argparse
 import glob
-from subprocess import call
-from pathlib import Path
-
-# Import CSV files from folder
-input_path = "/tank/SCRATCH/agarbo/GNSS/belcher_lower/"
-output_path = input_path + "RINEX/"
-
-# Create output path if required 
-try:
-    Path(output_path).mkdir(parents=True, exist_ok=False)
-except FileExistsError:
-    print("{} already exists".format(output_path))
-else:
-    print("{} folder was created".format(output_path))
-    
-# Recursively search for .ubx files
-files = sorted(glob.glob(input_path + "*.ubx", recursive=True))
-
-# Loop through each file
-for file in files:
-    program = "convbin"
-    arguments = "-od -os -oi -ot"
-    output = "-d {}".format(output_path)
-    convbin_cmd = "{} {} {} {}".format(program,arguments,output,file)
-    call([convbin_cmd],shell=True)
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import ubx2rinex
+
+# convbin options: output observation, SBAS, ionosphere and time-stamp files
+CONVBIN_ARGUMENTS = ("-od", "-os", "-oi", "-ot")
+
+# Conversion engines: RTKLIB convbin, or ubx2rinex.py
+ENGINES = ("convbin", "native")
+
+Conversion = namedtuple("Conversion", ["ubx_file", "obs_file", "status", "seconds", "error"])
+Conversion.__doc__ = "Outcome of one conversion: status is 'converted', 'skipped' or 'failed'."
+
+
+def find_ubx(input_path, pattern="*.ubx"):
+    """Recursively search input_path for u-blox logs matching pattern."""
+    return sorted(glob.glob(os.path.join(input_path, "**", pattern), recursive=True))
+
+
+def output_dir(ubx_file, input_path, output_path):
+    """Return the directory of the RINEX files of a log, mirroring its subfolder of input_path."""
+    relative = os.path.relpath(os.path.dirname(os.path.abspath(ubx_file)), os.path.abspath(input_path))
+    if relative.startswith(os.pardir):
+        relative = os.curdir
+    return os.path.normpath(os.path.join(output_path, relative))
+
+
+def obs_path(ubx_file, output_path):
+    """Return the path of the RINEX observation file convbin writes for a log."""
+    return os.path.join(output_path, os.path.splitext(os.path.basename(ubx_file))[0] + ".obs")
+
+
+def is_current(ubx_file, obs_file):
+    """Return True if obs_file exists and is at least as recent as ubx_file."""
+    try:
+        return os.path.getmtime(obs_file) >= os.path.getmtime(ubx_file)
+    except OSError:
+        return False
+
+
+def convert_file(ubx_file, output_path, program="convbin", arguments=CONVBIN_ARGUMENTS, engine="convbin",
+                 interval=None):
+    """
+    Convert one .ubx file to RINEX with convbin or the native converter.
+
+    Returns the path of the RINEX observation file written to output_path.
+    Files are written into a temporary directory and then renamed into
+    output_path, so an interrupted conversion never leaves a partial file
+    that looks current. interval (s) decimates the epochs. Raises
+    subprocess.CalledProcessError if convbin fails, ValueError if the log
+    holds no raw measurements (native engine).
+    """
+    os.makedirs(output_path, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".convbin.", dir=output_path)
+    try:
+        if engine == "native":
+            ubx2rinex.convert(ubx_file, tmp_dir, interval)
+        else:
+            command = [program, *arguments]
+            if interval:
+                command += ["-ti", "{0:g}".format(interval)]
+            subprocess.run(command + ["-d", tmp_dir, ubx_file], check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        obs_file = obs_path(ubx_file, tmp_dir)
+        if not os.path.isfile(obs_file):
+            raise FileNotFoundError("convbin wrote no observation file {0:s}".format(os.path.basename(obs_file)))
+        for name in os.listdir(tmp_dir):
+            os.replace(os.path.join(tmp_dir, name), os.path.join(output_path, name))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return obs_path(ubx_file, output_path)
+
+
+def convert_one(ubx_file, output_path, force=False, program="convbin", engine="convbin", interval=None):
+    """
+    Convert a log unless its observation file is current.
+
+    Never raises; returns a Conversion. Safe to run on a process pool.
+    """
+    obs_file = obs_path(ubx_file, output_path)
+    if not force and is_current(ubx_file, obs_file):
+        return Conversion(ubx_file, obs_file, "skipped", 0.0, None)
+
+    start = time.monotonic()
+    try:
+        convert_file(ubx_file, output_path, program, engine=engine, interval=interval)
+    except subprocess.CalledProcessError as e:
+        error = e.stderr.decode(errors="replace").strip() or "convbin exited with status {0:d}".format(e.returncode)
+        return Conversion(ubx_file, obs_file, "failed", time.monotonic() - start, error)
+    except (OSError, ValueError) as e:
+        return Conversion(ubx_file, obs_file, "failed", time.monotonic() - start, str(e))
+    return Conversion(ubx_file, obs_file, "converted", time.monotonic() - start, None)
+
+
+def convert_batch(files, input_path, output_path, jobs=None, force=False, program="convbin", summary=None,
+                  engine="convbin", interval=None):
+    """
+    Convert files on a pool of jobs processes (default: one per core).
+
+    Returns the Conversions in order of completion; a JSON record of each is
+    written to summary if given.
+    """
+    conversions = []
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        futures = [executor.submit(convert_one, file, output_dir(file, input_path, output_path), force, program,
+                                   engine, interval)
+                   for file in files]
+        for future in as_completed(futures):
+            conversion = future.result()
+            conversions.append(conversion)
+            if summary is not None:
+                summary.write(json.dumps(conversion._asdict()) + "\n")
+                summary.flush()
+            print("[{}/{}] {}: {} ({:.1f} sec){}".format(
+                len(conversions), len(files), conversion.ubx_file, conversion.status, conversion.seconds,
+                "" if conversion.error is None else " - {}".format(conversion.error)))
+    return conversions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Convert u-blox logs to RINEX with convbin")
+    parser.add_argument("--input_path", type=str, default="/tank/SCRATCH/agarbo/GNSS/belcher_lower/",
+                        help="Directory searched (recursively) for logs")
+    parser.add_argument("--output_path", type=str, help="Directory of the RINEX files (default=<input_path>/RINEX)")
+    parser.add_argument("--pattern", type=str, default="*.ubx", help="Log file name pattern (default=\"*.ubx\")")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="Number of conversions at once (default=number of cores)")
+    parser.add_argument("--force", action="store_true", help="Convert logs even if their RINEX file is current")
+    parser.add_argument("--engine", default="convbin", type=str.lower, choices=ENGINES,
+                        help="Converter: RTKLIB convbin or the built-in ubx2rinex.py (default=\"convbin\")")
+    parser.add_argument("--interval", type=float, help="Keep only epochs on multiples of this interval (s)")
+    parser.add_argument("--program", type=str, default="convbin", help="convbin executable (default=\"convbin\")")
+    parser.add_argument("--summary", type=str,
+                        help="JSON Lines file of per-file records (default=<output_path>/convbin_batch.jsonl)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    output_path = args.output_path or os.path.join(args.input_path, "RINEX")
+    os.makedirs(output_path, exist_ok=True)
+
+    # Do not pick up logs below the output directory
+    files = [file for file in find_ubx(args.input_path, args.pattern)
+             if not os.path.abspath(file).startswith(os.path.abspath(output_path) + os.sep)]
+    print("{} files found in {}".format(len(files), args.input_path))
+
+    start = time.monotonic()
+    with open(args.summary or os.path.join(output_path, "convbin_batch.jsonl"), "a") as summary:
+        conversions = convert_batch(files, args.input_path, output_path, args.jobs, args.force, args.program,
+                                    summary, args.engine, args.interval)
+
+    counts = Counter(conversion.status for conversion in conversions)
+    print("{} files in {:.1f} sec ({})".format(len(conversions), time.monotonic() - start,
+                                               ", ".join("{}: {}".format(k, v) for k, v in sorted(counts.items()))))
+    for conversion in conversions:
+        if conversion.status == "failed":
+            print("\t{} - {}".format(conversion.ubx_file, conversion.error))
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,7 +12,7 @@
 # INSTRUCTIONS
 # ------------
 # 0) Requirements:
-#       Python v3.5.x or higher (https://www.python.org/)
+#       Python v3.7.x or higher (https://www.python.org/)
 #       Requests library, v2.18.1 or higher (https://requests.readthedocs.io/en/latest/)
 #       Requests Toolbelt library, v0.8.0 or higher (https://toolbelt.readthedocs.io/en/latest/)
 #
@@ -49,13 +49,35 @@
 #
 # 4) If you find that the script keeps timing out, try increasing the value of --get_max.
 #
-# 5) Use --web command line flag to visit CSRS-PPP website (provided a web browser is installed).
+# 5) Uploads are gzip compressed on the fly; use --compression hatanaka to also apply Hatanaka compression
+#    (requires rnx2crx), or --compression none to upload the file as it is.
+#
+# 6) To resume interrupted batches without resubmitting files, pass the same --journal file to every run.
+#
+# 7) To reuse results of files already processed with the same options, pass a --cache-dir (size limited by
+#    --cache_size, in GB).
+#
+# 8) To upload less data, thin the RINEX file on the fly: --decimate 30 keeps one epoch every 30 seconds,
+#    --start/--end crop it to a time window, --systems GR keeps only GPS and GLONASS and --observables "C*,L*"
+#    keeps only code and phase observations.
+#
+# 9) Use --web command line flag to visit CSRS-PPP website (provided a web browser is installed).
 #
 # CHANGELOG
 # ---------
 # DATE          WHO						DESCRIPTION
 # 2022-07-25    Justin Farinaccio		1.6.1
 # Modified:
+#   2026-10-18 - 1.7.0
+#       Moved submission, polling and downloads into the importable asyncio client csrs_ppp_client.py
+#       This script is now a thin command line wrapper around CSRSPPPClient
+#       Added compression as an optional command line argument (observation files are gzipped on upload)
+#       Added journal as an optional command line argument to skip completed files and re-attach to keyids
+#       Added cache_dir and cache_size as optional command line arguments for a content-addressed result cache
+#       Requests are paced by an adaptive rate and concurrency governor; ERROR [002] still exits at once
+#       Added domain as an optional command line argument (or CSRS_PPP_DOMAIN), e.g. for csrs_ppp_mock_server.py
+#       Residuals files are downloaded concurrently; only the files that failed are downloaded again
+#       Added decimate, start, end, systems and observables to filter the RINEX file before upload
 #   2022-07-25 - 1.6.1 - JF
 #       Removed date-dependent change in CGS domain
 #       Removed use of Status.txt, now reading status directly from HTTP response
@@ -118,489 +140,196 @@ __email__ = 'geodeticinformation-informationgeodesique@nrcan-rncan.gc.ca'
 __license__ = 'Open Government Licence - Canada'
 __maintainer__ = 'Justin Farinaccio'
 __status__ = 'Production'
-__version__ = '1.6.1'
+__version__ = '1.7.0'
 
 # Imports
 # -------
 import argparse
+import asyncio
 import datetime
-import errno
+import importlib.util
+import logging
 import os
-import shutil
 import sys
 import time
 import webbrowser
-import zipfile
 
 try:
-    assert sys.version_info >= (3, 5)
+    assert sys.version_info >= (3, 7)
 except AssertionError:
-    sys.exit('ERROR: Must use Python 3.5.x or higher\n\t(see https://www.python.org/)')
-try:
-    import requests
-except ImportError:
+    sys.exit('ERROR: Must use Python 3.7.x or higher\n\t(see https://www.python.org/)')
+# The client modules import these; check them first for a clear message
+if importlib.util.find_spec('requests') is None:
     sys.exit('ERROR: Must install Requests library\n\t(see https://requests.readthedocs.io/en/latest/)')
-try:
-    from requests_toolbelt.multipart.encoder import MultipartEncoder
-except ImportError:
+if importlib.util.find_spec('requests_toolbelt') is None:
     sys.exit('ERROR: Must install Requests Toolbelt library\n\t(see https://toolbelt.readthedocs.io/en/latest/)')
 
-
-# Read/set options
-# ----------------
-# Instantiate the parser
-parser = argparse.ArgumentParser(
-    description='{0}'.format('# ---------------- Using CSRS-PPP via script, version 1.6.1 ---------------- #'),
-    epilog='{0}'.format('# -------------- See script header for complete documentation -------------- #'))
-# Positional arguments
-parser.add_argument('--user_name', type=str, required=True, help='User name (email) / Utilisateur (e-mail)')
-parser.add_argument('--lang', nargs='?', const=1, default='en', type=str.lower, choices=['en', 'fr'],
-                    help='Language / Langue (default="en")')
-parser.add_argument('--mode', nargs='?', const=1, default='Static', type=str.capitalize,
-                    choices=['Static', 'Statique', 'Kinematic', 'Cinematique', 'Cin\u00e9matique'],
-                    help='Processing mode / Mode de traitement (default="Static")')
-parser.add_argument('--ref', nargs='?', const=1, default='NAD83', type=str.upper, choices=['NAD83', 'ITRF'],
-                    help='Reference frame / Cadre de r\u00e9f\u00e9rence (default="NAD83")')
-parser.add_argument('--epoch', nargs='?', const=1, default='CURR', type=str.upper,
-                    help='NAD83 epoch / \u00e9poque (format="YYYY-MM-DD") (default="CURR")')
-parser.add_argument('--vdatum', nargs='?', const=1, default='CGVD2013', type=str.upper, choices=['CGVD2013', 'CGVD28'],
-                    help='Vertical datum / Datum altim\u00e9trique (default="CGVD2013")')
-parser.add_argument('--rnx', type=str, required=True,
-                    help='Absolute path of RINEX observation file / '
-                         'Chemin d\'acc\u00e8s du fichier d\'observation RINEX')
-parser.add_argument('--results_dir', type=str,
-                    help='Absolute path of directory in which to save results / '
-                         'Chemin d\'acc\u00e8s du r\u00e9pertoire dans lequel enregistrer les r\u00e9sultats')
-parser.add_argument('--email', nargs='?', const=1, default='dummy_email', type=str,
-                    help='Send results to this email / Envoyer les r\u00e9sultats \u00e0 ce courriel '
-                         '(default="dummy_email" (results downloaded to directory))')
-parser.add_argument('--output_pdf', nargs='?', const=1, default='full', type=str.lower, choices=['full', 'lite'],
-                    help='PDF solution report content / contenu du rapport des r\u00e8sultats en PDF '
-                         '(default="full" (entire report))')
-parser.add_argument('--res', action='store_true',
-                    help='Download residuals (flag) / T\u00e9l\u00e9charger des r\u00e9siduelles (option)')
-parser.add_argument('--get_max', nargs='?', const=1, default=30, type=int,
-                    help='Number of 10-second intervals to wait for results / '
-                         'Nombre d\'intervalles de 10 secondes d\'attendre des r\u00e9sultats (default=30)')
-parser.add_argument('--web', action='store_true',
-                    help='Visit CSRS-PPP website (flag) / Visitez le site Web SCRS-PPP (option)')
-# Parse arguments
-args = parser.parse_args()
-
-# Canadian Geodetic Survey domain
-domain = 'https://webapp.csrs-scrs.nrcan-rncan.gc.ca'
-
-# Launch CSRS-PPP web page
-# ------------------------
-if args.web:
+from csrs_ppp_cache import ResultCache
+from csrs_ppp_client import DOMAIN, DUMMY_EMAIL, CSRSPPPClient, PPPOptions
+from csrs_ppp_governor import ConcurrencyGovernor
+from csrs_ppp_journal import JobJournal
+from rinex_filter import filter_from_args
+
+
+def build_parser():
+    """Instantiate the command line parser."""
+    parser = argparse.ArgumentParser(
+        description='{0}'.format('# ---------------- Using CSRS-PPP via script, version 1.7.0 ---------------- #'),
+        epilog='{0}'.format('# -------------- See script header for complete documentation -------------- #'))
+    # Positional arguments
+    parser.add_argument('--user_name', type=str, required=True, help='User name (email) / Utilisateur (e-mail)')
+    parser.add_argument('--lang', nargs='?', const=1, default='en', type=str.lower, choices=['en', 'fr'],
+                        help='Language / Langue (default="en")')
+    parser.add_argument('--mode', nargs='?', const=1, default='Static', type=str.capitalize,
+                        choices=['Static', 'Statique', 'Kinematic', 'Cinematique', 'Cin\u00e9matique'],
+                        help='Processing mode / Mode de traitement (default="Static")')
+    parser.add_argument('--ref', nargs='?', const=1, default='NAD83', type=str.upper, choices=['NAD83', 'ITRF'],
+                        help='Reference frame / Cadre de r\u00e9f\u00e9rence (default="NAD83")')
+    parser.add_argument('--epoch', nargs='?', const=1, default='CURR', type=str.upper,
+                        help='NAD83 epoch / \u00e9poque (format="YYYY-MM-DD") (default="CURR")')
+    parser.add_argument('--vdatum', nargs='?', const=1, default='CGVD2013', type=str.upper,
+                        choices=['CGVD2013', 'CGVD28'],
+                        help='Vertical datum / Datum altim\u00e9trique (default="CGVD2013")')
+    parser.add_argument('--rnx', type=str, required=True,
+                        help='Absolute path of RINEX observation file / '
+                             'Chemin d\'acc\u00e8s du fichier d\'observation RINEX')
+    parser.add_argument('--results_dir', type=str,
+                        help='Absolute path of directory in which to save results / '
+                             'Chemin d\'acc\u00e8s du r\u00e9pertoire dans lequel enregistrer les r\u00e9sultats')
+    parser.add_argument('--email', nargs='?', const=1, default=DUMMY_EMAIL, type=str,
+                        help='Send results to this email / Envoyer les r\u00e9sultats \u00e0 ce courriel '
+                             '(default="dummy_email" (results downloaded to directory))')
+    parser.add_argument('--output_pdf', nargs='?', const=1, default='full', type=str.lower, choices=['full', 'lite'],
+                        help='PDF solution report content / contenu du rapport des r\u00e8sultats en PDF '
+                             '(default="full" (entire report))')
+    parser.add_argument('--res', action='store_true',
+                        help='Download residuals (flag) / T\u00e9l\u00e9charger des r\u00e9siduelles (option)')
+    parser.add_argument('--get_max', nargs='?', const=1, default=30, type=int,
+                        help='Number of 10-second intervals to wait for results / '
+                             'Nombre d\'intervalles de 10 secondes d\'attendre des r\u00e9sultats (default=30)')
+    parser.add_argument('--compression', nargs='?', const=1, default='gzip', type=str.lower,
+                        choices=['gzip', 'hatanaka', 'none'],
+                        help='Compression of the uploaded RINEX file / Compression du fichier RINEX '
+                             't\u00e9l\u00e9vers\u00e9 (default="gzip")')
+    parser.add_argument('--journal', type=str,
+                        help='SQLite job journal used to resume interrupted batches / '
+                             'Journal SQLite des t\u00e2ches pour reprendre un traitement interrompu')
+    parser.add_argument('--cache_dir', '--cache-dir', type=str,
+                        help='Directory of the result cache; identical files and options are not resubmitted / '
+                             'R\u00e9pertoire du cache des r\u00e9sultats')
+    parser.add_argument('--cache_size', nargs='?', const=1, default=10, type=float,
+                        help='Maximum size of the result cache in GB / Taille maximale du cache en Go (default=10)')
+    parser.add_argument('--domain', type=str,
+                        help='Base URL of the CSRS-PPP service (default=$CSRS_PPP_DOMAIN or {0:s}) / '
+                             'URL de base du service SCRS-PPP'.format(DOMAIN))
+    parser.add_argument('--decimate', type=float,
+                        help='Keep only epochs on multiples of this interval (s) / '
+                             'Garder seulement les \u00e9poques multiples de cet intervalle (s)')
+    parser.add_argument('--start', type=datetime.datetime.fromisoformat,
+                        help='Drop epochs before this time (YYYY-MM-DDTHH:MM:SS) / '
+                             'Retirer les \u00e9poques avant ce moment')
+    parser.add_argument('--end', type=datetime.datetime.fromisoformat,
+                        help='Drop epochs after this time (YYYY-MM-DDTHH:MM:SS) / '
+                             'Retirer les \u00e9poques apr\u00e8s ce moment')
+    parser.add_argument('--systems', type=str.upper,
+                        help='Constellations kept, e.g. GR / Constellations gard\u00e9es, p. ex. GR')
+    parser.add_argument('--observables', type=str,
+                        help='Comma-separated observation codes kept, e.g. "C*,L*" / '
+                             'Codes d\'observation gard\u00e9s, p. ex. "C*,L*"')
+    parser.add_argument('--web', action='store_true',
+                        help='Visit CSRS-PPP website (flag) / Visitez le site Web SCRS-PPP (option)')
+    return parser
+
+
+def validate_args(args):
+    """Verify the command line arguments, exiting with a message on the first problem."""
+    # Verify method(s) to return results to user
+    # ------------------------------------------
+    if args.email == DUMMY_EMAIL and not args.results_dir:
+        sys.exit('ERROR: Must provide directory or an email address to receive results')
+
+    if args.email != DUMMY_EMAIL and '@' not in args.email:
+        sys.exit('ERROR: Please enter valid email')
+
+    # Verify date format
+    # ------------------
+    if 'CURR' not in args.epoch and 'COUR' not in args.epoch:
+        max_date = datetime.date.today()
+        try:
+            input_date = datetime.datetime.strptime(args.epoch, '%Y-%m-%d').date()
+            if input_date < datetime.date(1994, 1, 1):
+                sys.exit('ERROR: Invalid epoch: {0:s}\n\tPlease select an epoch that is no earlier than '
+                         '1994-01-01'.format(args.epoch))
+        except ValueError:
+            sys.exit('ERROR: Invalid epoch: {0:s}\n\tFormat must be: YYYY-MM-DD'.format(args.epoch))
+
+        if input_date > max_date:
+            sys.exit('ERROR: Epoch cannot be later than today\'s date:'
+                     '\n\tepoch chosen: {0:s}\n\ttoday\'s date: {1}'.format(args.epoch, max_date))
+
+    # Verify get_max
+    # --------------
+    if args.get_max < 0:
+        sys.exit('ERROR: get_max cannot be negative...')
+    if 0 <= args.get_max < 30:
+        sys.exit('ERROR: As get_max is the number of 10-second intervals to wait for results,'
+                 '\n\tplease wait at least 5 minutes to receive your results.')
+    elif args.get_max > 180:
+        sys.exit('ERROR: Probably best not to wait more than 30 minutes for your results...')
+
+    # Ensure the RINEX file exists
+    # ----------------------------
+    if not os.path.isfile(args.rnx):
+        sys.exit('ERROR: Cannot access RINEX file {0:s}'.format(args.rnx))
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    # Launch CSRS-PPP web page
+    # ------------------------
+    if args.web:
+        try:
+            if args.lang == 'en':
+                print('Loading CSRS-PPP website...')
+            elif args.lang == 'fr':
+                print('Chargement du site Web SCRS-PPP...')
+            time.sleep(3)
+            webbrowser.open('{0:s}/geod/tools-outils/ppp.php?locale={1:s}'.format(DOMAIN, args.lang),
+                            new=2, autoraise=True)
+            sys.exit()
+        except webbrowser.Error:
+            sys.exit('ERROR: Cannot load web page')
+
+    validate_args(args)
+
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+
+    options = PPPOptions(lang=args.lang, mode=args.mode, ref=args.ref, epoch=args.epoch, vdatum=args.vdatum,
+                         email=args.email, output_pdf=args.output_pdf)
+
+    journal = JobJournal(args.journal) if args.journal else None
+    cache = ResultCache(args.cache_dir, int(args.cache_size * 1024 ** 3)) if args.cache_dir else None
     try:
-        if args.lang == 'en':
-            print('Loading CSRS-PPP website...')
-        elif args.lang == 'fr':
-            print('Chargement du site Web SCRS-PPP...')
-        time.sleep(3)
-        webbrowser.open('{0:s}/geod/tools-outils/ppp.php?locale={1:s}'.format(domain, args.lang), new=2, autoraise=True)
-        sys.exit()
-    except webbrowser.Error:
-        sys.exit('ERROR: Cannot load web page')
-
-# Verify method(s) to return results to user
-# ------------------------------------------
-if args.email == 'dummy_email' and not args.results_dir:
-    sys.exit('ERROR: Must provide directory or an email address to receive results')
-
-if args.email != 'dummy_email' and '@' not in args.email:
-    sys.exit('ERROR: Please enter valid email')
-
-# Verify date format
-# ------------------
-if 'CURR' not in args.epoch and 'COUR' not in args.epoch:
-    max_date = datetime.date.today()
-    try:
-        input_date = datetime.datetime.strptime(args.epoch, '%Y-%m-%d').date()
-        if input_date < datetime.date(1994, 1, 1):
-            sys.exit('ERROR: Invalid epoch: {0:s}\n\tPlease select an epoch that is no earlier than 1994-01-01'.format(
-                args.epoch))
-    except ValueError as e:
-        sys.exit('ERROR: Invalid epoch: {0:s}\n\tFormat must be: YYYY-MM-DD'.format(args.epoch))
-
-    if input_date > max_date:
-        sys.exit('ERROR: Epoch cannot be later than today\'s date:'
-                 '\n\tepoch chosen: {0:s}\n\ttoday\'s date: {1}'.format(args.epoch, max_date))
-
-# Verify get_max
-# --------------
-if args.get_max < 0:
-    sys.exit('ERROR: get_max cannot be negative...')
-if 0 <= args.get_max < 30:
-    sys.exit('ERROR: As get_max is the number of 10-second intervals to wait for results,'
-             '\n\tplease wait at least 5 minutes to receive your results.')
-elif args.get_max > 180:
-    sys.exit('ERROR: Probably best not to wait more than 30 minutes for your results...')
-
-# Working directory
-# -----------------
-rinex_file_abspath = os.path.abspath(args.rnx)
-
-(rinex_path, rinex_file) = os.path.split(rinex_file_abspath)
-
-try:
-    os.chdir(rinex_path)
-except FileNotFoundError:
-    sys.exit('ERROR: Cannot access directory {0:s}'.format(rinex_path))
-
-# Useful var
-# ----------
-procstat = None
-
-# Local Vars
-# ----------
-error = 0
-debug = 0
-sleepsec = 10
-
-request_max = 5
-
-keyid = None
-
-# Number of files submitted (for potential download of residuals)
-# ---------------------------------------------------------------
-num_files = 0
-
-# Specify the URL of the page to post to
-# --------------------------------------
-url_to_post_to = '{0:s}/CSRS-PPP/service/submit'.format(domain)
-browser_name = 'CSRS-PPP access via Python Browser Emulator'
-
-# Define PPP access mode
-# ----------------------
-ppp_access = 'nobrowser_status'  # default starting 2013-09-30
-
-# Print Info
-# ----------
-# Ensure splitting up the absolute path produces a file name and not just a directory
-if rinex_file is None:
-    sys.exit('ERROR: No RINEX file')
-(rinex_name, suffix) = os.path.splitext(rinex_file)
-
-print('=> RNX: {0:s} [{1:s}]'.format(rinex_file, rinex_path))
-
-# Some more initializations
-# -------------------------
-if args.mode == 'Static' or args.mode == 'Statique':
-    process_type = 'Static'
-else:
-    process_type = 'Kinematic'
-
-if args.epoch == 'CURR' or args.epoch == 'COUR':
-    nad83_epoch = 'CURR'
-else:
-    nad83_epoch = args.epoch
-
-if args.ref == 'ITRF':
-    if args.vdatum == 'CGVD28':
-        print('\nNOTE:\tReference frame of ITRF only allows vertical datum of CGVD2013'
-              '\n\tVertical datum set to CGVD2013\n')
-        time.sleep(10)
-    vdatum = 'cgvd2013'
-
-    if nad83_epoch != 'CURR':
-        print('\nNOTE:\tReference frame of ITRF only allows the epoch to be the same as the GPS data'
-              '\n\tEpoch set to "CURR"\n')
-        time.sleep(10)
-        nad83_epoch = 'CURR'
-else:
-    vdatum = args.vdatum.lower()
-
-# -------------------------------------------------
-# Create the browser that will post the information
-# -------------------------------------------------
-# ITERATE up to request_max!
-
-for request_num in range(request_max):
-    print('=> Request_num[{0:d}]'.format(request_num))
-
-    # The information to POST to the program
-    content = {
-        'return_email': args.email,
-        'cmd_process_type': 'std',
-        'ppp_access': ppp_access,
-        'language': args.lang,
-        'user_name': args.user_name,
-        'process_type': process_type,
-        'sysref': args.ref,
-        'nad83_epoch': nad83_epoch,
-        'v_datum': vdatum,
-        'rfile_upload': (rinex_file, open(rinex_file, 'rb'), 'text/plain'),
-        'output_pdf': args.output_pdf
-    }
-    mtp_data = MultipartEncoder(fields=content)
-    # Insert the browser name, if specified
-    header = {'User-Agent': browser_name, 'Content-Type': mtp_data.content_type, 'Accept': 'text/plain'}
-
-    req = requests.post(url_to_post_to, data=mtp_data, headers=header)
-    keyid = str(req.text)  # The keyid required for the job
-
-    # Print some values for debug!
-    if debug:
-        print('Key: {0:s}'.format(req.text))
-
-    # 'key'
-    if req.text:
-        keyid = req.text
-
-        # Problems while doing the 'request'
-        # ----------------------------------
-        # Re-Submit!
-        if 'DOCTYPE' in keyid:
-            print('=> Keyid has a weird value! [{0:s}]'.format(rinex_name))
-            if debug:
-                print('{0:s}'.format(keyid))
-            print('=> Re-Submit ...')
-            continue
-        # key OKAY!
-        # ---------
-        print('=> Keyid: {0:s}'.format(keyid))
-        if keyid == 'ERROR [002]':
-            sys.exit('*** NOTICE ***\nYou have been blocked from using CSRS-PPP. This block is temporary. Please contact CGS for further information.')
-        print('=> Now wait until "Status=done" ...')
-
-        # All is OKAY... now wait!
-        # ------------------------
-        # -----------------
-        # Loop until "done"
-        # -----------------
-        get_num = 0
-
-        while not (procstat == 'done' or error == 1):
-            get_num += 1
-
-            # Check get_max
-            if get_num > args.get_max:
-                print('=> Max number of get [{0:d}] exceeded! Too long! [{1:s}]'.format(args.get_max, rinex_name))
-                print('=> Next file ...')
-                error = 1
-                sys.exit(error)
-
-            # get status
-            r = requests.get('{0:s}/CSRS-PPP/service/results/status?id={1:s}"'.format(domain, keyid), timeout=5)
-            try:
-                status = r.content.decode(encoding='utf-8', errors='strict')
-            except UnicodeError:
-                sys.exit('ERROR: Problem with status! Try again!')
-
-            if 'processing' in str(status).lower():
-                procstat = 'processing'
-                sleepmore = 1
-            elif 'done' in str(status).lower():
-                procstat = 'done'
-                sleepmore = 0
-            elif 'error' in str(status).lower():
-                procstat = 'error'
-                sleepmore = 1
-            else:
-                procstat = 'Unknown'
-                print('*ERR*[{0:d}] ... log content follows ...'.format(get_num))
-                print('{0:s}'.format(status))
-                sleepmore = 1
-
-            print('\tStatus[{0:d}]: {1:s} [{2:s}]'.format(get_num, procstat, rinex_file))
-
-            if sleepmore:
-                print('\t[sleep {0:d} sec]'.format(sleepsec))
-                time.sleep(sleepsec)
-
-        # ---------------------------------
-        # Get result file 'full_output.zip'
-        # ---------------------------------
-        if not error:
-            # If only email and no results_dir requested, exit
-            if args.email and not args.results_dir:
-                print('=> Email with results sent to {0:s}'.format(args.email))
-                sys.exit()
-
-            result_name = 'full_output.zip'
-            if os.path.isfile(result_name):
-                os.remove(result_name)
-            print('=> Get results file: {0:s}'.format(result_name))
-
-            # Iterate!
-            # --------
-            for get_num in range(args.get_max):
-                # get
-                r = requests.get('{0:s}/CSRS-PPP/service/results/file?id={1:s}'.format(domain, keyid), timeout=5)
-
-                with open(result_name, 'wb') as f:
-                    f.write(r.content)
-
-                if os.path.isfile(result_name):
-                    print('=> Okay[{0:d}]: Got file "{1:s}" ... Moved to {2:s} ... if OK!'.format(get_num, result_name, rinex_name + '_' + result_name))
-
-                    # Check full_output.zip integrity
-                    try:
-                        zip_ref = zipfile.ZipFile(result_name).testzip()
-                    except zipfile.BadZipFile as e:
-                        sys.exit('ERROR: Bad ZIP file')
-
-                    print('=> Integrity[{0:d}]: OK.'.format(get_num))
-                    os.rename(result_name, rinex_name + '_' + result_name)
-                    result_name = rinex_name + '_' + result_name
-
-                    # Make results_dir if it does not exist
-                    try:
-                        os.makedirs(args.results_dir)
-                    except OSError as e:
-                        if e.errno != errno.EEXIST:
-                            raise
-
-                    # Extract sum and PDF
-                    # -------------------
-                    for extract_name in zipfile.ZipFile(result_name, 'r').namelist():
-                        if '.sum' in extract_name or '.pdf' in extract_name:
-                            print('\textracting ... {0:s}'.format(extract_name))
-
-                            with zipfile.ZipFile(result_name, 'r') as zip_ref:
-                                zip_ref.extract(extract_name)
-
-                            # Move outputs to desired path
-                            shutil.move(extract_name, '{0}/{1}'.format(args.results_dir, extract_name))
-
-                    # Move full_output.zip to desired path
-                    shutil.move(result_name, '{0}/{1}'.format(args.results_dir, result_name))
-
-                    if args.email != 'dummy_email':
-                        print('=> Email with results sent to {0:s}'.format(args.email))
-
-                    # If no residuals requested, exit
-                    if not args.res:
-                        sys.exit()
-                    else:
-                        break
-                else:
-                    print('** Error: File "$result_name" *NOT* found!')
-                    print('=> Will Re-get ...')
-                    continue  # re-get!
-
-            # Max get reached?
-            # ----------------
-            if not args.res:
-                print('=> Max number of requests [{0:d}] exceeded!'.format(args.get_max))
-                print('=> RNX: {0:s} [keyid: {1:s}]'.format(rinex_name, keyid))
-                print('=> NEXT file!')
-                error = 1
-                sys.exit(error)
-        else:
-            print('=> NO results! An error occurred while processing!!!')
-            print('=> RNX: {0:s} [keyid: {1:s}]'.format(rinex_name, keyid))
-            error = 1
-            sys.exit(error)
-
-        # ----------------------------
-        # Get residuals file 'res.zip'
-        # ----------------------------
-        if args.res:
-            print('\nResiduals requested too!')
-
-            if not error:
-                # Iterate!
-                # --------
-                for get_num in range(args.get_max):
-
-                    try:
-                        # If a zip file is submitted
-                        for extract_name in zipfile.ZipFile(rinex_file, 'r').namelist():
-                            num_files += 1
-
-                            residuals_name = '{0:s}_res.zip'.format(os.path.splitext(extract_name)[0])
-                            if os.path.isfile(residuals_name):
-                                os.remove(residuals_name)
-                            print('=> Get residuals file: {0:s}'.format(residuals_name))
-
-                            # get
-                            r = requests.get('{0:s}/CSRS-PPP/service/results/file?id={1:s}&fid={2:02d}&type=res'.format(domain, keyid, num_files), timeout=5)
-                            with open(residuals_name, 'wb') as f:
-                                f.write(r.content)
-
-                            if os.path.isfile(residuals_name):
-                                print('=> Okay[{0:d}]: Got file "{1:s}" ...'.format(get_num, residuals_name))
-
-                                # Check res.zip integrity
-                                try:
-                                    zip_ref = zipfile.ZipFile(residuals_name).testzip()
-                                except zipfile.BadZipFile as e:
-                                    sys.exit('ERROR: Bad ZIP file')
-
-                                print('=> Integrity[{0:d}]: OK.'.format(get_num))
-
-                                # Move res.zip to desired path
-                                shutil.move(residuals_name, '{0}/{1}'.format(args.results_dir, residuals_name))
-
-                            else:
-                                print('** Error: File "residuals_name" *NOT* found!')
-                                print('=> Will Re-get ...')
-                                continue  # re-get!
-
-                        else:
-                            sys.exit()
-
-                    except zipfile.BadZipFile:
-                        # If a zip file is not submitted
-                        num_files = 1
-
-                        residuals_name = '{0:s}_res.zip'.format(rinex_name)
-                        if os.path.isfile(residuals_name):
-                            os.remove(residuals_name)
-                        print('=> Get residuals file: {0:s}'.format(residuals_name))
-
-                        # get
-                        r = requests.get('{0:s}/CSRS-PPP/service/results/file?id={1:s}&fid={2:02d}&type=res'.format(domain, keyid, num_files), timeout=5)
-                        with open(residuals_name, 'wb') as f:
-                            f.write(r.content)
-
-                        if os.path.isfile(residuals_name):
-                            print('=> Okay[{0:d}]: Got file "{1:s}" ...'.format(get_num, residuals_name))
-
-                            # Check res.zip integrity
-                            try:
-                                zip_ref = zipfile.ZipFile(residuals_name).testzip()
-                            except zipfile.BadZipFile as e:
-                                sys.exit('ERROR: Bad ZIP file')
-
-                            print('=> Integrity[{0:d}]: OK.'.format(get_num))
-
-                            # Move res.zip to desired path
-                            shutil.move(residuals_name, '{0}/{1}'.format(args.results_dir, residuals_name))
-
-                            sys.exit()
-
-                        else:
-                            print('** Error: File "residuals_name" *NOT* found!')
-                            print('=> Will Re-get ...')
-                            continue  # re-get!
-
-                # Max get reached?
-                # ----------------
-                print('=> Max number of requests [{0:d}] exceeded!'.format(args.get_max))
-                print('=> RNX: {0:s} [keyid: {1:s}]'.format(rinex_name, keyid))
-                print('=> NEXT file!')
-                error = 1
-                sys.exit(error)
-            else:
-                print('=> NO residuals! An error occurred while processing!!!')
-                print('=> RNX: {0:s} [keyid: {1:s}]'.format(rinex_name, keyid))
-                error = 1
-                sys.exit(error)
-
-    # Problems while doing the 'request'
-    # ----------------------------------
-    # Re-Submit!
-    else:
-        print('=> Keyid does *NOT* exist!')
-        print('=> Re-Submit ...')
-        continue
-
-# If it gets here => Problems ... NEXT file!
-# ------------------------------------------
-print('=> Max number of requests [{0:d}] exceeded! [{1:s}]'.format(request_max, rinex_name))
-print('=> Next file ...')
-sys.exit(1)
+        with CSRSPPPClient(args.user_name, options, domain=args.domain, get_max=args.get_max,
+                           compression=args.compression, journal=journal, cache=cache,
+                           governor=ConcurrencyGovernor(retry_blocked=False),
+                           rinex_filter=filter_from_args(args)) as client:
+            for note in client.notes:
+                print('\nNOTE:\t{0:s}\n'.format(note))
+                time.sleep(10)
+
+            result = asyncio.run(client.process(os.path.abspath(args.rnx), args.results_dir, args.res))
+    finally:
+        if journal is not None:
+            journal.close()
+
+    if result.status == 'blocked':
+        sys.exit('*** NOTICE ***\n{0:s}'.format(result.error))
+    if result.status == 'failed':
+        print('=> Next file ...')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,226 @@
-from subprocess import Popen, PIPE
-import os
-import time
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch submission of RINEX observation files to CSRS-PPP.
+
+All files are processed in-process by one CSRSPPPClient, with at most
+--max_jobs jobs in flight at once. Results and logs mirror the subfolders of
+--input_path below --output_path and --log_dir, so files of the same name in
+different folders (e.g. the same day at two stations) do not overwrite each
+other. Every file gets its own log in --log_dir,
+a structured record (status, exit code, keyid, timings, outputs, error) is
+appended to the JSON Lines summary, and a final summary is printed. The exit
+code is 0 only if every file succeeded.
+
+Example:
+
+    python3 csrs_ppp_batch.py --user_name first.last@email.com --input_path RINEX/ --output_path ppp/ \
+        --epoch 2010-01-01 --mode Static --output_pdf lite --get_max 180
+"""
+
+import argparse
+import asyncio
 import glob
+import json
 import logging
+import os
+import sys
+import time
+from collections import Counter
 
-logging.basicConfig(filename="logtest.txt",
-                    filemode='a',
-                    format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
-                    datefmt='%H:%M:%S',
-                    level=logging.DEBUG)
+from convbin_batch import output_dir
+from csrs_ppp_cache import ResultCache
+from csrs_ppp_client import DUMMY_EMAIL, CSRSPPPClient, JobResult, PPPOptions
+from csrs_ppp_governor import ConcurrencyGovernor
+from csrs_ppp_journal import JobJournal
+from rinex_filter import add_filter_arguments, filter_from_args
 
 logger = logging.getLogger("csrs_ppp")
 
-# Set paths
-input_path = "/tank/SCRATCH/agarbo/gnss/belcher_upper/RINEX/"
-output_path = "/tank/SCRATCH/agarbo/gnss/belcher_upper/ppp/"
-
-# Search for all RINEX .obs files
-files = sorted(glob.glob(input_path + "*.obs", recursive=True))
-
-# Set number of concurrent processes
-processes = set()
-max_processes = 4
-
-# Loop through and process each RINEX .obs file
-for file in files:
-    command = "python3 csrs_ppp_auto.py --user_name adam.garbo@carleton.ca --epoch 2010-01-01 --mode Static --output_pdf lite --get_max 180 --results_dir {} --rnx {}".format(output_path, file)
-    p = Popen([command], shell=True, stdout=PIPE, stderr=PIPE)
-    output, error = p.communicate()
-    if p.returncode != 0: 
-       logger.debug("Popen failed {} {} {}".format(p.returncode, output, error))
-    if len(processes) >= max_processes:
-        os.wait()
-        processes.difference_update(
-            [p for p in processes if p.poll() is not None])
-
-# Check if all child processes were closed
-for p in processes:
-    if p.poll() is None:
-        p.wait()
+# Exit code of each job status
+EXIT_CODES = {"done": 0, "emailed": 0, "skipped": 0, "cached": 0, "failed": 1, "blocked": 2}
+
+
+def find_files(input_path, pattern="*.obs"):
+    """Recursively search input_path for RINEX files matching pattern."""
+    return sorted(glob.glob(os.path.join(input_path, "**", pattern), recursive=True))
+
+
+def log_path(rinex_file, log_dir, input_path=None):
+    """Return the log file of a job, in the subfolder of log_dir mirroring that of input_path if given."""
+    if input_path is not None:
+        log_dir = output_dir(rinex_file, input_path, log_dir)
+    return os.path.join(log_dir, "{0:s}.log".format(os.path.basename(rinex_file)))
+
+
+def job_logger(rinex_file, log_dir, input_path=None):
+    """Return a logger writing the messages of one job to its own file (see log_path)."""
+    path = log_path(rinex_file, log_dir, input_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Keyed on the log file, so that jobs of files with the same name do not share a logger
+    job_log = logging.getLogger("csrs_ppp.job.{0:s}".format(os.path.relpath(path, log_dir)))
+    job_log.setLevel(logging.DEBUG)
+    job_log.propagate = False
+    handler = logging.FileHandler(path, mode="a")
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    job_log.addHandler(handler)
+    return job_log
+
+
+def close_logger(job_log):
+    for handler in list(job_log.handlers):
+        job_log.removeHandler(handler)
+        handler.close()
+
+
+def job_record(result, log_path):
+    """Return the structured summary record of a JobResult."""
+    return {
+        "rinex_file": result.rinex_file,
+        "keyid": result.keyid,
+        "status": result.status,
+        "exit_code": EXIT_CODES[result.status],
+        "elapsed": round(result.elapsed, 3),
+        "time_to_done": None if result.time_to_done is None else round(result.time_to_done, 3),
+        "outputs": result.outputs,
+        "error": result.error,
+        "log": log_path,
+    }
+
+
+async def run_batch(client, files, results_dir, res=False, max_jobs=4, log_dir=None, summary=None,
+                    input_path=None):
+    """
+    Process files with a bounded pool of concurrent jobs.
+
+    With input_path, the results and log of each file go to the subfolders
+    of results_dir and log_dir mirroring its subfolder of input_path.
+    Returns the list of summary records, in the order of files. Once a job
+    reports that the user is blocked, jobs that have not started yet are not
+    submitted and are recorded as blocked too.
+    """
+    semaphore = asyncio.Semaphore(max_jobs)
+    snapshot = client.http.stats()
+    blocked = []
+    records = [None] * len(files)
+
+    async def worker(index, rinex_file):
+        async with semaphore:
+            job_log_path = log_path(rinex_file, log_dir, input_path)
+            if blocked:
+                result = JobResult(rinex_file, None, "blocked", [], blocked[0], 0.0)
+            else:
+                job_log = job_logger(rinex_file, log_dir, input_path)
+                results = results_dir if input_path is None else output_dir(rinex_file, input_path, results_dir)
+                try:
+                    result = await client.process(rinex_file, results, res, log=job_log)
+                except Exception as e:  # keep the batch going; the record carries the error
+                    job_log.exception("Unexpected error")
+                    result = JobResult(rinex_file, None, "failed", [], repr(e), 0.0)
+                finally:
+                    close_logger(job_log)
+                if result.status == "blocked":
+                    blocked.append(result.error)
+
+            record = job_record(result, job_log_path)
+            records[index] = record
+            if summary is not None:
+                summary.write(json.dumps(record) + "\n")
+                summary.flush()
+            logger.info("[{0:d}/{1:d}] {2:s}: {3:s} ({4:.1f} sec){5:s}".format(
+                sum(r is not None for r in records), len(files), os.path.basename(rinex_file), result.status,
+                result.elapsed, "" if result.error is None else " - {0:s}".format(result.error)))
+
+    await asyncio.gather(*(worker(i, rinex_file) for i, rinex_file in enumerate(files)))
+    client.log_report(snapshot)
+    return records
+
+
+def print_summary(records, elapsed):
+    """Log the number of jobs per status and the overall throughput."""
+    counts = Counter(record["status"] for record in records)
+    logger.info("=> Summary: {0:d} files in {1:.1f} sec ({2:s})".format(
+        len(records), elapsed, ", ".join("{0:s}: {1:d}".format(k, v) for k, v in sorted(counts.items()))))
+    for record in records:
+        if record["exit_code"] != 0:
+            logger.info("\t{0:s} [{1:s}] {2}".format(record["rinex_file"], record["status"], record["error"]))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Batch submission of RINEX files to CSRS-PPP")
+    parser.add_argument("--user_name", type=str, default="adam.garbo@carleton.ca", help="CSRS-PPP user name (email)")
+    parser.add_argument("--input_path", type=str, default="/tank/SCRATCH/agarbo/gnss/belcher_upper/RINEX/",
+                        help="Directory searched (recursively) for RINEX files")
+    parser.add_argument("--output_path", type=str, default="/tank/SCRATCH/agarbo/gnss/belcher_upper/ppp/",
+                        help="Directory in which to save results (in the subfolders of input_path)")
+    parser.add_argument("--pattern", type=str, default="*.obs", help="RINEX file name pattern (default=\"*.obs\")")
+    parser.add_argument("--max_jobs", type=int, default=4, help="Number of jobs in flight at once (default=4)")
+    parser.add_argument("--domain", type=str,
+                        help="Base URL of the CSRS-PPP service (default=$CSRS_PPP_DOMAIN or the NRCan web service)")
+    parser.add_argument("--max_requests", type=int, default=16,
+                        help="Highest number of requests in flight to CSRS-PPP (default=16)")
+    parser.add_argument("--rate", type=float, default=2.0,
+                        help="Initial requests per second to CSRS-PPP, adapted to the service (default=2)")
+    parser.add_argument("--lang", default="en", type=str.lower, choices=["en", "fr"])
+    parser.add_argument("--mode", default="Static", type=str.capitalize, choices=["Static", "Kinematic"])
+    parser.add_argument("--ref", default="NAD83", type=str.upper, choices=["NAD83", "ITRF"])
+    parser.add_argument("--epoch", default="CURR", type=str.upper, help="NAD83 epoch (YYYY-MM-DD or CURR)")
+    parser.add_argument("--vdatum", default="CGVD2013", type=str.upper, choices=["CGVD2013", "CGVD28"])
+    parser.add_argument("--email", default=DUMMY_EMAIL, type=str, help="Also send results to this email")
+    parser.add_argument("--output_pdf", default="full", type=str.lower, choices=["full", "lite"])
+    parser.add_argument("--res", action="store_true", help="Download residuals")
+    parser.add_argument("--get_max", default=30, type=int,
+                        help="Number of 10-second intervals to wait for results (default=30)")
+    parser.add_argument("--compression", default="gzip", type=str.lower, choices=["gzip", "hatanaka", "none"])
+    add_filter_arguments(parser)
+    parser.add_argument("--journal", type=str,
+                        help="SQLite job journal (default=<output_path>/csrs_ppp_journal.sqlite)")
+    parser.add_argument("--cache_dir", "--cache-dir", type=str, help="Directory of the result cache")
+    parser.add_argument("--cache_size", default=10, type=float, help="Maximum size of the result cache in GB")
+    parser.add_argument("--log_dir", type=str, help="Directory of the per-file logs (default=<output_path>/logs)")
+    parser.add_argument("--summary", type=str,
+                        help="JSON Lines file of per-file records (default=<output_path>/csrs_ppp_batch.jsonl)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    log_dir = args.log_dir or os.path.join(args.output_path, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    logging.basicConfig(format="%(asctime)s %(message)s", datefmt="%H:%M:%S", level=logging.INFO)
+
+    files = find_files(args.input_path, args.pattern)
+    logger.info("=> {0:d} files found in {1:s}".format(len(files), args.input_path))
+    if not files:
+        return 0
+
+    options = PPPOptions(lang=args.lang, mode=args.mode, ref=args.ref, epoch=args.epoch, vdatum=args.vdatum,
+                         email=args.email, output_pdf=args.output_pdf)
+    journal = JobJournal(args.journal or os.path.join(args.output_path, "csrs_ppp_journal.sqlite"))
+    cache = ResultCache(args.cache_dir, int(args.cache_size * 1024 ** 3)) if args.cache_dir else None
+    governor = ConcurrencyGovernor(initial=min(4, args.max_requests), maximum=args.max_requests, rate=args.rate)
+    summary_path = args.summary or os.path.join(args.output_path, "csrs_ppp_batch.jsonl")
+
+    # One thread (and pooled connection) per request the governor may allow
+    workers = max(args.max_jobs, args.max_requests)
+
+    start = time.monotonic()
+    try:
+        with CSRSPPPClient(args.user_name, options, domain=args.domain, max_workers=workers,
+                           get_max=args.get_max, compression=args.compression, journal=journal, cache=cache,
+                           governor=governor, rinex_filter=filter_from_args(args)) as client, \
+                open(summary_path, "a") as summary:
+            for note in client.notes:
+                logger.info("NOTE: {0:s}".format(note))
+            records = asyncio.run(run_batch(client, files, args.output_path, args.res, args.max_jobs, log_dir,
+                                            summary, args.input_path))
+    finally:
+        journal.close()
+
+    print_summary(records, time.monotonic() - start)
+    return max(record["exit_code"] for record in records)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache of CSRS-PPP results.
+
+Results are keyed on the SHA-256 of the RINEX bytes plus the parameters that
+change the solution (mode, reference frame, epoch, vertical datum and PDF
+content). Re-running a batch with the same options, or sweeping between
+parameter sets that were already processed, restores results from the cache
+instead of submitting the files again.
+
+Layout:
+
+    cache_dir/ab/abcdef.../full_output.zip
+                          /<members>.sum, .pdf, .csv
+                          /meta.json
+
+Entries are hard-linked into the results directory when possible (copied
+otherwise), and the least recently used entries are evicted when the cache
+grows past its size limit. The size of the cache is walked once and then kept
+as a running total; it is walked again only to evict, down to LOW_WATER of the
+limit.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+
+from csrs_ppp_journal import encode_params
+from csrs_ppp_results import atomic_write
+
+# Submit fields that determine the results of a job
+KEY_FIELDS = ("process_type", "sysref", "nad83_epoch", "v_datum", "output_pdf")
+
+# Archive members kept next to the cached archive
+MEMBER_SUFFIXES = (".sum", ".pdf", ".csv")
+
+RESULT_NAME = "full_output.zip"
+
+# Eviction frees the cache down to this fraction of its size limit, so that a
+# full cache is not walked again at every store
+LOW_WATER = 0.9
+
+
+def cache_key(digest, fields):
+    """Return the cache key of a RINEX content hash and submit fields."""
+    params = {name: fields[name] for name in KEY_FIELDS}
+    if fields.get("rinex_filter"):
+        # Filtered uploads give different results; unfiltered keys are unchanged
+        params["rinex_filter"] = fields["rinex_filter"]
+    return hashlib.sha256("{0:s}|{1:s}".format(digest, encode_params(params)).encode()).hexdigest()
+
+
+def _place(source, target):
+    """Hard-link source to target (atomically replacing it), or copy if linking fails."""
+    directory, name = os.path.split(target)
+    tmp_path = os.path.join(directory, ".{0:s}.{1:d}.link".format(name, os.getpid()))
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        with open(source, "rb") as f:
+            atomic_write(target, f)
+    else:
+        os.replace(tmp_path, target)
+    return target
+
+
+def _entry_size(entry):
+    """Return the size in bytes of the files of an entry directory."""
+    return sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+
+
+class ResultCache:
+    """
+    Size-bounded, content-addressed store of result archives.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory of the cache; created if needed.
+    max_bytes : int
+        Size above which the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir, max_bytes=10 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        # Running total of the entry sizes, seeded by the first store (None until then)
+        self._total = None
+        self._lock = threading.Lock()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def lookup(self, key):
+        """Return the entry directory of a key, marking it as recently used, or None."""
+        entry = self._entry_dir(key)
+        meta = os.path.join(entry, "meta.json")
+        if not os.path.isfile(meta):
+            return None
+        os.utime(meta)
+        return entry
+
+    def store(self, key, result_zip, rinex_file):
+        """
+        Add a result archive (and its members) to the cache, then evict old entries.
+
+        Returns the entry directory.
+        """
+        entry = self._entry_dir(key)
+        if os.path.isfile(os.path.join(entry, "meta.json")):
+            return entry
+
+        # Build the entry aside, then rename it into place
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp_entry = tempfile.mkdtemp(prefix=".{0:s}.".format(key), dir=os.path.dirname(entry))
+        try:
+            members = []
+            with zipfile.ZipFile(result_zip) as zip_ref:
+                for info in zip_ref.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith(MEMBER_SUFFIXES):
+                        continue
+                    name = os.path.basename(info.filename)
+                    with zip_ref.open(info) as member:
+                        atomic_write(os.path.join(tmp_entry, name), member)
+                    members.append(name)
+            shutil.copyfile(result_zip, os.path.join(tmp_entry, RESULT_NAME))
+
+            meta = {"rinex_name": os.path.splitext(os.path.basename(rinex_file))[0],
+                    "members": members, "created": time.time()}
+            with open(os.path.join(tmp_entry, "meta.json"), "w") as f:
+                json.dump(meta, f)
+            size = _entry_size(tmp_entry)
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            if not os.path.isfile(os.path.join(entry, "meta.json")):
+                raise
+            return entry
+
+        with self._lock:
+            if self._total is None:
+                # The walk already counts the new entry
+                self._total = sum(size for _, size, _ in self.entries())
+            else:
+                self._total += size
+            over = self._total > self.max_bytes
+        if over:
+            self.evict()
+        return entry
+
+    def restore(self, key, results_dir, rinex_file, suffixes=MEMBER_SUFFIXES):
+        """
+        Place a cached entry in results_dir as if it had just been downloaded.
+
+        Members named after the RINEX file that produced the entry are renamed
+        after rinex_file. Returns the paths written (members first, archive
+        last), or None if the key is not cached.
+        """
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+        with open(os.path.join(entry, "meta.json")) as f:
+            meta = json.load(f)
+
+        os.makedirs(results_dir, exist_ok=True)
+        rinex_name = os.path.splitext(os.path.basename(rinex_file))[0]
+        outputs = []
+        for name in meta["members"]:
+            if not name.lower().endswith(suffixes):
+                continue
+            if name.startswith(meta["rinex_name"]):
+                target = rinex_name + name[len(meta["rinex_name"]):]
+            else:
+                target = name
+            outputs.append(_place(os.path.join(entry, name), os.path.join(results_dir, target)))
+
+        result_name = "{0:s}_{1:s}".format(rinex_name, RESULT_NAME)
+        outputs.append(_place(os.path.join(entry, RESULT_NAME), os.path.join(results_dir, result_name)))
+        return outputs
+
+    def entries(self):
+        """Return (last used time, size in bytes, entry directory) for every entry."""
+        entries = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry = os.path.join(prefix_dir, key)
+                meta = os.path.join(entry, "meta.json")
+                if key.startswith(".") or not os.path.isfile(meta):
+                    continue
+                entries.append((os.path.getmtime(meta), _entry_size(entry), entry))
+        return entries
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in
+        LOW_WATER * max_bytes.
+
+        The walk also counts entries stored by other processes sharing the
+        cache, and resets the running total.
+        """
+        with self._lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total <= LOW_WATER * self.max_bytes:
+                    break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+            self._total = total
@@ -0,0 +1,648 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Asynchronous client for the NRCan CSRS-PPP web service.
+
+One CSRSPPPClient keeps many CSRS-PPP jobs in flight from a single event loop.
+Waiting between status polls is done with asyncio.sleep, and the blocking HTTP
+calls run on a shared thread pool, so hundreds of keyids can be tracked at the
+same time without one interpreter per RINEX file.
+
+Typical use:
+
+    client = CSRSPPPClient("first.last@email.com", PPPOptions(mode="Static"))
+    with client:
+        results = asyncio.run(client.process_batch(files, results_dir))
+
+The coroutines submit, poll_status, fetch_results and fetch_residuals can also
+be awaited individually to build other schedulers on top of the client.
+"""
+
+import asyncio
+import contextlib
+import functools
+import logging
+import os
+import time
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+
+import csrs_ppp_journal
+from csrs_ppp_cache import cache_key
+from csrs_ppp_governor import BLOCKED, DOCTYPE, TIMEOUT, ConcurrencyGovernor
+from csrs_ppp_journal import content_hash
+from csrs_ppp_polling import PollRecord, PollScheduler
+from csrs_ppp_results import atomic_write, check_zip, download_spool, save_results
+from csrs_ppp_session import PooledSession
+from csrs_ppp_upload import COMPRESSED_SUFFIXES, prepare_upload
+from rinex_filter import filter_params, is_active
+
+# Canadian Geodetic Survey domain
+DOMAIN = "https://webapp.csrs-scrs.nrcan-rncan.gc.ca"
+
+# Environment variable overriding DOMAIN (e.g. to use csrs_ppp_mock_server.py)
+DOMAIN_ENV = "CSRS_PPP_DOMAIN"
+
+# Browser name sent with every request
+BROWSER_NAME = "CSRS-PPP access via Python Browser Emulator"
+
+# PPP access mode (default starting 2013-09-30)
+PPP_ACCESS = "nobrowser_status"
+
+# Email placeholder used when results are only downloaded
+DUMMY_EMAIL = "dummy_email"
+
+logger = logging.getLogger("csrs_ppp")
+
+
+# -----------------------------------------------------------------------------
+# Errors
+# -----------------------------------------------------------------------------
+
+class CSRSPPPError(Exception):
+    """Base class for CSRS-PPP job failures."""
+
+
+class BlockedError(CSRSPPPError):
+    """The user has been (temporarily) blocked from using CSRS-PPP."""
+
+
+class SubmitError(CSRSPPPError):
+    """No usable keyid was returned after request_max submissions."""
+
+
+class ProcessingError(CSRSPPPError):
+    """The job did not reach "done" within get_max status polls."""
+
+
+class ResultsError(CSRSPPPError):
+    """The results could not be downloaded or failed the integrity check."""
+
+
+# -----------------------------------------------------------------------------
+# Processing options and job results
+# -----------------------------------------------------------------------------
+
+PPPOptions = namedtuple("PPPOptions",
+                        ["lang", "mode", "ref", "epoch", "vdatum", "email", "output_pdf"],
+                        defaults=["en", "Static", "NAD83", "CURR", "CGVD2013", DUMMY_EMAIL, "full"])
+PPPOptions.__doc__ = "Processing options shared by every job submitted by a client."
+
+JobResult = namedtuple("JobResult", ["rinex_file", "keyid", "status", "outputs", "error", "elapsed", "time_to_done"],
+                       defaults=[None])
+JobResult.__doc__ = ("Outcome of one job: status is 'done', 'emailed', 'skipped', 'cached', 'failed' or "
+                     "'blocked'; outputs lists the files written to results_dir; time_to_done is the time (s) "
+                     "between submission and the 'done' status.")
+
+
+def normalize_options(options):
+    """
+    Map user options onto the values expected by the submit form.
+
+    Returns the form fields and a list of notes for options that had to be
+    overridden (ITRF only allows CGVD2013 and the epoch of the GPS data).
+    """
+    notes = []
+
+    if options.mode in ("Static", "Statique"):
+        process_type = "Static"
+    else:
+        process_type = "Kinematic"
+
+    if options.epoch in ("CURR", "COUR"):
+        nad83_epoch = "CURR"
+    else:
+        nad83_epoch = options.epoch
+
+    if options.ref == "ITRF":
+        if options.vdatum == "CGVD28":
+            notes.append("Reference frame of ITRF only allows vertical datum of CGVD2013"
+                         "\n\tVertical datum set to CGVD2013")
+        vdatum = "cgvd2013"
+
+        if nad83_epoch != "CURR":
+            notes.append("Reference frame of ITRF only allows the epoch to be the same as the GPS data"
+                         "\n\tEpoch set to \"CURR\"")
+            nad83_epoch = "CURR"
+    else:
+        vdatum = options.vdatum.lower()
+
+    fields = {
+        "return_email": options.email,
+        "cmd_process_type": "std",
+        "ppp_access": PPP_ACCESS,
+        "language": options.lang,
+        "process_type": process_type,
+        "sysref": options.ref,
+        "nad83_epoch": nad83_epoch,
+        "v_datum": vdatum,
+        "output_pdf": options.output_pdf,
+    }
+    return fields, notes
+
+
+def parse_status(text):
+    """Reduce a status response to 'processing', 'done', 'error' or 'Unknown'."""
+    status = str(text).lower()
+    if "processing" in status:
+        return "processing"
+    elif "done" in status:
+        return "done"
+    elif "error" in status:
+        return "error"
+    return "Unknown"
+
+
+def residual_members(rinex_file):
+    """
+    Return the names of the RINEX files contained in a submission.
+
+    A zip archive may hold several RINEX files, each with its own residuals
+    file numbered (fid) from 1 in archive order; any other submission is a
+    single file.
+    """
+    try:
+        with zipfile.ZipFile(rinex_file) as zip_ref:
+            return [name for name in zip_ref.namelist() if not name.endswith("/")]
+    except zipfile.BadZipFile:
+        return [os.path.basename(rinex_file)]
+
+
+@contextlib.asynccontextmanager
+async def stage_slot(stages, name):
+    """Hold the semaphore of a processing stage ('submit', 'poll' or 'fetch'), if stages limits it."""
+    if stages is None or name not in stages:
+        yield
+        return
+    async with stages[name]:
+        yield
+
+
+# -----------------------------------------------------------------------------
+# Client
+# -----------------------------------------------------------------------------
+
+class CSRSPPPClient:
+    """
+    Submit RINEX files to CSRS-PPP and collect their results asynchronously.
+
+    Parameters
+    ----------
+    user_name : str
+        CSRS-PPP user name (email).
+    options : PPPOptions
+        Processing options applied to every submission.
+    domain : str
+        Base URL of the CSRS-PPP service; by default $CSRS_PPP_DOMAIN, or
+        DOMAIN if unset.
+    max_workers : int
+        Number of threads available for blocking HTTP calls, and the size of
+        the connection pool when no session is given.
+    session : PooledSession
+        Shared keep-alive session; by default the client creates its own.
+    request_max : int
+        Number of submissions attempted before giving up on a file.
+    get_max : int
+        Number of sleepsec intervals to wait for results (and number of
+        download attempts) before giving up.
+    sleepsec : float
+        Length in seconds of one get_max interval.
+    scheduler : PollScheduler
+        Decides the delays between status polls; shared by all jobs so that
+        processing times learned on one job benefit the next.
+    timeout : float
+        Timeout in seconds for status and download requests.
+    compression : str
+        Compression of uploaded observation files: "gzip", "hatanaka" or
+        "none" (see csrs_ppp_upload.prepare_upload).
+    journal : JobJournal
+        Records every job so that an interrupted batch can be resumed.
+    cache : ResultCache
+        Content-addressed result cache; files already processed with the same
+        parameters are restored from it instead of being submitted (unless
+        residuals are requested, which are not cached).
+    extract : tuple of str
+        Suffixes of the result archive members saved to results_dir.
+    governor : ConcurrencyGovernor
+        Rate and concurrency limits shared by every request of the client;
+        by default at most max_workers requests are in flight.
+    max_residuals : int
+        Number of residuals files of one job downloaded at once.
+    rinex_filter : rinex_filter.RinexFilter
+        Decimation, time window, constellations and observables applied to
+        observation files before upload (see rinex_filter.py).
+    """
+
+    def __init__(self, user_name, options=None, domain=None, max_workers=32, session=None,
+                 request_max=5, get_max=30, sleepsec=10, timeout=5, scheduler=None, compression="gzip",
+                 journal=None, cache=None, extract=(".sum", ".pdf"),
+                 governor=None, max_residuals=8, rinex_filter=None):
+        self.user_name = user_name
+        self.options = options or PPPOptions()
+        self.domain = (domain or os.environ.get(DOMAIN_ENV) or DOMAIN).rstrip("/")
+        self.request_max = request_max
+        self.get_max = get_max
+        self.sleepsec = sleepsec
+        self.timeout = timeout
+        self.compression = compression
+        self.journal = journal
+        self.cache = cache
+        self.extract = tuple(extract)
+        self.max_residuals = max_residuals
+        self.rinex_filter = rinex_filter
+        self.scheduler = scheduler or PollScheduler()
+        self.fields, self.notes = normalize_options(self.options)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="csrs_ppp")
+        self.governor = governor or ConcurrencyGovernor(maximum=max_workers)
+        self._owns_session = session is None
+        self.http = session or PooledSession(pool_size=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Release the worker threads and, if the client created it, the session."""
+        self._executor.shutdown(wait=True)
+        if self._owns_session:
+            self.http.close()
+
+    @property
+    def job_params(self):
+        """Parameters that, with the file contents, determine the results of a job."""
+        params = dict(self.fields, compression=self.compression)
+        if is_active(self.rinex_filter):
+            params["rinex_filter"] = filter_params(self.rinex_filter)
+        return params
+
+    @property
+    def key_fields(self):
+        """Submit fields and RINEX filter, as used by cache keys."""
+        return dict(self.fields, rinex_filter=filter_params(self.rinex_filter))
+
+    @property
+    def url_submit(self):
+        return "{0:s}/CSRS-PPP/service/submit".format(self.domain)
+
+    def url_status(self, keyid):
+        return "{0:s}/CSRS-PPP/service/results/status?id={1:s}".format(self.domain, keyid)
+
+    def url_file(self, keyid, fid=None):
+        if fid is None:
+            return "{0:s}/CSRS-PPP/service/results/file?id={1:s}".format(self.domain, keyid)
+        return "{0:s}/CSRS-PPP/service/results/file?id={1:s}&fid={2:02d}&type=res".format(self.domain, keyid, fid)
+
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking call on the worker threads."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _request(self, func, *args):
+        """Run a blocking HTTP call within the governor's rate and concurrency limits."""
+        async with self.governor.slot():
+            try:
+                return await self._run(func, *args)
+            except (requests.Timeout, requests.ConnectionError):
+                self.governor.congestion(TIMEOUT)
+                raise
+
+    # -------------------------------------------------------------------------
+    # Blocking HTTP calls (run on the worker threads)
+    # -------------------------------------------------------------------------
+
+    def _post_submit(self, upload_name, stream):
+        stream.rewind()
+        if upload_name.lower().endswith(COMPRESSED_SUFFIXES):
+            content_type = "application/octet-stream"
+        else:
+            content_type = "text/plain"
+        content = dict(self.fields, user_name=self.user_name, rfile_upload=(upload_name, stream, content_type))
+        mtp_data = MultipartEncoder(fields=content)
+        header = {"User-Agent": BROWSER_NAME, "Content-Type": mtp_data.content_type, "Accept": "text/plain"}
+        start = time.monotonic()
+        req = self.http.post(self.url_submit, data=mtp_data, headers=header)
+        return req.text, time.monotonic() - start
+
+    def _get_status(self, keyid):
+        r = self.http.get(self.url_status(keyid), timeout=self.timeout)
+        return r.content.decode(encoding="utf-8", errors="strict")
+
+    def _get_results(self, url, results_dir, result_name):
+        with download_spool(self.http.get(url, timeout=self.timeout, stream=True)) as spool:
+            check_zip(spool)
+            return save_results(spool, results_dir, result_name, self.extract)
+
+    def _get_residuals(self, url, path):
+        with download_spool(self.http.get(url, timeout=self.timeout, stream=True)) as spool:
+            check_zip(spool)
+            atomic_write(path, spool)
+
+    # -------------------------------------------------------------------------
+    # Coroutines
+    # -------------------------------------------------------------------------
+
+    async def submit(self, rinex_file, log=logger):
+        """
+        Upload a RINEX file and return the keyid of the new job.
+
+        Weird (HTML) or empty keyids are re-submitted up to request_max times.
+        Raises BlockedError if CSRS-PPP reports ERROR [002].
+        """
+        rinex_name = os.path.splitext(os.path.basename(rinex_file))[0]
+
+        # Compress once; every re-submission streams the same bytes
+        with contextlib.ExitStack() as stack:
+            upload_name, stream = await self._run(stack.enter_context,
+                                                  prepare_upload(rinex_file, self.compression,
+                                                                 rinex_filter=self.rinex_filter))
+            log.info("=> Upload: {0:s} ({1:d} of {2:d} bytes)".format(upload_name, stream.size,
+                                                                       os.path.getsize(rinex_file)))
+            return await self._submit_stream(upload_name, stream, rinex_name, log)
+
+    async def _submit_stream(self, upload_name, stream, rinex_name, log):
+        blocked = False
+        for request_num in range(self.request_max):
+            log.info("=> Request_num[{0:d}]".format(request_num))
+            try:
+                keyid, upload_time = await self._request(self._post_submit, upload_name, stream)
+            except requests.RequestException as e:
+                log.info("=> Submission failed! [{0}]".format(e))
+                log.info("=> Re-Submit ...")
+                continue
+            log.info("=> Uploaded in {0:.1f} sec".format(upload_time))
+            log.debug("Key: {0:s}".format(keyid))
+
+            if not keyid:
+                log.info("=> Keyid does *NOT* exist!")
+                log.info("=> Re-Submit ...")
+                continue
+            if "DOCTYPE" in keyid:
+                self.governor.congestion(DOCTYPE)
+                log.info("=> Keyid has a weird value! [{0:s}]".format(rinex_name))
+                log.debug("{0:s}".format(keyid))
+                log.info("=> Re-Submit ...")
+                continue
+
+            log.info("=> Keyid: {0:s}".format(keyid))
+            if keyid == "ERROR [002]":
+                if blocked:
+                    break
+                # Pause every request of the batch, then try once more (if the governor allows it)
+                self.governor.congestion(BLOCKED)
+                blocked = True
+                if not self.governor.retry_blocked:
+                    break
+                log.info("=> Blocked! Pausing requests for {0:.0f} sec ...".format(self.governor.cooldown))
+                continue
+            self.governor.success()
+            return keyid
+
+        if blocked:
+            raise BlockedError("You have been blocked from using CSRS-PPP. This block is temporary. "
+                               "Please contact CGS for further information.")
+        raise SubmitError("Max number of requests [{0:d}] exceeded! [{1:s}]".format(self.request_max, rinex_name))
+
+    async def poll_status(self, keyid, rinex_file, log=logger, learn=True):
+        """
+        Poll the job status, with delays from the scheduler, until it is "done".
+
+        Returns the PollRecord of the job, which the scheduler also learns from
+        unless learn is False (e.g. when re-attaching to an older job). Raises
+        ProcessingError after waiting get_max * sleepsec seconds.
+        """
+        rinex_name = os.path.basename(rinex_file)
+        mode = self.fields["process_type"]
+        size = os.path.getsize(rinex_file)
+        deadline = self.get_max * self.sleepsec
+        log.info("=> Now wait until \"Status=done\" ...")
+
+        start = time.monotonic()
+        delays = self.scheduler.delays(mode, size)
+        get_num = 0
+        while time.monotonic() - start <= deadline:
+            get_num += 1
+            try:
+                status = await self._request(self._get_status, keyid)
+            except UnicodeError:
+                raise ProcessingError("Problem with status! Try again!")
+            except requests.RequestException as e:
+                status = "{0}".format(e)
+
+            procstat = parse_status(status)
+            if procstat == "Unknown":
+                log.info("*ERR*[{0:d}] ... log content follows ...".format(get_num))
+                log.info("{0:s}".format(status))
+                if "DOCTYPE" in status:
+                    self.governor.congestion(DOCTYPE)
+            else:
+                self.governor.success()
+
+            log.info("\tStatus[{0:d}]: {1:s} [{2:s}]".format(get_num, procstat, rinex_name))
+            if procstat == "done":
+                elapsed = time.monotonic() - start
+                log.info("=> Time to done: {0:.1f} sec ({1:d} polls) [{2:s}]".format(elapsed, get_num, rinex_name))
+                if not learn:
+                    return PollRecord(rinex_file, mode, size, elapsed, get_num)
+                self.scheduler.record(rinex_file, mode, size, elapsed, get_num)
+                return self.scheduler.records[-1]
+
+            sleepsec = next(delays)
+            log.info("\t[sleep {0:.1f} sec]".format(sleepsec))
+            await asyncio.sleep(sleepsec)
+
+        raise ProcessingError("Max number of get [{0:d}] exceeded! Too long! [{1:s}]".format(self.get_max, rinex_name))
+
+    async def fetch_results(self, keyid, rinex_file, results_dir, log=logger):
+        """
+        Download full_output.zip and save it with its members (.sum and .pdf
+        by default, see extract).
+
+        The archive is streamed into memory (or a spooled temporary file),
+        checked there, and written to results_dir with atomic renames; bad or
+        truncated downloads are fetched again. Returns the paths written.
+        """
+        rinex_name = os.path.splitext(os.path.basename(rinex_file))[0]
+        result_name = "{0:s}_full_output.zip".format(rinex_name)
+        log.info("=> Get results file: {0:s}".format(result_name))
+
+        for get_num in range(self.get_max):
+            try:
+                outputs = await self._request(self._get_results, self.url_file(keyid), results_dir, result_name)
+            except (zipfile.BadZipFile, requests.RequestException) as e:
+                log.info("** Error: File \"{0:s}\" *NOT* valid! [{1}]".format(result_name, e))
+                log.info("=> Will Re-get ...")
+                continue
+
+            log.info("=> Integrity[{0:d}]: OK.".format(get_num))
+            for path in outputs:
+                log.info("\tsaved ... {0:s}".format(path))
+            return outputs
+
+        raise ResultsError("Max number of requests [{0:d}] exceeded! [keyid: {1:s}]".format(self.get_max, keyid))
+
+    async def fetch_residuals(self, keyid, rinex_file, results_dir, log=logger):
+        """
+        Download the residuals zip file of every RINEX file in the submission.
+
+        Files are numbered (fid) in the order of the submission members and
+        downloaded concurrently, at most max_residuals at once; each round of
+        retries only fetches again the files that failed. Every download is
+        checked in memory (or a spooled temporary file) and written to
+        results_dir with an atomic rename. Returns the paths written, in fid
+        order.
+        """
+        log.info("\nResiduals requested too!")
+        os.makedirs(results_dir, exist_ok=True)
+        semaphore = asyncio.Semaphore(self.max_residuals)
+
+        pending = {}
+        for fid, extract_name in enumerate(residual_members(rinex_file), start=1):
+            residuals_name = "{0:s}_res.zip".format(os.path.splitext(os.path.basename(extract_name))[0])
+            pending[fid] = os.path.join(results_dir, residuals_name)
+        outputs = {}
+        log.info("=> Get residuals files: {0:d}".format(len(pending)))
+
+        async def get_one(fid, path):
+            async with semaphore:
+                try:
+                    await self._request(self._get_residuals, self.url_file(keyid, fid), path)
+                except (zipfile.BadZipFile, requests.RequestException) as e:
+                    log.info("** Error: File \"{0:s}\" *NOT* valid! [{1}]".format(os.path.basename(path), e))
+                    return False
+                return True
+
+        for get_num in range(self.get_max):
+            fids = sorted(pending)
+            results = await asyncio.gather(*(get_one(fid, pending[fid]) for fid in fids))
+            for fid, ok in zip(fids, results):
+                if ok:
+                    outputs[fid] = pending.pop(fid)
+                    log.info("=> Okay[{0:d}]: Got file \"{1:s}\" ...".format(get_num, os.path.basename(outputs[fid])))
+            if not pending:
+                return [outputs[fid] for fid in sorted(outputs)]
+            log.info("=> Will Re-get {0:d} file(s) ...".format(len(pending)))
+
+        raise ResultsError("Max number of requests [{0:d}] exceeded! [{1:s}]".format(
+            self.get_max, ", ".join(os.path.basename(pending[fid]) for fid in sorted(pending))))
+
+    def _journal(self, job, status, **kwargs):
+        if job is not None:
+            self.journal.set_status(job.id, status, **kwargs)
+
+    async def process(self, rinex_file, results_dir=None, res=False, log=logger, stages=None):
+        """
+        Run one RINEX file through submit, poll and download.
+
+        With a journal, files whose results are already saved are skipped and
+        jobs that were interrupted re-attach to their keyid. stages optionally
+        maps 'submit', 'poll' and 'fetch' to semaphores shared with other jobs,
+        limiting how many jobs are in each stage at once. Never raises for job
+        failures; the outcome is reported in a JobResult.
+        """
+        start = time.monotonic()
+        keyid = None
+        record = None
+        outputs = []
+        job = None
+        log.info("=> RNX: {0:s} [{1:s}]".format(os.path.basename(rinex_file),
+                                                 os.path.dirname(os.path.abspath(rinex_file))))
+
+        digest = None
+        if self.journal is not None or self.cache is not None:
+            digest = await self._run(content_hash, rinex_file)
+
+        if self.journal is not None:
+            job = self.journal.start(os.path.abspath(rinex_file), digest, self.job_params)
+            if (job.status == csrs_ppp_journal.COMPLETE and (job.outputs or not results_dir)
+                    and all(os.path.isfile(path) for path in job.outputs)):
+                log.info("=> Already processed [keyid: {0}] ... skipping".format(job.keyid))
+                return JobResult(rinex_file, job.keyid, "skipped", job.outputs, None, time.monotonic() - start)
+            if job.status in csrs_ppp_journal.IN_FLIGHT:
+                keyid = job.keyid
+                log.info("=> Re-attach to keyid: {0:s}".format(keyid))
+
+        # Identical file and parameters already processed: restore the results
+        if self.cache is not None and results_dir and not res:
+            key = cache_key(digest, self.key_fields)
+            cached = await self._run(self.cache.restore, key, results_dir, rinex_file, self.extract)
+            if cached is not None:
+                log.info("=> Results restored from cache [{0:s}]".format(key))
+                self._journal(job, csrs_ppp_journal.COMPLETE, outputs=cached)
+                return JobResult(rinex_file, job and job.keyid, "cached", cached, None, time.monotonic() - start)
+
+        try:
+            if keyid is None:
+                async with stage_slot(stages, "submit"):
+                    keyid = await self.submit(rinex_file, log)
+                self._journal(job, csrs_ppp_journal.SUBMITTED, keyid=keyid)
+                async with stage_slot(stages, "poll"):
+                    record = await self.poll_status(keyid, rinex_file, log)
+            else:
+                async with stage_slot(stages, "poll"):
+                    record = await self.poll_status(keyid, rinex_file, log, learn=False)
+            self._journal(job, csrs_ppp_journal.DONE)
+
+            # If only email and no results_dir requested, stop here
+            if not results_dir:
+                log.info("=> Email with results sent to {0:s}".format(self.options.email))
+                self._journal(job, csrs_ppp_journal.COMPLETE, outputs=outputs)
+                return JobResult(rinex_file, keyid, "emailed", outputs, None, time.monotonic() - start,
+                                 record.time_to_done)
+
+            async with stage_slot(stages, "fetch"):
+                outputs += await self.fetch_results(keyid, rinex_file, results_dir, log)
+                if self.cache is not None:
+                    await self._run(self.cache.store, cache_key(digest, self.key_fields), outputs[-1], rinex_file)
+                if self.options.email != DUMMY_EMAIL:
+                    log.info("=> Email with results sent to {0:s}".format(self.options.email))
+                if res:
+                    outputs += await self.fetch_residuals(keyid, rinex_file, results_dir, log)
+            self._journal(job, csrs_ppp_journal.COMPLETE, outputs=outputs)
+        except BlockedError as e:
+            self._journal(job, csrs_ppp_journal.BLOCKED, error=str(e))
+            return JobResult(rinex_file, keyid, "blocked", outputs, str(e), time.monotonic() - start,
+                             record and record.time_to_done)
+        except CSRSPPPError as e:
+            self._journal(job, csrs_ppp_journal.FAILED, error=str(e))
+            log.info("=> {0}".format(e))
+            log.info("=> RNX: {0:s} [keyid: {1}]".format(os.path.basename(rinex_file), keyid))
+            return JobResult(rinex_file, keyid, "failed", outputs, str(e), time.monotonic() - start,
+                             record and record.time_to_done)
+
+        return JobResult(rinex_file, keyid, "done", outputs, None, time.monotonic() - start, record.time_to_done)
+
+    async def process_batch(self, rinex_files, results_dir=None, res=False, max_jobs=100):
+        """
+        Process many RINEX files concurrently, with at most max_jobs in flight.
+
+        Returns the JobResults in the order of rinex_files.
+        """
+        semaphore = asyncio.Semaphore(max_jobs)
+        snapshot = self.http.stats()
+
+        async def bounded(rinex_file):
+            async with semaphore:
+                return await self.process(rinex_file, results_dir, res)
+
+        results = await asyncio.gather(*(bounded(rinex_file) for rinex_file in rinex_files))
+        self.log_report(snapshot)
+        return results
+
+    def log_report(self, snapshot, log=logger):
+        """Log connections opened and reused since a session snapshot, time to done, and the governor limits."""
+        stats = self.http.stats_since(snapshot)
+        log.info("=> Connections: {0:d} opened, {1:d} reused ({2:d} requests)".format(
+            stats.opened, stats.reused, stats.requests))
+        for mode, size_mib, jobs, mean, longest, polls in self.scheduler.report():
+            log.info("=> Time to done [{0:s}, <= {1:d} MiB]: {2:d} jobs, mean {3:.1f} sec, "
+                     "max {4:.1f} sec, {5:.1f} polls/job".format(mode, size_mib, jobs, mean, longest, polls))
+        report = self.governor.report()
+        log.info("=> Governor: {0:d} requests in flight, {1:.2f} requests/sec{2:s}".format(
+            report["limit"], report["rate"],
+            "".join(", {0:s}: {1:d}".format(k, v) for k, v in sorted(report["events"].items()))))
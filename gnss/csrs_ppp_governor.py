@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rate limiting and adaptive concurrency for requests to the CSRS-PPP service.
+
+One ConcurrencyGovernor is shared by every job of a batch. Each request first
+takes a slot (at most `limit` requests in flight) and a token from a token
+bucket (at most `rate` requests per second on average). Both limits follow
+AIMD: they grow additively while the service answers normally and are cut
+multiplicatively on signs of overload (HTML "DOCTYPE" pages instead of a
+keyid, timeouts, connection errors). When CSRS-PPP reports a temporary block
+(ERROR [002]) every request is paused for a cool-down period and both limits
+drop to their minimum, and the blocked submission is tried once more (unless
+retry_blocked is False: the job then fails at once).
+"""
+
+import asyncio
+import contextlib
+import time
+from collections import Counter
+
+# Congestion signals
+DOCTYPE = "doctype"
+TIMEOUT = "timeout"
+BLOCKED = "blocked"
+
+
+class TokenBucket:
+    """Token bucket of `burst` tokens refilled at `rate` tokens per second."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ConcurrencyGovernor:
+    """
+    AIMD controller of concurrent requests and request rate.
+
+    Parameters
+    ----------
+    initial, minimum, maximum : int
+        Initial, lowest and highest number of requests in flight.
+    rate, min_rate, max_rate : float
+        Initial, lowest and highest average requests per second.
+    burst : int
+        Size of the token bucket.
+    decrease : float
+        Factor applied to both limits on congestion.
+    holdoff : float
+        Seconds after a decrease during which further congestion signals do
+        not decrease the limits again (one reaction per congestion episode).
+    cooldown : float
+        Seconds during which no request is made after a block.
+    retry_blocked : bool
+        Whether a blocked submission is made again after the cool-down.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=32, rate=5.0, min_rate=0.2, max_rate=20.0, burst=10,
+                 decrease=0.5, holdoff=10.0, cooldown=900.0, retry_blocked=True):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.decrease = decrease
+        self.holdoff = holdoff
+        self.cooldown = cooldown
+        self.retry_blocked = retry_blocked
+        self.bucket = TokenBucket(rate, burst)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.events = Counter()
+        self._last_decrease = float("-inf")
+        self._condition = None
+
+    def _cond(self):
+        # Created lazily so that it belongs to the running event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Hold a request slot and a rate token for the duration of a request."""
+        cond = self._cond()
+        async with cond:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(cond.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                elif self.in_flight < int(self.limit):
+                    break
+                else:
+                    await cond.wait()
+            self.in_flight += 1
+
+        try:
+            await self.bucket.acquire()
+            yield
+        finally:
+            async with cond:
+                self.in_flight -= 1
+                cond.notify_all()
+
+    def success(self):
+        """Additive increase after a normal answer from the service."""
+        self.events["success"] += 1
+        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+        self.bucket.rate = min(self.max_rate, self.bucket.rate + 1.0 / self.bucket.rate)
+
+    def congestion(self, kind):
+        """Multiplicative decrease (and, for a block, a pause) after a congestion signal."""
+        self.events[kind] += 1
+        now = time.monotonic()
+        if kind == BLOCKED:
+            self.limit = float(self.minimum)
+            self.bucket.rate = self.min_rate
+            self.paused_until = max(self.paused_until, now + self.cooldown)
+            self._last_decrease = now
+            return
+        if now - self._last_decrease < self.holdoff:
+            return
+        self.limit = max(float(self.minimum), self.limit * self.decrease)
+        self.bucket.rate = max(self.min_rate, self.bucket.rate * self.decrease)
+        self._last_decrease = now
+
+    def report(self):
+        """Return the current limits and the count of each signal received."""
+        return {"limit": int(self.limit), "rate": round(self.bucket.rate, 2), "events": dict(self.events)}
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent SQLite journal of CSRS-PPP jobs.
+
+Every RINEX file is recorded with its content hash, the submit parameters,
+the keyid, each status transition with its time, and the result paths. When
+an interrupted batch is restarted, jobs that already completed are skipped
+and jobs that were submitted but not collected re-attach to their keyid
+instead of being uploaded and processed again.
+
+A job is identified by the RINEX file name, its content hash and the
+parameters, so moving a RINEX file to another directory does not cause it to
+be re-processed, while a modified file is.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import namedtuple
+
+# Job statuses
+PENDING = "pending"
+SUBMITTED = "submitted"
+DONE = "done"            # CSRS-PPP finished processing; results not collected yet
+COMPLETE = "complete"    # results saved (or emailed)
+FAILED = "failed"
+BLOCKED = "blocked"
+
+# Jobs with a keyid worth re-attaching to
+IN_FLIGHT = (SUBMITTED, DONE)
+
+JournalEntry = namedtuple("JournalEntry", ["id", "rinex_file", "rinex_name", "content_hash", "params", "keyid", "status",
+                                           "submitted_at", "done_at", "completed_at", "outputs", "error"])
+JournalEntry.__doc__ = "One job of the journal; times are UNIX timestamps and outputs a list of paths."
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    rinex_file TEXT NOT NULL,
+    rinex_name TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    keyid TEXT,
+    status TEXT NOT NULL,
+    submitted_at REAL,
+    done_at REAL,
+    completed_at REAL,
+    outputs TEXT NOT NULL DEFAULT '[]',
+    error TEXT,
+    UNIQUE (rinex_name, content_hash, params)
+);
+CREATE TABLE IF NOT EXISTS transitions (
+    job_id INTEGER NOT NULL REFERENCES jobs (id),
+    status TEXT NOT NULL,
+    at REAL NOT NULL
+);
+"""
+
+# Timestamp column set when a job enters a status
+_STATUS_TIMES = {SUBMITTED: "submitted_at", DONE: "done_at", COMPLETE: "completed_at"}
+
+
+def content_hash(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def encode_params(params):
+    """Serialise submit parameters to a canonical string."""
+    return json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+
+class JobJournal:
+    """
+    SQLite journal shared by the jobs of one or more batches.
+
+    The database uses write-ahead logging and a busy timeout, so several
+    processes (e.g. csrs_ppp_auto.py runs started by csrs_ppp_batch.py) can
+    share one journal file.
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def _entry(self, row):
+        if row is None:
+            return None
+        row = list(row)
+        row[4] = json.loads(row[4])
+        row[10] = json.loads(row[10])
+        return JournalEntry(*row)
+
+    def find(self, rinex_name, digest, params):
+        """Return the JournalEntry of a file name, content hash and parameters, or None."""
+        row = self._db.execute("SELECT * FROM jobs WHERE rinex_name = ? AND content_hash = ? AND params = ?",
+                               (rinex_name, digest, encode_params(params))).fetchone()
+        return self._entry(row)
+
+    def get(self, job_id):
+        return self._entry(self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def start(self, rinex_file, digest, params):
+        """
+        Return the JournalEntry for a job, creating it as pending if new.
+
+        The recorded path is updated if the file has moved.
+        """
+        rinex_name = os.path.basename(rinex_file)
+        encoded = encode_params(params)
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.execute("INSERT OR IGNORE INTO jobs (rinex_file, rinex_name, content_hash, params, status) "
+                             "VALUES (?, ?, ?, ?, ?)", (rinex_file, rinex_name, digest, encoded, PENDING))
+            self._db.execute("UPDATE jobs SET rinex_file = ? WHERE rinex_name = ? AND content_hash = ? AND params = ?",
+                             (rinex_file, rinex_name, digest, encoded))
+        return self.find(rinex_name, digest, params)
+
+    def set_status(self, job_id, status, keyid=None, outputs=None, error=None):
+        """Record a status transition, with the keyid, result paths or error if given."""
+        now = time.time()
+        assignments = ["status = ?", "error = ?"]
+        values = [status, error]
+        if keyid is not None:
+            assignments.append("keyid = ?")
+            values.append(keyid)
+        if outputs is not None:
+            assignments.append("outputs = ?")
+            values.append(json.dumps(outputs))
+        if status in _STATUS_TIMES:
+            assignments.append("{0:s} = ?".format(_STATUS_TIMES[status]))
+            values.append(now)
+
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.execute("UPDATE jobs SET {0:s} WHERE id = ?".format(", ".join(assignments)), values + [job_id])
+            self._db.execute("INSERT INTO transitions (job_id, status, at) VALUES (?, ?, ?)", (job_id, status, now))
+
+    def transitions(self, job_id):
+        """Return the (status, time) transitions of a job in order."""
+        return self._db.execute("SELECT status, at FROM transitions WHERE job_id = ? ORDER BY rowid",
+                                (job_id,)).fetchall()
+
+    def entries(self, status=None):
+        """Return every JournalEntry, optionally only those with a given status."""
+        if status is None:
+            rows = self._db.execute("SELECT * FROM jobs ORDER BY id")
+        else:
+            rows = self._db.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id", (status,))
+        return [self._entry(row) for row in rows]
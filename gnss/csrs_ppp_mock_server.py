@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the CSRS-PPP web service.
+
+Serves the submit, status and file endpoints used by csrs_ppp_client.py so
+that batches, retries and throughput can be exercised offline. Jobs reach
+"Status=done" after a configurable processing latency, and result archives
+are synthetic: a .sum, a .pdf and a .csv of positions with the columns of
+the CSRS-PPP output, one row per epoch (kinematic) or a single row (static).
+
+Errors can be injected at random: HTML "DOCTYPE" pages instead of a keyid or
+status, "ERROR [002]" (temporary block) on submission, and truncated result
+archives.
+
+Example:
+
+    python3 csrs_ppp_mock_server.py --port 8080 --latency 20 --doctype 0.05 --truncated 0.05
+    python3 csrs_ppp_batch.py --domain http://127.0.0.1:8080 --input_path RINEX/ --output_path ppp/
+
+The client also reads the base URL from the CSRS_PPP_DOMAIN environment
+variable.
+"""
+
+import argparse
+import calendar
+import email.parser
+import email.policy
+import gzip
+import io
+import itertools
+import logging
+import math
+import random
+import threading
+import time
+import zipfile
+from collections import Counter, namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger("csrs_ppp.mock")
+
+SUBMIT_PATH = "/CSRS-PPP/service/submit"
+STATUS_PATH = "/CSRS-PPP/service/results/status"
+FILE_PATH = "/CSRS-PPP/service/results/file"
+
+DOCTYPE_PAGE = (b"<!DOCTYPE html>\n<html><head><title>Service unavailable</title></head>"
+                b"<body><p>The service is temporarily unavailable.</p></body></html>\n")
+BLOCKED_TEXT = b"ERROR [002]"
+
+# Columns of the position CSV in a result archive
+CSV_COLUMNS = ("latitude_decimal_degree", "longitude_decimal_degree", "ellipsoidal_height_m", "decimal_hour",
+               "day_of_year", "year", "rcvr_clk_ns")
+
+MockConfig = namedtuple("MockConfig", ["latency", "jitter", "doctype", "blocked", "truncated", "interval", "epochs"],
+                        defaults=[5.0, 0.0, 0.0, 0.0, 0.0, 30.0, 2880])
+MockConfig.__doc__ = ("Behaviour of the mock service: latency and jitter (s) of processing, probabilities of "
+                      "injected DOCTYPE pages, blocks and truncated archives, and the epoch interval (s) and "
+                      "number of epochs of kinematic results.")
+
+MockJob = namedtuple("MockJob", ["keyid", "rinex_name", "fields", "first_obs", "ready_at"])
+MockJob.__doc__ = "One submission held by the mock service."
+
+
+# -----------------------------------------------------------------------------
+# Synthetic results
+# -----------------------------------------------------------------------------
+
+def parse_form(content_type, body):
+    """Return the fields and the uploaded (file name, bytes) of a multipart/form-data body."""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    fields, upload = {}, (None, b"")
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True) or b""
+        if part.get_filename():
+            upload = (part.get_filename(), payload)
+        else:
+            fields[name] = payload.decode("utf-8", errors="replace")
+    return fields, upload
+
+
+def first_obs_time(upload_name, data):
+    """
+    Return the TIME OF FIRST OBS of an uploaded RINEX file as a UNIX time.
+
+    Gzipped uploads are decompressed; the current time is returned when the
+    header cannot be read.
+    """
+    if upload_name.lower().endswith(".gz"):
+        try:
+            data = gzip.decompress(data)
+        except (OSError, EOFError):
+            return time.time()
+    for line in data[:64 * 1024].decode("ascii", errors="replace").splitlines():
+        if "TIME OF FIRST OBS" in line:
+            try:
+                values = line[:43].split()
+                year, month, day, hour, minute = (int(v) for v in values[:5])
+                second = float(values[5])
+                return calendar.timegm((year, month, day, hour, minute, 0)) + second
+            except (ValueError, IndexError):
+                break
+        if "END OF HEADER" in line:
+            break
+    return time.time()
+
+
+def synthetic_csv(job, config):
+    """Return the position CSV of a job: a station moving at constant velocity plus centimetre noise."""
+    rng = random.Random(job.rinex_name)
+    lat0 = rng.uniform(75.0, 82.0)
+    lon0 = rng.uniform(-95.0, -60.0)
+    h0 = rng.uniform(50.0, 1500.0)
+    speed = rng.uniform(0.0, 2e-4)   # m/s, tens of metres per year
+    heading = rng.uniform(0.0, 2 * math.pi)
+    offset = rng.uniform(0.0, 86400.0 * 365)
+
+    if job.fields.get("process_type") == "Static":
+        epochs = [job.first_obs]
+    else:
+        epochs = [job.first_obs + i * config.interval for i in range(config.epochs)]
+
+    lines = [",".join(CSV_COLUMNS)]
+    for t in epochs:
+        elapsed = t - job.first_obs + offset
+        north = speed * elapsed * math.cos(heading) + rng.gauss(0.0, 0.02)
+        east = speed * elapsed * math.sin(heading) + rng.gauss(0.0, 0.02)
+        lat = lat0 + north / 111320.0
+        lon = lon0 + east / (111320.0 * math.cos(math.radians(lat0)))
+        tm = time.gmtime(t)
+        decimal_hour = tm.tm_hour + tm.tm_min / 60.0 + (t % 60) / 3600.0
+        lines.append("{0:.9f},{1:.9f},{2:.4f},{3:.6f},{4:d},{5:d},{6:.3f}".format(
+            lat, lon, h0 + rng.gauss(0.0, 0.05), decimal_hour, tm.tm_yday, tm.tm_year, rng.gauss(0.0, 50.0)))
+    return "\n".join(lines) + "\n"
+
+
+def result_zip(job, config):
+    """Return the bytes of the full_output.zip of a job."""
+    summary = "\n".join([
+        "CSRS-PPP mock service",
+        "KEYID {0:s}".format(job.keyid),
+        "RINEX {0:s}".format(job.rinex_name),
+        "MODE {0:s}".format(job.fields.get("process_type", "")),
+        "REFERENCE FRAME {0:s}".format(job.fields.get("sysref", "")),
+        "EPOCH {0:s}".format(job.fields.get("nad83_epoch", "")),
+        "VERTICAL DATUM {0:s}".format(job.fields.get("v_datum", "")),
+    ]) + "\n"
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr("{0:s}.sum".format(job.rinex_name), summary)
+        zip_ref.writestr("{0:s}.pdf".format(job.rinex_name), b"%PDF-1.4\n%mock\n%%EOF\n")
+        zip_ref.writestr("{0:s}.csv".format(job.rinex_name), synthetic_csv(job, config))
+    return buffer.getvalue()
+
+
+def residual_zip(job, fid):
+    """Return the bytes of the residuals archive fid of a job."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr("{0:s}_{1:02d}.res".format(job.rinex_name, fid), "mock residuals\n")
+    return buffer.getvalue()
+
+
+# -----------------------------------------------------------------------------
+# Server
+# -----------------------------------------------------------------------------
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Request handler of the submit, status and file endpoints."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def _send(self, body, content_type="text/plain; charset=utf-8", status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlsplit(self.path).path != SUBMIT_PATH:
+            self._send(b"Not found", status=404)
+            return
+        self._send(self.server.submit(self.headers.get("Content-Type", ""), body))
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == STATUS_PATH:
+            self._send(self.server.status(query.get("id", "")))
+        elif url.path == FILE_PATH:
+            body = self.server.file(query.get("id", ""), query.get("fid"))
+            if body is None:
+                self._send(b"Not found", status=404)
+            else:
+                self._send(body, "application/zip")
+        else:
+            self._send(b"Not found", status=404)
+
+
+class MockCSRSPPPServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server emulating CSRS-PPP.
+
+    Parameters
+    ----------
+    address : tuple
+        (host, port) to listen on; port 0 picks a free port.
+    config : MockConfig
+        Latency and error injection settings.
+    seed : int
+        Seed of the random error injection.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), config=None, seed=None):
+        super().__init__(address, MockHandler)
+        self.config = config or MockConfig()
+        self.jobs = {}
+        self.counts = Counter()
+        self._random = random.Random(seed)
+        self._keyids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        """Base URL to use as the client domain."""
+        host, port = self.server_address[:2]
+        return "http://{0:s}:{1:d}".format(host, port)
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _inject(self, probability, name):
+        with self._lock:
+            injected = self._random.random() < probability
+            if injected:
+                self.counts[name] += 1
+            return injected
+
+    def submit(self, content_type, body):
+        """Register a submission and return its keyid (or an injected error)."""
+        self._count("submit")
+        if self._inject(self.config.doctype, "doctype"):
+            return DOCTYPE_PAGE
+        if self._inject(self.config.blocked, "blocked"):
+            return BLOCKED_TEXT
+
+        fields, (upload_name, data) = parse_form(content_type, body)
+        if not upload_name:
+            return b"ERROR [001] No RINEX file"
+        rinex_name = upload_name
+        for suffix in (".gz", ".crx", ".obs", ".zip"):
+            if rinex_name.lower().endswith(suffix):
+                rinex_name = rinex_name[:-len(suffix)]
+        delay = max(0.0, self.config.latency + self._random.uniform(-1, 1) * self.config.jitter)
+
+        with self._lock:
+            keyid = "MOCK{0:08d}".format(next(self._keyids))
+            self.jobs[keyid] = MockJob(keyid, rinex_name, fields, first_obs_time(upload_name, data),
+                                       time.monotonic() + delay)
+        return keyid.encode()
+
+    def status(self, keyid):
+        """Return the status page of a job."""
+        self._count("status")
+        if self._inject(self.config.doctype, "doctype"):
+            return DOCTYPE_PAGE
+        job = self.jobs.get(keyid)
+        if job is None:
+            return b"Status=error"
+        if time.monotonic() < job.ready_at:
+            return b"Status=processing"
+        return b"Status=done"
+
+    def file(self, keyid, fid=None):
+        """Return the result (or residuals) archive of a finished job, possibly truncated."""
+        self._count("file")
+        job = self.jobs.get(keyid)
+        if job is None or time.monotonic() < job.ready_at:
+            return None
+        body = result_zip(job, self.config) if fid is None else residual_zip(job, int(fid))
+        if self._inject(self.config.truncated, "truncated"):
+            body = body[:len(body) // 2]
+        return body
+
+    def start(self):
+        """Serve in a daemon thread and return the thread; stop with shutdown()."""
+        thread = threading.Thread(target=self.serve_forever, name="csrs_ppp_mock", daemon=True)
+        thread.start()
+        return thread
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Local mock of the CSRS-PPP web service")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on (default=127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on (default=8080)")
+    parser.add_argument("--latency", type=float, default=5.0, help="Processing time of a job in seconds (default=5)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- jitter of the latency in seconds")
+    parser.add_argument("--doctype", type=float, default=0.0,
+                        help="Probability of answering a submit or status request with a DOCTYPE page")
+    parser.add_argument("--blocked", type=float, default=0.0,
+                        help="Probability of answering a submission with ERROR [002]")
+    parser.add_argument("--truncated", type=float, default=0.0,
+                        help="Probability of sending a truncated result archive")
+    parser.add_argument("--interval", type=float, default=30.0, help="Epoch interval of kinematic results (s)")
+    parser.add_argument("--epochs", type=int, default=2880, help="Number of epochs of kinematic results")
+    parser.add_argument("--seed", type=int, help="Seed of the error injection")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(format="%(asctime)s %(message)s", datefmt="%H:%M:%S", level=logging.INFO)
+
+    config = MockConfig(latency=args.latency, jitter=args.jitter, doctype=args.doctype, blocked=args.blocked,
+                        truncated=args.truncated, interval=args.interval, epochs=args.epochs)
+    server = MockCSRSPPPServer((args.host, args.port), config, args.seed)
+    logger.info("=> Mock CSRS-PPP serving at {0:s}".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info("=> Requests: {0:s}".format(
+            ", ".join("{0:s}: {1:d}".format(k, v) for k, v in sorted(server.counts.items()))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Adaptive status polling for CSRS-PPP jobs.
+
+PollScheduler replaces the fixed 10 s sleep between status requests. Polls
+start fast and back off exponentially with jitter, so small files are picked
+up quickly and a large batch does not hit the server in lockstep. The
+scheduler also learns how long jobs take for a given processing mode and file
+size, and waits most of that time before the first poll of similar jobs.
+"""
+
+import json
+import math
+import random
+from collections import namedtuple
+
+PollRecord = namedtuple("PollRecord", ["rinex_file", "mode", "size", "time_to_done", "polls"])
+PollRecord.__doc__ = "Time from submission to 'done' (seconds) and number of status polls for one job."
+
+
+def size_bucket(size):
+    """Group file sizes by powers of two (in MiB)."""
+    return max(int(math.log2(max(size, 1) / 2 ** 20)) + 1, 0)
+
+
+class PollScheduler:
+    """
+    Exponential backoff with jitter, seeded by learned processing times.
+
+    Parameters
+    ----------
+    first : float
+        First delay in seconds when nothing is known about similar jobs.
+    factor : float
+        Growth factor between consecutive delays.
+    max_delay : float
+        Upper limit of a single delay in seconds.
+    jitter : float
+        Relative jitter applied to every delay (0.25 is +/-25 %).
+    lead : float
+        Fraction of the expected processing time to wait before the first
+        poll of a job whose mode and size have been seen before.
+    alpha : float
+        Weight of the newest observation in the learned processing time.
+    """
+
+    def __init__(self, first=2.0, factor=1.6, max_delay=60.0, jitter=0.25, lead=0.8, alpha=0.3, seed=None):
+        self.first = first
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.lead = lead
+        self.alpha = alpha
+        self.records = []
+        self._expected = {}
+        self._random = random.Random(seed)
+
+    def _jittered(self, delay):
+        return delay * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def expected(self, mode, size):
+        """Return the learned processing time (s) for a mode and file size, or None."""
+        bucket = size_bucket(size)
+        known = [b for (m, b) in self._expected if m == mode]
+        if not known:
+            return None
+        nearest = min(known, key=lambda b: abs(b - bucket))
+        return self._expected[(mode, nearest)]
+
+    def delays(self, mode, size):
+        """Yield the successive delays (s) to wait between status polls of a job."""
+        expected = self.expected(mode, size)
+        if expected is not None and self.lead * expected > self.first:
+            yield self._jittered(self.lead * expected)
+
+        delay = self.first
+        while True:
+            yield self._jittered(delay)
+            delay = min(delay * self.factor, self.max_delay)
+
+    def record(self, rinex_file, mode, size, time_to_done, polls):
+        """Store the outcome of a job and update the learned processing time."""
+        self.records.append(PollRecord(rinex_file, mode, size, time_to_done, polls))
+        key = (mode, size_bucket(size))
+        if key in self._expected:
+            self._expected[key] += self.alpha * (time_to_done - self._expected[key])
+        else:
+            self._expected[key] = time_to_done
+
+    def report(self):
+        """
+        Summarise the recorded jobs per mode and size bucket.
+
+        Returns a list of (mode, bucket upper size in MiB, jobs, mean time to
+        done, maximum time to done, mean polls).
+        """
+        groups = {}
+        for record in self.records:
+            groups.setdefault((record.mode, size_bucket(record.size)), []).append(record)
+
+        rows = []
+        for (mode, bucket), records in sorted(groups.items()):
+            times = [r.time_to_done for r in records]
+            rows.append((mode, 2 ** bucket, len(records), sum(times) / len(times), max(times),
+                         sum(r.polls for r in records) / len(records)))
+        return rows
+
+    def load(self, path):
+        """Load learned processing times saved by save()."""
+        with open(path) as f:
+            for mode, bucket, seconds in json.load(f):
+                self._expected[(mode, bucket)] = seconds
+
+    def save(self, path):
+        """Save the learned processing times as JSON."""
+        with open(path, "w") as f:
+            json.dump([[mode, bucket, seconds] for (mode, bucket), seconds in sorted(self._expected.items())], f)
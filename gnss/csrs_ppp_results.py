@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Download and unpack CSRS-PPP result archives without intermediate copies.
+
+A result zip is streamed from the HTTP response into a spooled temporary file
+(in memory while small), checked with testzip() there, and only the wanted
+members are written, each straight into the results directory through a
+temporary file and an atomic rename. Readers of the results directory never
+see a partially written file.
+"""
+
+import functools
+import os
+import tempfile
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+
+# Archives larger than this are spooled to disk instead of memory
+SPOOL_SIZE = 32 * 1024 * 1024
+
+
+@functools.lru_cache(maxsize=None)
+def _umask():
+    """
+    Return the process umask without setting it (os.umask would change it for
+    every thread): from /proc on Linux, otherwise from the mode of a probe
+    file.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except OSError:
+        pass
+    directory = tempfile.mkdtemp()
+    try:
+        probe = os.path.join(directory, "probe")
+        os.close(os.open(probe, os.O_WRONLY | os.O_CREAT, 0o777))
+        return 0o777 & ~os.stat(probe).st_mode
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+
+def download_spool(response, chunk_size=CHUNK_SIZE, spool_size=SPOOL_SIZE):
+    """
+    Copy a streamed Requests response into a SpooledTemporaryFile.
+
+    The response is closed; the returned file is positioned at its start and
+    must be closed by the caller.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    try:
+        with response:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                spool.write(chunk)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+def atomic_write(path, source, chunk_size=CHUNK_SIZE):
+    """Copy a file object to path through a temporary file in the same directory."""
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=".{0:s}.".format(name), dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # Temporary files are created private; results get the usual umask permissions
+            os.fchmod(f.fileno(), 0o666 & ~_umask())
+            for chunk in iter(lambda: source.read(chunk_size), b""):
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
+
+
+def check_zip(fileobj):
+    """
+    Raise zipfile.BadZipFile unless fileobj holds a complete, valid zip archive.
+
+    The file is left positioned at its start.
+    """
+    try:
+        with zipfile.ZipFile(fileobj) as zip_ref:
+            bad_member = zip_ref.testzip()
+    finally:
+        fileobj.seek(0)
+    if bad_member is not None:
+        raise zipfile.BadZipFile("Bad CRC for member {0:s}".format(bad_member))
+
+
+def save_results(spool, results_dir, result_name, suffixes=(".sum", ".pdf")):
+    """
+    Write the members of a checked result archive ending in suffixes, and the
+    archive itself as result_name, into results_dir.
+
+    Returns the paths written, members first.
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    outputs = []
+    with zipfile.ZipFile(spool) as zip_ref:
+        for info in zip_ref.infolist():
+            if info.is_dir() or not info.filename.lower().endswith(suffixes):
+                continue
+            with zip_ref.open(info) as member:
+                outputs.append(atomic_write(os.path.join(results_dir, os.path.basename(info.filename)), member))
+
+    spool.seek(0)
+    outputs.append(atomic_write(os.path.join(results_dir, result_name), spool))
+    return outputs
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pooled HTTP session shared by every CSRS-PPP call.
+
+A single Requests session with keep-alive connection pools per host, so that
+the submit, status and download requests of many jobs reuse a handful of
+TCP+TLS connections instead of opening one per request. Connection errors are
+retried by urllib3 before they reach the caller.
+"""
+
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+ConnectionStats = namedtuple("ConnectionStats", ["requests", "opened", "reused"])
+ConnectionStats.__doc__ = "Requests made, connections opened and requests served on a reused connection."
+
+
+class PooledSession:
+    """
+    Thread-safe keep-alive session for the CSRS-PPP service.
+
+    Parameters
+    ----------
+    pool_size : int
+        Maximum number of connections kept open per host. Callers block when
+        all of them are busy rather than opening extra connections.
+    retries : int
+        Number of retries on connection errors (and on read errors of
+        idempotent requests).
+    backoff_factor : float
+        Backoff between retries, in seconds (urllib3 semantics).
+    """
+
+    def __init__(self, pool_size=32, retries=3, backoff_factor=0.5):
+        self.pool_size = pool_size
+        retry = Retry(total=retries, connect=retries, read=retries, status=0, other=0,
+                      backoff_factor=backoff_factor, raise_on_status=False)
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry,
+                                    pool_block=True)
+        self.session = requests.Session()
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close every pooled connection."""
+        self.session.close()
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def host_stats(self):
+        """Return ConnectionStats per (scheme, host, port) connection pool."""
+        stats = {}
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened = pool.num_connections
+            stats[(key.key_scheme, key.key_host, key.key_port)] = ConnectionStats(
+                pool.num_requests, opened, max(pool.num_requests - opened, 0))
+        return stats
+
+    def stats(self):
+        """Return ConnectionStats summed over every host."""
+        totals = [0, 0, 0]
+        for host in self.host_stats().values():
+            totals = [a + b for a, b in zip(totals, host)]
+        return ConnectionStats(*totals)
+
+    def stats_since(self, snapshot):
+        """Return the ConnectionStats accumulated since an earlier stats() snapshot."""
+        return ConnectionStats(*(a - b for a, b in zip(self.stats(), snapshot)))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming, compressed uploads of RINEX observation files to CSRS-PPP.
+
+CSRS-PPP accepts gzip and Hatanaka (compact RINEX) compressed observation
+files. prepare_upload compresses a file once, chunk by chunk, into a spooled
+temporary file (kept in memory while small, spilled to disk when large) and
+hands MultipartEncoder a stream over it, so the whole observation file is
+never held in memory and every re-submission reuses the same compressed
+bytes. An optional rinex_filter.RinexFilter decimates, windows and thins the
+observations on the way into the compressor.
+"""
+
+import gzip
+import os
+import shutil
+import subprocess
+import tempfile
+from contextlib import ExitStack, contextmanager
+
+from rinex_filter import filter_rinex, is_active
+
+# Suffixes of files that are already compressed and are uploaded as they are
+COMPRESSED_SUFFIXES = (".z", ".gz", ".zip", ".bz2", ".crx")
+
+CHUNK_SIZE = 1024 * 1024
+
+# Compressed uploads larger than this are spooled to disk instead of memory
+SPOOL_SIZE = 16 * 1024 * 1024
+
+
+class UploadStream:
+    """
+    File-like upload body of known length for MultipartEncoder.
+
+    MultipartEncoder needs the number of bytes left to read (len) and a
+    read() method; exposing fileno() would force a spooled file to disk.
+    """
+
+    def __init__(self, fileobj, size):
+        self._fileobj = fileobj
+        self.size = size
+
+    @property
+    def len(self):
+        return self.size - self._fileobj.tell()
+
+    def read(self, length=-1):
+        return self._fileobj.read(length)
+
+    def rewind(self):
+        """Go back to the start, before (re-)submitting."""
+        self._fileobj.seek(0)
+
+
+def hatanaka_name(name):
+    """Return the compact RINEX name of an observation file (ALGO2390.15o -> ALGO2390.15d)."""
+    stem, suffix = os.path.splitext(name)
+    if len(suffix) == 4 and suffix[1:3].isdigit() and suffix[3].lower() == "o":
+        return stem + suffix[:3] + "d"
+    return stem + ".crx"
+
+
+def _copy_chunks(source, target, chunk_size):
+    for chunk in iter(lambda: source.read(chunk_size), b""):
+        target.write(chunk)
+
+
+@contextmanager
+def prepare_upload(rinex_file, compression="gzip", chunk_size=CHUNK_SIZE, spool_size=SPOOL_SIZE, rinex_filter=None):
+    """
+    Yield (upload name, UploadStream) for a RINEX file.
+
+    compression is "gzip", "hatanaka" (rnx2crx, then gzip) or "none". Files
+    that are already compressed are always uploaded as they are, and
+    "hatanaka" falls back to gzip when rnx2crx is not installed. Every file
+    handle is closed when the context exits.
+
+    rinex_filter (a rinex_filter.RinexFilter) is applied to plain and gzip
+    compressed observation files; other compressed files are uploaded
+    unfiltered.
+    """
+    name = os.path.basename(rinex_file)
+    if is_active(rinex_filter) and name.lower().endswith(".gz"):
+        name = name[:-3]
+        opener = gzip.open
+    else:
+        opener = open
+        if name.lower().endswith(COMPRESSED_SUFFIXES):
+            compression = "none"
+            rinex_filter = None
+    if compression == "hatanaka" and shutil.which("rnx2crx") is None:
+        compression = "gzip"
+
+    if compression == "none" and not is_active(rinex_filter):
+        with open(rinex_file, "rb") as f:
+            yield name, UploadStream(f, os.fstat(f.fileno()).st_size)
+        return
+
+    with ExitStack() as stack:
+        f = stack.enter_context(opener(rinex_file, "rb"))
+        spool = stack.enter_context(tempfile.SpooledTemporaryFile(max_size=spool_size))
+
+        if compression == "none":
+            filter_rinex(f, spool, rinex_filter)
+            size = spool.tell()
+            spool.seek(0)
+            yield name, UploadStream(spool, size)
+            return
+
+        if compression == "hatanaka" and is_active(rinex_filter):
+            # rnx2crx reads from a file descriptor: filter into an unnamed file first
+            filtered = stack.enter_context(tempfile.TemporaryFile())
+            filter_rinex(f, filtered, rinex_filter)
+            filtered.seek(0)
+            f = filtered
+
+        with gzip.GzipFile(filename="", mode="wb", fileobj=spool, mtime=0) as gz:
+            if compression == "hatanaka":
+                name = hatanaka_name(name)
+                with subprocess.Popen(["rnx2crx", "-"], stdin=f, stdout=subprocess.PIPE) as crx:
+                    _copy_chunks(crx.stdout, gz, chunk_size)
+                if crx.returncode != 0:
+                    raise OSError("rnx2crx failed with exit code {0:d} [{1:s}]".format(crx.returncode, rinex_file))
+            elif is_active(rinex_filter):
+                filter_rinex(f, gz, rinex_filter)
+            else:
+                _copy_chunks(f, gz, chunk_size)
+
+        size = spool.tell()
+        spool.seek(0)
+        yield name + ".gz", UploadStream(spool, size)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time-aligned comparison of two sets of CSRS-PPP solutions.
+
+Two solution sets (static and kinematic, daily mean and final, ...) are
+joined on their epochs rather than on row position: every epoch of a is
+matched to the nearest epoch of b within a tolerance (a sorted search, as
+pandas.merge_asof with direction="nearest"). Both sets are projected once to
+local east, north, up metres about the first matched position of b
+(ppp_projection.to_enu), and for each matched pair the difference a - b is
+computed on NumPy arrays in one pass:
+
+    east_m, north_m, up_m     a - b
+    distance_m, azimuth_deg   horizontal distance and direction from b to a
+                              in the local frame of the first b position
+    geodesic_m,               WGS84 geodesic distance and forward azimuth
+    geodesic_azimuth_deg      from b to a (one vectorized Geod.inv call)
+    <column>_delta            a - b of any other column
+
+The local frame is a tangent plane at the height of the first b position:
+its distances exceed the geodesic ones (on the ellipsoid) by about height /
+6371 km, 16 ppm at 100 m, and its directions differ from the geodesic
+azimuths by the meridian convergence.
+
+daily_summary reduces the pairs to one row per day (count, mean and standard
+deviation of the ENU deltas, horizontal RMS, median and maximum distance).
+
+Example:
+
+    python3 ppp_compare.py lowell_corner_kinematic.csv lowell_corner_static.csv lowell_corner_delta.csv \
+        --tolerance 0.5
+"""
+
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+from ppp_projection import azimuth, geodesic, to_enu
+from ppp_store import load_station
+
+LATITUDE = "latitude_decimal_degree"
+LONGITUDE = "longitude_decimal_degree"
+HEIGHT = "ellipsoidal_height_m"
+
+
+def match(times_a, times_b, tolerance=0):
+    """
+    Match every time of a to the nearest time of b.
+
+    Parameters
+    ----------
+    times_a, times_b : array of datetime64
+        Epochs; they need not be sorted.
+    tolerance : float
+        Largest time difference of a pair, in seconds.
+
+    Returns
+    -------
+    Indices (ia, ib) of the matched pairs in times_a and times_b, in order
+    of time of a.
+    """
+    ta = np.asarray(times_a, dtype="datetime64[ns]").astype(np.int64)
+    tb = np.asarray(times_b, dtype="datetime64[ns]").astype(np.int64)
+    if len(ta) == 0 or len(tb) == 0:
+        return np.array([], dtype=np.intp), np.array([], dtype=np.intp)
+    order_a = np.argsort(ta, kind="stable")
+    order_b = np.argsort(tb, kind="stable")
+    ta, tb = ta[order_a], tb[order_b]
+
+    j = np.searchsorted(tb, ta)
+    left = np.clip(j - 1, 0, len(tb) - 1)
+    right = np.clip(j, 0, len(tb) - 1)
+    nearest = np.where(np.abs(tb[right] - ta) < np.abs(ta - tb[left]), right, left)
+    ok = np.abs(tb[nearest] - ta) <= int(round(tolerance * 1e9))
+    return order_a[ok], order_b[nearest[ok]]
+
+
+def compare(a, b, on="datetime", tolerance=0, columns=()):
+    """
+    Join two solution sets on time and return the differences a - b.
+
+    Parameters
+    ----------
+    a, b : DataFrame
+        Solutions with latitude and longitude columns, the on column and
+        optionally ellipsoidal_height_m (0 if absent).
+    on : str
+        Time column: "datetime" for epochs, "date" for daily solutions
+        (datetime64, Timestamp or datetime.date values).
+    tolerance : float
+        Largest time difference of a pair, in seconds.
+    columns : list of str
+        Other columns of both sets returned as <column>_a, <column>_b and
+        <column>_delta.
+
+    Returns
+    -------
+    DataFrame with the time of a (datetime64), dt_s (time of b - time of
+    a), distance_m, azimuth_deg, east_m, north_m, up_m, geodesic_m and
+    geodesic_azimuth_deg, and the columns requested.
+    """
+    times_a = pd.to_datetime(a[on]).to_numpy(dtype="datetime64[ns]")
+    times_b = pd.to_datetime(b[on]).to_numpy(dtype="datetime64[ns]")
+    ia, ib = match(times_a, times_b, tolerance)
+
+    def values(df, name, index):
+        if name not in df.columns:
+            return np.zeros(len(index))
+        return df[name].to_numpy(dtype=np.float64)[index]
+
+    lat_a, lon_a, h_a = values(a, LATITUDE, ia), values(a, LONGITUDE, ia), values(a, HEIGHT, ia)
+    lat_b, lon_b, h_b = values(b, LATITUDE, ib), values(b, LONGITUDE, ib), values(b, HEIGHT, ib)
+    reference = (lat_b[0], lon_b[0], h_b[0]) if len(ib) else None
+    east_a, north_a, up_a = to_enu(lat_a, lon_a, h_a, reference)
+    east_b, north_b, up_b = to_enu(lat_b, lon_b, h_b, reference)
+    east, north, up = east_a - east_b, north_a - north_b, up_a - up_b
+    geodesic_m, geodesic_azimuth = geodesic(lat_b, lon_b, lat_a, lon_a)
+    time_a = times_a[ia]
+
+    result = {
+        on: time_a,
+        "dt_s": (times_b[ib] - time_a) / np.timedelta64(1, "s"),
+        "distance_m": np.hypot(east, north),
+        "azimuth_deg": azimuth(east, north),
+        "east_m": east,
+        "north_m": north,
+        "up_m": up,
+        "geodesic_m": geodesic_m,
+        "geodesic_azimuth_deg": geodesic_azimuth,
+    }
+    for name in columns:
+        result[name + "_a"] = a[name].to_numpy()[ia]
+        result[name + "_b"] = b[name].to_numpy()[ib]
+        result[name + "_delta"] = result[name + "_a"] - result[name + "_b"]
+    return pd.DataFrame(result)
+
+
+def daily_summary(pairs, on="datetime"):
+    """Return per-day statistics of the pairs of compare."""
+    day = pairs[on].dt.floor("D").rename("date")
+    horizontal2 = pairs["east_m"] ** 2 + pairs["north_m"] ** 2
+    grouped = pairs.assign(horizontal2_m2=horizontal2).groupby(day)
+    summary = grouped.agg(epochs=("distance_m", "size"),
+                          east_mean_m=("east_m", "mean"), east_std_m=("east_m", "std"),
+                          north_mean_m=("north_m", "mean"), north_std_m=("north_m", "std"),
+                          up_mean_m=("up_m", "mean"), up_std_m=("up_m", "std"),
+                          horizontal_rms_m=("horizontal2_m2", "mean"),
+                          distance_median_m=("distance_m", "median"), distance_max_m=("distance_m", "max"))
+    summary["horizontal_rms_m"] = np.sqrt(summary["horizontal_rms_m"])
+    return summary.reset_index()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Compare two sets of CSRS-PPP solutions epoch by epoch")
+    parser.add_argument("a", help="Merged CSV of the first solutions (its Parquet store is used if there is one)")
+    parser.add_argument("b", help="Merged CSV of the second solutions")
+    parser.add_argument("output", help="CSV of the daily statistics of a - b")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="Largest time difference of matched epochs in seconds (default=0.5)")
+    parser.add_argument("--start", type=str, help="First date compared (YYYY-MM-DD)")
+    parser.add_argument("--end", type=str, help="End date (YYYY-MM-DD, excluded)")
+    parser.add_argument("--pairs", type=str, help="Also write every matched pair to this CSV")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    columns = [LATITUDE, LONGITUDE, HEIGHT]
+    a = load_station(args.a, columns, args.start, args.end)
+    b = load_station(args.b, columns, args.start, args.end)
+    pairs = compare(a, b, tolerance=args.tolerance)
+    print("{} of {} epochs matched".format(len(pairs), len(a)))
+    if args.pairs:
+        pairs.to_csv(args.pairs, index=False)
+    daily_summary(pairs).to_csv(args.output, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite index of the coverage of merged CSRS-PPP solutions.
+
+Listing the days missing from a station used to mean loading all of its
+solutions. The ingest (unzip_concat.py) also records, for every station,
+result archive and hour, the number of epochs and the first and last epoch
+times. Coverage and gap queries over many stations and years read only this
+index (a few rows per day), and support sub-daily gaps: an hour (or day)
+with fewer than min_epochs epochs counts as missing.
+
+Hours are stored as hours since 1970-01-01 and times as milliseconds, as in
+the Parquet store (ppp_store.py).
+
+Example:
+
+    from ppp_coverage import CoverageIndex
+    with CoverageIndex("/Users/adam/Desktop/gnss/data/ppp_coverage.sqlite") as index:
+        print(index.gaps(["lowell_upper", "lowell_corner"]))
+        print(index.gaps("lowell_corner", freq="h", min_epochs=3000))
+"""
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS coverage (
+    station TEXT NOT NULL,
+    archive TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    epochs INTEGER NOT NULL,
+    first_ms INTEGER NOT NULL,
+    last_ms INTEGER NOT NULL,
+    PRIMARY KEY (station, hour, archive)
+);
+"""
+
+# Length of the periods of the queries, in hours
+PERIODS = {"h": 1, "D": 24}
+
+_HOUR_MS = 3600 * 1000
+
+
+def hourly_counts(times):
+    """
+    Return the hours (since 1970), epoch counts and first and last times (ms)
+    of an array of datetime64 values.
+    """
+    ms = np.sort(np.asarray(times, dtype="datetime64[ms]").astype(np.int64))
+    if len(ms) == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty, empty
+    hours = ms // _HOUR_MS
+    starts = np.flatnonzero(np.r_[True, hours[1:] != hours[:-1]])
+    ends = np.r_[starts[1:], len(ms)]
+    return hours[starts], ends - starts, ms[starts], ms[ends - 1]
+
+
+class CoverageIndex:
+    """
+    Coverage index shared by the stations of a data directory.
+
+    Like the job journal, the database uses write-ahead logging and a busy
+    timeout so that queries can run while an ingest is writing.
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    # -------------------------------------------------------------------------
+    # Ingest
+    # -------------------------------------------------------------------------
+
+    def add(self, station, archive, times):
+        """Record the epochs (datetime64 values) of a result archive, replacing earlier records of it."""
+        hours, epochs, first, last = hourly_counts(times)
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.execute("DELETE FROM coverage WHERE station = ? AND archive = ?", (station, archive))
+            self._db.executemany("INSERT INTO coverage VALUES (?, ?, ?, ?, ?, ?)",
+                                 zip([station] * len(hours), [archive] * len(hours), hours.tolist(),
+                                     epochs.tolist(), first.tolist(), last.tolist()))
+
+    def remove_station(self, station):
+        """Delete the records of a station (before it is rebuilt)."""
+        with self._db:
+            self._db.execute("DELETE FROM coverage WHERE station = ?", (station,))
+
+    def stations(self):
+        """Return the stations of the index."""
+        return [row[0] for row in self._db.execute("SELECT DISTINCT station FROM coverage ORDER BY station")]
+
+    # -------------------------------------------------------------------------
+    # Queries
+    # -------------------------------------------------------------------------
+
+    def coverage(self, stations=None, start=None, end=None, freq="D"):
+        """
+        Return the epochs and first and last epoch times of each period.
+
+        Parameters
+        ----------
+        stations : str or list of str
+            Stations queried (default: all).
+        start, end : str or datetime
+            Only periods starting at or after start and before end.
+        freq : str
+            Period: "h" (hour) or "D" (day).
+
+        Returns
+        -------
+        DataFrame with columns station, period, epochs, first, last; periods
+        without epochs are absent.
+        """
+        span = PERIODS[freq]
+        sql = "SELECT station, hour / ? AS period, SUM(epochs), MIN(first_ms), MAX(last_ms) FROM coverage"
+        where, params = [], [span]
+        if isinstance(stations, str):
+            stations = [stations]
+        if stations is not None:
+            where.append("station IN ({0:s})".format(", ".join("?" * len(stations))))
+            params += list(stations)
+        if start is not None:
+            where.append("hour >= ?")
+            params.append(_period(start, span) * span)
+        if end is not None:
+            where.append("hour < ?")
+            params.append(_period(end, span, up=True) * span)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " GROUP BY station, period ORDER BY station, period"
+
+        rows = self._db.execute(sql, params).fetchall()
+        df = pd.DataFrame(rows, columns=["station", "period", "epochs", "first", "last"])
+        df["period"] = pd.to_datetime(df["period"].astype(np.int64) * span * _HOUR_MS, unit="ms")
+        df["first"] = pd.to_datetime(df["first"].astype(np.int64), unit="ms")
+        df["last"] = pd.to_datetime(df["last"].astype(np.int64), unit="ms")
+        return df
+
+    def missing(self, station, start=None, end=None, freq="D", min_epochs=1):
+        """
+        Return the periods of a station with fewer than min_epochs epochs,
+        between start and end (default: the first and last periods with data).
+        """
+        df = self.coverage(station, start, end, freq)
+        if df.empty and (start is None or end is None):
+            return pd.DatetimeIndex([])
+        span = pd.Timedelta(hours=PERIODS[freq])
+        first = pd.Timestamp(start).floor(span) if start is not None else df["period"].iloc[0]
+        last = pd.Timestamp(end).ceil(span) - span if end is not None else df["period"].iloc[-1]
+        covered = df.loc[df["epochs"] >= min_epochs, "period"]
+        return pd.date_range(first, last, freq=span).difference(pd.DatetimeIndex(covered))
+
+    def gaps(self, stations=None, start=None, end=None, freq="D", min_epochs=1):
+        """
+        Return the gaps of stations as runs of consecutive missing periods.
+
+        Returns
+        -------
+        DataFrame with columns station, start, end (start of the last
+        missing period) and periods.
+        """
+        if isinstance(stations, str):
+            stations = [stations]
+        span = pd.Timedelta(hours=PERIODS[freq])
+        runs = []
+        for station in stations if stations is not None else self.stations():
+            missing = self.missing(station, start, end, freq, min_epochs)
+            if len(missing) == 0:
+                continue
+            run = np.cumsum(np.r_[True, np.diff(missing.values.astype("datetime64[ns]")) != span.to_timedelta64()])
+            for _, periods in pd.Series(missing, index=run).groupby(level=0):
+                runs.append((station, periods.iloc[0], periods.iloc[-1], len(periods)))
+        return pd.DataFrame(runs, columns=["station", "start", "end", "periods"])
+
+
+def _period(value, span, up=False):
+    """Return the index (since 1970) of the period of span hours containing value (or starting at/after it)."""
+    hours = pd.Timestamp(value).value / (_HOUR_MS * 1e6)
+    return int(np.ceil(hours / span)) if up else int(np.floor(hours / span))
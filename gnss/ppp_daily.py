@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Daily reduction of CSRS-PPP solutions to one row per day.
+
+The solutions are sorted once by date and time, and every reduction is
+computed from that order with NumPy reduceat over the day boundaries, so a
+single pass gives, for each day and each coordinate column:
+
+    <column>_last      last solution of the day
+    <column>_mean      mean
+    <column>_median    median
+    <column>_robust    sigma-clipped mean: mean of the solutions within sigma
+                       standard deviations of the median, the standard
+                       deviation being re-estimated from the kept solutions
+                       until no more are rejected (or iterations is reached)
+    <column>_std       standard deviation of the day (sigma, ddof=1)
+    <column>_robust_n  solutions kept by the clipping
+
+plus date, epochs and datetime_first, datetime_mean, datetime_last. Columns
+are in the units of the coordinate columns (degrees, metres).
+
+reduce_chunks does the same on an iterable of DataFrames in date order (e.g.
+ppp_store.iter_station), holding only one chunk and the unfinished day in
+memory, for years of 1 Hz kinematic solutions.
+
+Example:
+
+    from ppp_store import iter_station
+    from ppp_daily import reduce_chunks
+    daily = reduce_chunks(iter_station("/Users/adam/Desktop/gnss/data/lowell_corner/lowell_corner.csv"))
+    daily[["date", "latitude_decimal_degree_mean", "latitude_decimal_degree_robust"]]
+"""
+
+import numpy as np
+import pandas as pd
+
+LATITUDE = "latitude_decimal_degree"
+LONGITUDE = "longitude_decimal_degree"
+HEIGHT = "ellipsoidal_height_m"
+
+COLUMNS = (LATITUDE, LONGITUDE, HEIGHT)
+MODES = ("last", "mean", "median", "robust")
+
+SIGMA = 3.0
+ITERATIONS = 5
+
+
+def daily_columns(columns, times=True):
+    """Return the columns of the daily table of some coordinate columns."""
+    names = ["date", "epochs"]
+    if times:
+        names += ["datetime_first", "datetime_mean", "datetime_last"]
+    for name in columns:
+        names += ["{0:s}_{1:s}".format(name, mode) for mode in MODES]
+        names += [name + "_std", name + "_robust_n"]
+    return names
+
+
+def _clipped(values, center, starts, counts, sigma, iterations):
+    """Return the mask of the values kept by sigma clipping about the center of each day."""
+    keep = np.ones(len(values), dtype=bool)
+    deviation = np.abs(values - np.repeat(center, counts))
+    for _ in range(iterations):
+        kept = np.add.reduceat(keep, starts)
+        mean = np.add.reduceat(np.where(keep, values, 0.0), starts) / kept
+        residuals = np.where(keep, values - np.repeat(mean, counts), 0.0)
+        std = np.sqrt(np.add.reduceat(residuals ** 2, starts) / kept)
+        clipped = deviation <= sigma * np.repeat(std, counts)
+        if np.array_equal(clipped, keep):
+            break
+        keep = clipped
+    return keep
+
+
+def reduce_days(df, columns=COLUMNS, sigma=SIGMA, iterations=ITERATIONS):
+    """
+    Reduce solutions to one row per day.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Solutions with a date column and preferably datetime (otherwise
+        the last solution of a day is the last row).
+    columns : list of str
+        Coordinate columns reduced; columns df lacks are skipped.
+    sigma : float
+        Clipping threshold of the robust mean, in standard deviations.
+    iterations : int
+        Largest number of clipping iterations.
+
+    Returns
+    -------
+    DataFrame with the columns of daily_columns, sorted by date.
+    """
+    columns = [name for name in columns if name in df.columns]
+    times = "datetime" in df.columns
+    if df.empty:
+        return pd.DataFrame(columns=daily_columns(columns, times))
+
+    days = df["date"].to_numpy(dtype="datetime64[ns]")
+    epochs = df["datetime"].to_numpy(dtype="datetime64[ns]").astype(np.int64) if times else np.arange(len(df))
+    order = np.lexsort((epochs, days))
+    days, epochs = days[order], epochs[order]
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    counts = np.diff(np.r_[starts, len(days)])
+    lasts = starts + counts - 1
+    day_index = np.repeat(np.arange(len(starts)), counts)
+
+    daily = {"date": days[starts], "epochs": counts}
+    if times:
+        # Offsets from the first epoch of the day, as the sum of the epochs overflows int64
+        offsets = (epochs - np.repeat(epochs[starts], counts)).astype(np.float64)
+        mean = epochs[starts] + np.round(np.add.reduceat(offsets, starts) / counts).astype(np.int64)
+        daily["datetime_first"] = epochs[starts].astype("datetime64[ns]")
+        daily["datetime_mean"] = mean.astype("datetime64[ns]")
+        daily["datetime_last"] = epochs[lasts].astype("datetime64[ns]")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for name in columns:
+            values = df[name].to_numpy(dtype=np.float64)[order]
+            mean = np.add.reduceat(values, starts) / counts
+            residuals = values - np.repeat(mean, counts)
+            ranked = values[np.lexsort((values, day_index))]
+            median = (ranked[starts + (counts - 1) // 2] + ranked[starts + counts // 2]) / 2
+            keep = _clipped(values, median, starts, counts, sigma, iterations)
+            kept = np.add.reduceat(keep, starts)
+
+            daily[name + "_last"] = values[lasts]
+            daily[name + "_mean"] = mean
+            daily[name + "_median"] = median
+            daily[name + "_robust"] = np.add.reduceat(np.where(keep, values, 0.0), starts) / kept
+            daily[name + "_std"] = np.sqrt(np.add.reduceat(residuals ** 2, starts) / (counts - 1))
+            daily[name + "_robust_n"] = kept
+    return pd.DataFrame(daily)
+
+
+def reduce_chunks(chunks, columns=COLUMNS, sigma=SIGMA, iterations=ITERATIONS):
+    """
+    Reduce solutions read in chunks to one row per day (see reduce_days).
+
+    The chunks must be in date order; a day may be split across chunks. The
+    last day of a chunk is only reduced once a chunk of a later day arrives.
+    """
+    frames = []
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if chunk.empty:
+            carry = chunk
+            continue
+        done = (chunk["date"] < chunk["date"].max()).to_numpy()
+        if done.any():
+            frames.append(reduce_days(chunk[done], columns, sigma, iterations))
+        carry = chunk[~done]
+    if carry is not None and not carry.empty:
+        frames.append(reduce_days(carry, columns, sigma, iterations))
+    if not frames:
+        return pd.DataFrame(columns=daily_columns(columns))
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental, epoch-sorted merge of CSRS-PPP result archives into a station CSV.
+
+The rows of the .csv members of each result archive are sorted by epoch
+(year, day_of_year, decimal_hour) and merged into the CSV of the station,
+which is kept sorted: rows after the last epoch are appended, rows of a late
+archive are merged with the tail of the file, rewritten in place. Every
+archive merged is also written to the Parquet store of the station
+(ppp_store.py) and its hourly coverage recorded (ppp_coverage.py).
+
+A manifest next to the CSV (<station>_manifest.json) records the size and
+modification time of every archive merged, the last epoch and the size of
+the CSV, so that only new archives are merged; the station is rebuilt from
+scratch if an archive merged before has changed or gone, or if the CSV, store
+or coverage records no longer match the manifest.
+
+Used by unzip_concat.py (zip files of a station directory) and ppp_pipeline.py
+(archives as they are downloaded).
+
+Example:
+
+    from ppp_coverage import CoverageIndex
+    from ppp_merge import add_zip, open_station, read_rows
+    with CoverageIndex("/Users/adam/Desktop/gnss/data/ppp_coverage.sqlite") as coverage:
+        station = open_station(path_csv, sorted(glob.glob(path_input + "*.zip")), coverage)
+        for file in station["new"]:
+            add_zip(station, file, *read_rows(file))
+"""
+
+import heapq
+import json
+import os
+import zipfile
+
+import ppp_store
+
+# Columns giving the epoch of a row; the merged CSV is kept sorted by them
+EPOCH_COLUMNS = ("year", "day_of_year", "decimal_hour")
+
+def epoch_key(columns):
+    """Return a function giving the epoch of a CSV row (bytes) from the header columns."""
+    header = [name.strip() for name in columns.decode().strip().split(",")]
+    index = [header.index(name) for name in EPOCH_COLUMNS]
+
+    def key(line):
+        fields = line.split(b",")
+        return (int(float(fields[index[0]])), int(float(fields[index[1]])), float(fields[index[2]]))
+    return key
+
+def read_rows(file):
+    """Return the header and the epoch-sorted rows (bytes) of the CSV members of a zip file."""
+    header, rows = None, []
+    with zipfile.ZipFile(file) as item:
+        for name in sorted(n for n in item.namelist() if n.lower().endswith(".csv")):
+            with item.open(name) as infile:
+                header = infile.readline()
+                rows += [line if line.endswith(b"\n") else line + b"\n" for line in infile if line.strip()]
+    if rows:
+        rows.sort(key=epoch_key(header))
+    return header, rows
+
+def tail_offset(f, start, size, key, epoch, block=1024 * 1024):
+    """
+    Return the offset of the first row after epoch in a sorted CSV, reading
+    it backwards by blocks from size down to start (the end of the header).
+    """
+    pos, buf = size, b""
+    while pos > start:
+        end, pos = pos, max(start, pos - block)
+        f.seek(pos)
+        buf = f.read(end - pos) + buf
+        # The first line of the block may be partial, unless it is the first row
+        first = 0 if pos == start else buf.find(b"\n") + 1
+        if first == 0 and pos != start:
+            continue
+        lines = buf[first:].splitlines(keepends=True)
+        if pos == start or (lines and key(lines[0]) <= epoch):
+            offset = pos + first
+            for line in lines:
+                if key(line) > epoch:
+                    return offset
+                offset += len(line)
+            return offset
+    return start
+
+def merge_rows(path_csv, header, rows, last_epoch):
+    """
+    Add sorted rows to a merged CSV kept sorted by epoch, writing the header
+    if the file is new. Rows after the last epoch are appended; rows of a
+    late file are merged with the tail of the file after their first epoch,
+    which is rewritten in place. Returns the new last epoch.
+    """
+    key = epoch_key(header)
+    if not os.path.isfile(path_csv) or os.path.getsize(path_csv) == 0:
+        with open(path_csv, "wb") as outfile:
+            outfile.write(header)
+            outfile.writelines(rows)
+        return key(rows[-1])
+    if key(rows[0]) >= tuple(last_epoch):
+        with open(path_csv, "ab") as outfile:
+            outfile.writelines(rows)
+        return key(rows[-1])
+    with open(path_csv, "r+b") as f:
+        start = len(f.readline())
+        offset = tail_offset(f, start, os.fstat(f.fileno()).st_size, key, key(rows[0]))
+        f.seek(offset)
+        tail = f.read().splitlines(keepends=True)
+        f.seek(offset)
+        f.writelines(heapq.merge(tail, rows, key=key))
+        f.truncate()
+    return max(tuple(last_epoch), key(rows[-1]))
+
+def _stat(file):
+    return [os.path.getsize(file), os.path.getmtime(file)]
+
+def manifest_path(path_csv):
+    """Return the manifest of a merged CSV (belcher_upper.csv -> belcher_upper_manifest.json)."""
+    return os.path.splitext(path_csv)[0] + "_manifest.json"
+
+def open_station(path_csv, files, coverage, name=None):
+    """
+    Load the manifest of a merged CSV and return a dict of its paths,
+    manifest, coverage index and the archives of files not merged yet.
+
+    files are all the archives of the station: one merged before that is no
+    longer among them, or has changed, causes a rebuild. name is the station
+    in the coverage index (default: the CSV name without extension).
+    """
+    name = name or os.path.splitext(os.path.basename(path_csv))[0]
+    path_manifest = manifest_path(path_csv)
+    path_store = ppp_store.store_path(path_csv)
+
+    stats = {os.path.basename(file): _stat(file) for file in files}
+    try:
+        with open(path_manifest) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = None
+
+    csv_size = os.path.getsize(path_csv) if os.path.isfile(path_csv) else 0
+    if (manifest is None or manifest["csv_size"] != csv_size
+            or any(stats.get(archive) != stat for archive, stat in manifest["zips"].items())
+            or (manifest["zips"] and not os.path.isdir(path_store))
+            or (manifest["zips"] and name not in coverage.stations())):
+        if manifest is not None or csv_size:
+            print("{} is rebuilt from scratch".format(path_csv))
+        manifest = {"zips": {}, "last_epoch": None, "csv_size": 0}
+        if os.path.isfile(path_csv):
+            os.remove(path_csv)
+        ppp_store.remove_store(path_store)
+        coverage.remove_station(name)
+
+    return {"filename": name, "csv": path_csv, "store": path_store, "manifest_path": path_manifest,
+            "manifest": manifest, "coverage": coverage,
+            "new": [file for file in files if os.path.basename(file) not in manifest["zips"]]}
+
+def add_zip(station, file, header, rows):
+    """Merge the rows of a zip file into the CSV of a station and record it in the manifest."""
+    manifest = station["manifest"]
+    name = os.path.basename(file)
+    if rows:
+        manifest["last_epoch"] = merge_rows(station["csv"], header, rows, manifest["last_epoch"])
+        # Typed, date-partitioned copy of the rows for the analysis scripts, and their hourly coverage
+        table = ppp_store.write_rows(station["store"], name, header, rows)
+        station["coverage"].add(station["filename"], name, table.column("datetime").to_numpy())
+        print("{} has been merged ({} rows).".format(file, len(rows)))
+    manifest["zips"][name] = _stat(file)
+    manifest["csv_size"] = os.path.getsize(station["csv"]) if os.path.isfile(station["csv"]) else 0
+    # Save the manifest after every zip so an interrupted run resumes where it stopped
+    with open(station["manifest_path"] + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(station["manifest_path"] + ".tmp", station["manifest_path"])
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+End-to-end pipeline from u-blox logs to a merged CSRS-PPP time series.
+
+Every .ubx file flows through the stages as soon as it is ready, instead of
+each stage waiting for the previous one to finish the whole dataset:
+
+    convert (convbin) -> submit -> poll -> fetch -> merge (merged CSV)
+
+Stages are connected by bounded queues, so a fast stage never runs far ahead
+of a slow one, and each stage has its own concurrency limit. Conversion runs
+on a process pool; submission, polling and downloads share one
+CSRSPPPClient (with its journal, cache and rate governor); the rows of each
+result archive are merged into the merged CSV as soon as it is downloaded.
+Wall-clock time is then close to that of the slowest stage rather than the
+sum of all of them.
+
+Results complete in any order, so the merge stage uses the sorted merge of
+ppp_merge.py: the merged CSV stays sorted by epoch, and its Parquet store and
+the coverage index (ppp_coverage.sqlite next to the merged CSV) are updated
+with every archive. Archives already in the results directory but not merged
+yet (e.g. after an interrupted run) are merged when the pipeline starts.
+
+Example:
+
+    python3 ppp_pipeline.py --user_name first.last@email.com --input_path UBX/ --output_path belcher_upper/ \
+        --mode Kinematic --ref ITRF --convert_jobs 32
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import sys
+import time
+import zipfile
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import ppp_merge
+
+from convbin_batch import ENGINES, convert_one, find_ubx, output_dir
+from csrs_ppp_batch import EXIT_CODES, close_logger, job_logger, job_record
+from csrs_ppp_cache import ResultCache
+from csrs_ppp_client import DUMMY_EMAIL, CSRSPPPClient, JobResult, PPPOptions
+from csrs_ppp_governor import ConcurrencyGovernor
+from csrs_ppp_journal import JobJournal
+from ppp_coverage import CoverageIndex
+from rinex_filter import add_filter_arguments, filter_from_args
+
+logger = logging.getLogger("csrs_ppp")
+
+StageLimits = namedtuple("StageLimits", ["convert", "submit", "poll", "fetch"],
+                         defaults=[os.cpu_count() or 1, 4, 32, 4])
+StageLimits.__doc__ = "Number of files processed at once by each stage of the pipeline."
+
+
+def coverage_path(merged_csv):
+    """Return the coverage index (ppp_coverage.py) in the directory of merged_csv."""
+    return os.path.join(os.path.dirname(os.path.abspath(merged_csv)), "ppp_coverage.sqlite")
+
+
+def open_merged(merged_csv, results_dir):
+    """
+    Open merged_csv for the sorted merge of ppp_merge.py, with the result
+    archives of results_dir, and merge the archives not merged yet.
+
+    Returns the station dict of ppp_merge.open_station; its coverage index
+    must be used and closed on the thread that opened it.
+    """
+    coverage = CoverageIndex(coverage_path(merged_csv))
+    station = ppp_merge.open_station(merged_csv, sorted(glob.glob(os.path.join(results_dir, "*_full_output.zip"))),
+                                     coverage)
+    for archive in list(station["new"]):
+        merge_results(station, archive)
+    return station
+
+
+def merge_results(station, result_zip):
+    """
+    Merge the rows of the .csv members of a result archive into the merged
+    CSV of station, keeping it sorted by epoch, and into its Parquet store
+    and coverage index. Returns the number of rows merged.
+
+    An archive merged before (e.g. the same result fetched again from the
+    cache) is only recorded again, so its rows are not duplicated.
+    """
+    if os.path.basename(result_zip) in station["manifest"]["zips"]:
+        ppp_merge.add_zip(station, result_zip, None, [])
+        return 0
+    header, rows = ppp_merge.read_rows(result_zip)
+    ppp_merge.add_zip(station, result_zip, header, rows)
+    return len(rows)
+
+
+def result_archive(outputs):
+    """Return the full_output.zip among the outputs of a job, or None."""
+    for path in outputs:
+        if path.endswith("_full_output.zip"):
+            return path
+    return None
+
+
+async def run_pipeline(client, ubx_files, input_path, rinex_dir, results_dir, merged_csv, limits=None,
+                       queue_size=8, res=False, log_dir=None, summary=None, engine="convbin", interval=None):
+    """
+    Run ubx_files through conversion, CSRS-PPP processing and merging.
+
+    RINEX files are written below rinex_dir in subfolders mirroring those of
+    input_path by the engine of convbin_batch.py, decimated to interval if
+    given; logs whose RINEX file is current are not converted again.
+    Result archives are merged into merged_csv (see merge_results) on a
+    single thread, after the archives of results_dir not merged yet.
+    Returns the list of summary records, in order of completion. Files whose
+    results are skipped by the journal are not merged again. Once a job
+    reports that the user is blocked, files not submitted yet are recorded as
+    blocked.
+    """
+    limits = limits or StageLimits()
+    loop = asyncio.get_running_loop()
+    stages = {"submit": asyncio.Semaphore(limits.submit), "poll": asyncio.Semaphore(limits.poll),
+              "fetch": asyncio.Semaphore(limits.fetch)}
+    to_ppp = asyncio.Queue(queue_size)
+    to_merge = asyncio.Queue(queue_size)
+    pending = iter(ubx_files)
+    snapshot = client.http.stats()
+    busy = Counter()
+    counts = Counter()
+    blocked = []
+    records = []
+
+    def finish(result, log_path, rows=0):
+        record = job_record(result, log_path)
+        record["rows"] = rows
+        records.append(record)
+        if summary is not None:
+            summary.write(json.dumps(record) + "\n")
+            summary.flush()
+        logger.info("[{0:d}/{1:d}] {2:s}: {3:s} ({4:.1f} sec, {5:d} rows){6:s}".format(
+            len(records), len(ubx_files), os.path.basename(result.rinex_file), result.status, result.elapsed,
+            rows, "" if result.error is None else " - {0:s}".format(result.error)))
+
+    async def convert_worker(executor):
+        for ubx_file in pending:
+            start = time.monotonic()
+            conversion = await loop.run_in_executor(executor, convert_one, ubx_file,
+                                                    output_dir(ubx_file, input_path, rinex_dir), False, "convbin",
+                                                    engine, interval)
+            busy["convert"] += conversion.seconds
+            counts["convert"] += 1
+            if conversion.status == "failed":
+                finish(JobResult(ubx_file, None, "failed", [], "convert: {0:s}".format(conversion.error),
+                                 time.monotonic() - start), None)
+                continue
+            await to_ppp.put((conversion.obs_file, start))
+
+    async def ppp_worker():
+        while True:
+            item = await to_ppp.get()
+            if item is None:
+                return
+            rinex_file, start = item
+            log_path = os.path.join(log_dir, "{0:s}.log".format(os.path.basename(rinex_file)))
+            if blocked:
+                result = JobResult(rinex_file, None, "blocked", [], blocked[0], 0.0)
+            else:
+                job_log = job_logger(rinex_file, log_dir)
+                try:
+                    result = await client.process(rinex_file, results_dir, res, log=job_log, stages=stages)
+                except Exception as e:  # keep the pipeline going; the record carries the error
+                    job_log.exception("Unexpected error")
+                    result = JobResult(rinex_file, None, "failed", [], repr(e), 0.0)
+                finally:
+                    close_logger(job_log)
+                if result.status == "blocked":
+                    blocked.append(result.error)
+            busy["ppp"] += result.elapsed
+            counts["ppp"] += 1
+            await to_merge.put((result._replace(elapsed=time.monotonic() - start), log_path))
+
+    async def merge_worker(merger, station):
+        while True:
+            item = await to_merge.get()
+            if item is None:
+                return
+            result, log_path = item
+            rows = 0
+            archive = result_archive(result.outputs)
+            if result.status in ("done", "cached") and archive is not None:
+                start = time.monotonic()
+                try:
+                    rows = await loop.run_in_executor(merger, merge_results, station, archive)
+                except (OSError, ValueError, zipfile.BadZipFile) as e:
+                    result = result._replace(status="failed", error="merge: {0!r}".format(e))
+                busy["merge"] += time.monotonic() - start
+                counts["merge"] += 1
+            finish(result, log_path, rows)
+
+    start = time.monotonic()
+    # Archives are merged one at a time, on the thread of the coverage index
+    with ProcessPoolExecutor(max_workers=limits.convert) as executor, ThreadPoolExecutor(max_workers=1) as merger:
+        station = await loop.run_in_executor(merger, open_merged, merged_csv, results_dir)
+        try:
+            converters = [asyncio.ensure_future(convert_worker(executor)) for _ in range(limits.convert)]
+            jobs = [asyncio.ensure_future(ppp_worker()) for _ in range(limits.submit + limits.poll + limits.fetch)]
+            merging = asyncio.ensure_future(merge_worker(merger, station))
+
+            await asyncio.gather(*converters)
+            for _ in jobs:
+                await to_ppp.put(None)
+            await asyncio.gather(*jobs)
+            await to_merge.put(None)
+            await merging
+        finally:
+            await loop.run_in_executor(merger, station["coverage"].close)
+
+    elapsed = time.monotonic() - start
+    for stage in ("convert", "ppp", "merge"):
+        logger.info("=> Stage {0:s}: {1:d} files, {2:.1f} sec busy".format(stage, counts[stage], busy[stage]))
+    logger.info("=> Pipeline: {0:.1f} sec wall-clock".format(elapsed))
+    client.log_report(snapshot)
+    return records
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Pipeline from u-blox logs to a merged CSRS-PPP time series")
+    parser.add_argument("--user_name", type=str, required=True, help="CSRS-PPP user name (email)")
+    parser.add_argument("--input_path", type=str, required=True, help="Directory searched (recursively) for logs")
+    parser.add_argument("--output_path", type=str, required=True,
+                        help="Directory of the RINEX files, results, logs and merged CSV")
+    parser.add_argument("--pattern", type=str, default="*.ubx", help="Log file name pattern (default=\"*.ubx\")")
+    parser.add_argument("--merged", type=str,
+                        help="Merged CSV of all positions (default=<output_path>/<input directory name>.csv)")
+    parser.add_argument("--engine", default="convbin", type=str.lower, choices=ENGINES,
+                        help="Converter: RTKLIB convbin or the built-in ubx2rinex.py (default=\"convbin\")")
+    parser.add_argument("--interval", type=float, help="Keep only epochs on multiples of this interval (s)")
+    parser.add_argument("--convert_jobs", type=int, default=os.cpu_count() or 1,
+                        help="Number of conversions at once (default=number of cores)")
+    parser.add_argument("--submit_jobs", type=int, default=4, help="Number of uploads at once (default=4)")
+    parser.add_argument("--poll_jobs", type=int, default=32, help="Number of jobs polled at once (default=32)")
+    parser.add_argument("--fetch_jobs", type=int, default=4, help="Number of downloads at once (default=4)")
+    parser.add_argument("--queue_size", type=int, default=8, help="Size of the queues between stages (default=8)")
+    parser.add_argument("--domain", type=str,
+                        help="Base URL of the CSRS-PPP service (default=$CSRS_PPP_DOMAIN or the NRCan web service)")
+    parser.add_argument("--max_requests", type=int, default=16,
+                        help="Highest number of requests in flight to CSRS-PPP (default=16)")
+    parser.add_argument("--rate", type=float, default=2.0,
+                        help="Initial requests per second to CSRS-PPP, adapted to the service (default=2)")
+    parser.add_argument("--lang", default="en", type=str.lower, choices=["en", "fr"])
+    parser.add_argument("--mode", default="Kinematic", type=str.capitalize, choices=["Static", "Kinematic"])
+    parser.add_argument("--ref", default="ITRF", type=str.upper, choices=["NAD83", "ITRF"])
+    parser.add_argument("--epoch", default="CURR", type=str.upper, help="NAD83 epoch (YYYY-MM-DD or CURR)")
+    parser.add_argument("--vdatum", default="CGVD2013", type=str.upper, choices=["CGVD2013", "CGVD28"])
+    parser.add_argument("--output_pdf", default="lite", type=str.lower, choices=["full", "lite"])
+    parser.add_argument("--res", action="store_true", help="Download residuals")
+    parser.add_argument("--get_max", default=30, type=int,
+                        help="Number of 10-second intervals to wait for results (default=30)")
+    parser.add_argument("--compression", default="gzip", type=str.lower, choices=["gzip", "hatanaka", "none"])
+    add_filter_arguments(parser)
+    parser.add_argument("--journal", type=str,
+                        help="SQLite job journal (default=<output_path>/csrs_ppp_journal.sqlite)")
+    parser.add_argument("--cache_dir", "--cache-dir", type=str, help="Directory of the result cache")
+    parser.add_argument("--cache_size", default=10, type=float, help="Maximum size of the result cache in GB")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(format="%(asctime)s %(message)s", datefmt="%H:%M:%S", level=logging.INFO)
+
+    rinex_dir = os.path.join(args.output_path, "RINEX")
+    results_dir = os.path.join(args.output_path, "ppp")
+    log_dir = os.path.join(args.output_path, "logs")
+    for path in (rinex_dir, results_dir, log_dir):
+        os.makedirs(path, exist_ok=True)
+    merged_csv = args.merged or os.path.join(
+        args.output_path, "{0:s}.csv".format(os.path.basename(os.path.normpath(args.input_path))))
+
+    files = find_ubx(args.input_path, args.pattern)
+    logger.info("=> {0:d} files found in {1:s}".format(len(files), args.input_path))
+    if not files:
+        return 0
+
+    options = PPPOptions(lang=args.lang, mode=args.mode, ref=args.ref, epoch=args.epoch, vdatum=args.vdatum,
+                         email=DUMMY_EMAIL, output_pdf=args.output_pdf)
+    limits = StageLimits(args.convert_jobs, args.submit_jobs, args.poll_jobs, args.fetch_jobs)
+    journal = JobJournal(args.journal or os.path.join(args.output_path, "csrs_ppp_journal.sqlite"))
+    cache = ResultCache(args.cache_dir, int(args.cache_size * 1024 ** 3)) if args.cache_dir else None
+    governor = ConcurrencyGovernor(initial=min(4, args.max_requests), maximum=args.max_requests, rate=args.rate)
+
+    # One thread (and pooled connection) per request the governor may allow
+    workers = max(limits.submit + limits.poll + limits.fetch, args.max_requests)
+
+    try:
+        with CSRSPPPClient(args.user_name, options, domain=args.domain, max_workers=workers, get_max=args.get_max,
+                           compression=args.compression, journal=journal, cache=cache,
+                           governor=governor, rinex_filter=filter_from_args(args)) as client, \
+                open(os.path.join(args.output_path, "ppp_pipeline.jsonl"), "a") as summary:
+            records = asyncio.run(run_pipeline(client, files, args.input_path, rinex_dir, results_dir, merged_csv,
+                                               limits, args.queue_size, args.res, log_dir, summary, args.engine,
+                                               args.interval))
+    finally:
+        journal.close()
+
+    counts = Counter(record["status"] for record in records)
+    logger.info("=> Summary: {0:d} files, {1:d} rows merged into {2:s} ({3:s})".format(
+        len(records), sum(record["rows"] for record in records), merged_csv,
+        ", ".join("{0:s}: {1:d}".format(k, v) for k, v in sorted(counts.items()))))
+    return max(EXIT_CODES[record["status"]] for record in records)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
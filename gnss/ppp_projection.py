@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Projection of CSRS-PPP positions to metres with cached pyproj transformers.
+
+Displacements used to be computed with a geodesic inverse call
+(pyproj.Geod.inv) on every pair of consecutive positions. Instead, a whole
+station series is projected once, and distances, directions and velocities
+become array differences:
+
+    to_enu     local east, north, up (m) about a reference point (by default
+               the first position): a topocentric frame, exact in 3D and
+               within a few ppm of the geodesic horizontal distance for
+               stations a few tens of kilometres from the reference
+    to_polar   x, y (m) in NSIDC Sea Ice Polar Stereographic North
+               (EPSG:3413), a common grid for maps and several stations;
+               grid distances carry the scale error of the projection
+               (about 4 % at 60°N)
+
+Directions are clockwise from the north of the reference point, which
+differs from the geodesic azimuth by the meridian convergence (below 0.1°
+within 3 km at 70°N). geodesic gives the exact WGS84 distance and azimuth
+between arrays of point pairs, in one call of a cached pyproj.Geod.
+
+Transformers are built once per reference point or CRS pair and cached
+(they are not shared between threads; the ingest uses processes).
+
+Example:
+
+    from ppp_projection import to_enu, steps
+    east, north, up = to_enu(df["latitude_decimal_degree"], df["longitude_decimal_degree"],
+                             df["ellipsoidal_height_m"])
+    distance, direction = steps(east, north)
+"""
+
+import functools
+
+import numpy as np
+import pyproj
+
+WGS84 = "EPSG:4326"
+POLAR_STEREOGRAPHIC = "EPSG:3413"
+
+_TOPOCENTRIC = ("+proj=pipeline +step +proj=unitconvert +xy_in=deg +xy_out=rad +step +proj=cart +ellps=WGS84 "
+                "+step +proj=topocentric +ellps=WGS84 +lat_0={0!r} +lon_0={1!r} +h_0={2!r}")
+
+
+@functools.lru_cache(maxsize=32)
+def transformer(source=WGS84, target=POLAR_STEREOGRAPHIC):
+    """Return the (cached) transformer between two CRS, in longitude, latitude (x, y) order."""
+    return pyproj.Transformer.from_crs(source, target, always_xy=True)
+
+
+@functools.lru_cache(maxsize=None)
+def ellipsoid(ellps="WGS84"):
+    """Return the (cached) pyproj.Geod of an ellipsoid."""
+    return pyproj.Geod(ellps=ellps)
+
+
+@functools.lru_cache(maxsize=64)
+def enu_transformer(lat0, lon0, h0=0.0):
+    """Return the (cached) transformer from longitude, latitude, height to east, north, up about a point."""
+    return pyproj.Transformer.from_pipeline(_TOPOCENTRIC.format(float(lat0), float(lon0), float(h0)))
+
+
+def _array(values):
+    return np.asarray(values, dtype=np.float64)
+
+
+def to_enu(lat, lon, height=None, reference=None):
+    """
+    Project positions to local east, north, up coordinates.
+
+    Parameters
+    ----------
+    lat, lon : array
+        WGS84 latitudes and longitudes (degrees).
+    height : array
+        Ellipsoidal heights (m); 0 if None.
+    reference : tuple of float
+        Latitude, longitude and height of the origin; default: the first
+        position.
+
+    Returns
+    -------
+    Arrays east, north and up (m).
+    """
+    lat, lon = _array(lat), _array(lon)
+    height = np.zeros(len(lat)) if height is None else _array(height)
+    if reference is None:
+        if len(lat) == 0:
+            return lat.copy(), lat.copy(), lat.copy()
+        reference = (lat[0], lon[0], height[0])
+    return enu_transformer(*reference).transform(lon, lat, height)
+
+
+def to_polar(lat, lon, crs=POLAR_STEREOGRAPHIC):
+    """Return the x and y (m) of WGS84 latitudes and longitudes (degrees) in a projected CRS."""
+    return transformer(WGS84, crs).transform(_array(lon), _array(lat))
+
+
+def geodesic(lat1, lon1, lat2, lon2):
+    """
+    Return the geodesic distance (m) and forward azimuth (degrees clockwise
+    from north, 0 to 360) from each point 1 to point 2 (WGS84 degrees).
+    """
+    forward, _, distance = ellipsoid().inv(_array(lon1), _array(lat1), _array(lon2), _array(lat2))
+    return distance, np.mod(forward, 360.0)
+
+
+def azimuth(east, north):
+    """Return the direction (degrees clockwise from north, 0 to 360) of east, north displacements."""
+    return np.mod(np.degrees(np.arctan2(east, north)), 360.0)
+
+
+def steps(east, north):
+    """
+    Return the horizontal distance (m) and direction (degrees) from each
+    position to the next, NaN for the first position.
+    """
+    east, north = _array(east), _array(north)
+    distance = np.full(len(east), np.nan)
+    direction = np.full(len(east), np.nan)
+    if len(east) > 1:
+        de, dn = np.diff(east), np.diff(north)
+        distance[1:] = np.hypot(de, dn)
+        direction[1:] = azimuth(de, dn)
+    return distance, direction
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Daily displacement statistics of merged CSRS-PPP solutions.
+
+The position of each day is one of the reductions of ppp_daily (the last
+solution of the day by default, or the mean, median or sigma-clipped robust
+mean), taken at the last or mean epoch time of the day. The daily positions
+of a station are projected once to local east, north metres about its first
+position (ppp_projection.to_enu), and the direction and horizontal distance
+from day to day are array differences, followed by the cumulative distance
+and the speed. Column names carry their units:
+
+    station, date, latitude_decimal_degree, longitude_decimal_degree,
+    elapsed_h, direction_deg, distance_m, distance_csum_m, speed_m_per_h
+
+The first day of a station has no displacement (NaN).
+
+Example:
+
+    from ppp_store import load_station
+    from ppp_stats import station_stats
+    columns = ["latitude_decimal_degree", "longitude_decimal_degree"]
+    stats = station_stats({name: load_station(path_data + name + ".csv", columns)
+                           for name in ("lowell_upper", "lowell_corner")}, mode="robust")
+"""
+
+import numpy as np
+import pandas as pd
+
+from ppp_daily import LATITUDE, LONGITUDE, MODES, reduce_days
+from ppp_projection import steps, to_enu
+
+STATS_COLUMNS = ["station", "date", LATITUDE, LONGITUDE, "elapsed_h", "direction_deg", "distance_m",
+                 "distance_csum_m", "speed_m_per_h"]
+
+
+def station_stats(stations, mode="last"):
+    """
+    Return the daily statistics of several stations.
+
+    Parameters
+    ----------
+    stations : dict of str to DataFrame
+        Solutions of each station, with date (and preferably datetime)
+        columns, e.g. from ppp_store.load_station.
+    mode : str
+        Daily position: "last", "mean", "median" or "robust".
+
+    Returns
+    -------
+    DataFrame with STATS_COLUMNS, sorted by station and date.
+    """
+    return position_stats({name: reduce_days(df, (LATITUDE, LONGITUDE)) for name, df in stations.items()}, mode)
+
+
+def position_stats(dailies, mode="last"):
+    """
+    Return the daily statistics of several stations from their daily tables.
+
+    Parameters
+    ----------
+    dailies : dict of str to DataFrame
+        Daily table of each station (ppp_daily.reduce_days or reduce_chunks).
+    mode : str
+        Daily position: "last", "mean", "median" or "robust".
+
+    Returns
+    -------
+    DataFrame with STATS_COLUMNS, sorted by station and date.
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown daily position {0:s} (expected one of {1:s})".format(mode, ", ".join(MODES)))
+    frames = [df.assign(station=name) for name, df in dailies.items()]
+    if not frames:
+        return pd.DataFrame(columns=STATS_COLUMNS)
+    daily = pd.concat(frames, ignore_index=True)
+
+    station = daily["station"].to_numpy()
+    lat = daily["{0:s}_{1:s}".format(LATITUDE, mode)].to_numpy(dtype=np.float64)
+    lon = daily["{0:s}_{1:s}".format(LONGITUDE, mode)].to_numpy(dtype=np.float64)
+    time = "datetime_last" if mode == "last" else "datetime_mean"
+    time = daily[time if time in daily.columns else "date"].to_numpy(dtype="datetime64[ns]")
+
+    # Each station is projected to east, north (m) about its first position; the displacement from the
+    # previous day is then a difference (rows are grouped by station)
+    first = np.r_[True, station[1:] != station[:-1]]
+    bounds = np.r_[np.flatnonzero(first), len(daily)]
+    east, north = np.empty(len(daily)), np.empty(len(daily))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        east[start:end], north[start:end], _ = to_enu(lat[start:end], lon[start:end])
+    distance, direction = steps(east, north)
+    elapsed = np.r_[np.nan, np.diff(time) / np.timedelta64(1, "h")]
+    distance[first], direction[first], elapsed[first] = np.nan, np.nan, np.nan
+
+    stats = pd.DataFrame({
+        "station": pd.Categorical(station, categories=list(dailies)),
+        "date": daily["date"].to_numpy(),
+        LATITUDE: lat,
+        LONGITUDE: lon,
+        "elapsed_h": elapsed,
+        "direction_deg": direction,
+        "distance_m": distance,
+    })
+    stats["distance_csum_m"] = stats.groupby("station", observed=True)["distance_m"].cumsum()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stats["speed_m_per_h"] = distance / elapsed
+    return stats[STATS_COLUMNS]
+
+
+def daily_stats(df, station="", mode="last"):
+    """Return the daily statistics of one station (see station_stats)."""
+    return station_stats({station: df}, mode)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Date-partitioned Parquet store of merged CSRS-PPP solutions.
+
+Parsing a year of 1 Hz kinematic solutions from a merged CSV, and turning
+year/day_of_year into dates, takes tens of seconds every time an analysis
+script loads a station. The ingest (unzip_concat.py) also writes the rows of
+every result archive to a Parquet dataset next to the merged CSV:
+
+    <station>.parquet/date=2022-06-19/<archive>-0.parquet
+
+Columns are typed (year and day_of_year as small integers, every other
+numeric column as float64, whatever the values of an archive look like, so
+that all the files of a store share one schema), compressed with zstd, and a
+datetime column (ms resolution) is precomputed. Each archive writes its
+own files in the date partitions it covers, so re-writing an archive replaces
+only its rows. load_station reads only the requested columns and date range
+(partition pruning and Parquet row group statistics), and falls back to the
+CSV when a station has no store yet. iter_station reads a station in chunks
+of whole days (or of CSV rows) for reductions that do not fit in memory.
+
+Example:
+
+    from ppp_store import load_station
+    df = load_station("/Users/adam/Desktop/gnss/data/belcher_upper/belcher_upper.csv",
+                      columns=["latitude_decimal_degree", "longitude_decimal_degree"],
+                      start="2022-06-01", end="2022-09-01")
+"""
+
+import io
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# Columns added to the CSRS-PPP columns
+DATE = "date"
+DATETIME = "datetime"
+
+# Integer columns stored as int16
+SMALL_INTS = ("year", "day_of_year")
+
+COMPRESSION = "zstd"
+
+# Size of the chunks of iter_station
+CHUNK_DAYS = 7
+CHUNK_ROWS = 1000000
+
+
+def store_path(path_csv):
+    """Return the Parquet store of a merged CSV (belcher_upper.csv -> belcher_upper.parquet)."""
+    return os.path.splitext(path_csv)[0] + ".parquet"
+
+
+def add_dates(df):
+    """Add the date (day) and datetime columns computed from year, day_of_year and decimal_hour."""
+    df[DATE] = pd.to_datetime(df["year"] * 1000 + df["day_of_year"], format="%Y%j")
+    df[DATETIME] = (df[DATE] + pd.to_timedelta(df["decimal_hour"], unit="h")).dt.round("ms")
+    return df
+
+
+def to_table(df):
+    """Return a typed Arrow table of CSRS-PPP solutions, partitioned on the date string."""
+    df = add_dates(df.copy())
+    for name in df.columns:
+        if name in SMALL_INTS:
+            df[name] = df[name].astype("int16")
+        elif name not in (DATE, DATETIME) and pd.api.types.is_numeric_dtype(df[name]):
+            # pd.read_csv infers int64 for an archive whose values happen to be whole
+            df[name] = df[name].astype("float64")
+    df[DATETIME] = df[DATETIME].astype("datetime64[ms]")
+    df[DATE] = df[DATE].dt.strftime("%Y-%m-%d")
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def write_rows(store, name, header, rows):
+    """
+    Write CSV rows (bytes, without header) of one archive to the store and
+    return them as an Arrow table (None if there are no rows).
+
+    name identifies the archive: its files in every date partition are
+    replaced, the files of other archives are kept.
+    """
+    if not rows:
+        return None
+    df = pd.read_csv(io.BytesIO(header + b"".join(rows)), index_col=False)
+    df.columns = [column.strip() for column in df.columns]
+    table = to_table(df)
+    stem = os.path.splitext(os.path.basename(name))[0]
+    ds.write_dataset(table, store, format="parquet", partitioning=[DATE], partitioning_flavor="hive",
+                     basename_template=stem + "-{i}.parquet", existing_data_behavior="overwrite_or_ignore",
+                     file_options=ds.ParquetFileFormat().make_write_options(compression=COMPRESSION))
+    return table
+
+
+def remove_store(store):
+    """Delete a store (before it is rebuilt)."""
+    shutil.rmtree(store, ignore_errors=True)
+
+
+def _bound(value):
+    return pd.Timestamp(value).to_datetime64().astype("datetime64[ms]")
+
+
+def open_store(store):
+    """
+    Return a store as an Arrow dataset, with its integer columns (other than
+    SMALL_INTS) read as float64, as in stores written before to_table fixed
+    their type.
+    """
+    dataset = ds.dataset(store, format="parquet", partitioning="hive")
+    schema = pa.schema([field.with_type(pa.float64())
+                        if pa.types.is_integer(field.type) and field.name not in SMALL_INTS else field
+                        for field in dataset.schema])
+    return ds.dataset(store, schema=schema, format="parquet", partitioning="hive")
+
+
+def read_store(store, columns=None, start=None, end=None):
+    """
+    Load a store as a DataFrame sorted by datetime.
+
+    Parameters
+    ----------
+    store : str
+        Directory of the Parquet dataset.
+    columns : list of str
+        Columns read (default: all; columns the store lacks are ignored);
+        date and datetime are always included.
+    start, end : str or datetime
+        Only rows with start <= datetime < end are read.
+    """
+    dataset = open_store(store)
+    condition = None
+    if start is not None:
+        condition = ds.field(DATETIME) >= _bound(start)
+        # Partition pruning: the date partition is a string
+        condition &= ds.field(DATE) >= pd.Timestamp(start).strftime("%Y-%m-%d")
+    if end is not None:
+        upper = (ds.field(DATETIME) < _bound(end)) & (ds.field(DATE) <= pd.Timestamp(end).strftime("%Y-%m-%d"))
+        condition = upper if condition is None else condition & upper
+    # The date partition strings are not read: dates are cheaper to derive from datetime
+    if columns is None:
+        columns = [name for name in dataset.schema.names if name != DATE]
+    columns = list(dict.fromkeys([name for name in columns if name in dataset.schema.names and name != DATE]
+                                 + [DATETIME]))
+    df = dataset.to_table(columns=columns, filter=condition).to_pandas()
+    df[DATE] = df[DATETIME].dt.floor("D")
+    return df.sort_values(DATETIME, kind="stable").reset_index(drop=True)
+
+
+def load_station(path_csv, columns=None, start=None, end=None):
+    """
+    Load the solutions of a merged CSV, from its Parquet store if there is
+    one; see read_store for the parameters. Without a store the CSV is
+    parsed and the date and datetime columns are added.
+    """
+    store = store_path(path_csv)
+    if os.path.isdir(store):
+        return read_store(store, columns, start, end)
+
+    df = add_dates(pd.read_csv(path_csv, index_col=False))
+    if start is not None:
+        df = df[df[DATETIME] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df[DATETIME] < pd.Timestamp(end)]
+    if columns is not None:
+        df = df[list(dict.fromkeys([name for name in columns if name in df.columns] + [DATE, DATETIME]))]
+    return df.reset_index(drop=True)
+
+
+def _store_dates(store):
+    """Return the sorted dates of the partitions of a store."""
+    return sorted(pd.Timestamp(name[len(DATE) + 1:]) for name in os.listdir(store) if name.startswith(DATE + "="))
+
+
+def iter_station(path_csv, columns=None, start=None, end=None, days=CHUNK_DAYS, rows=CHUNK_ROWS):
+    """
+    Yield the solutions of a merged CSV as DataFrames in date order; see
+    read_store for the parameters. A store is read days partitions at a
+    time, so days are never split; a CSV is parsed rows rows at a time.
+    """
+    store = store_path(path_csv)
+    if os.path.isdir(store):
+        dates = _store_dates(store)
+        if start is not None:
+            dates = [date for date in dates if date >= pd.Timestamp(start).floor("D")]
+        if end is not None:
+            dates = [date for date in dates if date < pd.Timestamp(end)]
+        for i in range(0, len(dates), days):
+            lower = dates[i] if start is None else max(dates[i], pd.Timestamp(start))
+            upper = dates[min(i + days, len(dates)) - 1] + pd.Timedelta(days=1)
+            if end is not None:
+                upper = min(upper, pd.Timestamp(end))
+            yield read_store(store, columns, lower, upper)
+        return
+
+    for df in pd.read_csv(path_csv, index_col=False, chunksize=rows):
+        df = add_dates(df)
+        if start is not None:
+            df = df[df[DATETIME] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df[DATETIME] < pd.Timestamp(end)]
+        if columns is not None:
+            df = df[list(dict.fromkeys([name for name in columns if name in df.columns] + [DATE, DATETIME]))]
+        yield df.reset_index(drop=True)
@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sub-daily horizontal velocities of kinematic CSRS-PPP solutions.
+
+Daily statistics give one speed per day. For surges and calving events the
+velocity is estimated from the 1 Hz solutions themselves:
+
+    1. positions are projected to east, north metres about the first
+       position of the station (ppp_projection.to_enu),
+    2. averaged in bins of a regular interval (by default the median
+       spacing of the first epochs read, e.g. 1 s or 30 s; missing bins are
+       gaps),
+    3. differentiated over a window (e.g. 1 h) centred on every step
+       (e.g. every 10 min) by one of:
+
+       lsq      weighted least-squares slope, from prefix sums (any window
+                length costs the same)
+       savgol   Savitzky-Golay derivative (polyorder), an FFT convolution
+       kalman   steady-state constant-velocity Kalman filter and
+                Rauch-Tung-Striebel smoother, run as IIR filters
+                (scipy.signal.lfilter); acceleration (m/s²) sets the
+                smoothing, the window only the minimum coverage; the
+                gains are those of the noise of the station, the
+                uncertainty follows the variance of each bin
+
+The uncertainty of each velocity is propagated from the position sigmas:
+optional 1-sigma columns in metres (sigmas=(north, east); the 95 % values of
+CSRS-PPP .pos files divided by 1.96), otherwise the noise of each component
+estimated from the differences of consecutive bins. The noise of the station
+(the variance of bins without a sigma, and that of the Kalman model) is
+estimated once, from its first NOISE_BINS bins with positions, so that the
+velocities do not depend on how many days are read at a time. The Kalman
+sigma leaves out the acceleration (process noise) of the model: like those of
+the other methods, it is the scatter due to the position noise alone.
+Velocities whose window is less than half covered, or reaches beyond the
+data, are NaN; a warning is issued if no window is covered (e.g. bins finer
+than the solutions).
+
+The station is read a few days at a time (ppp_store.iter_station), and only
+the bins still needed by the next windows are kept between chunks, so months
+of 1 Hz solutions are processed within a fixed memory budget.
+
+Output columns carry their units:
+
+    datetime, epochs, east_m_per_h, north_m_per_h, speed_m_per_h,
+    direction_deg, east_sigma_m_per_h, north_sigma_m_per_h,
+    speed_sigma_m_per_h
+
+Example:
+
+    python3 ppp_velocity.py lowell_corner.csv lowell_corner_velocity.csv --method kalman --window 1h --step 10min
+"""
+
+import argparse
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy import linalg, signal
+
+from ppp_daily import LATITUDE, LONGITUDE
+from ppp_projection import azimuth, to_enu
+from ppp_store import iter_station
+
+METHODS = ("lsq", "savgol", "kalman")
+
+VELOCITY_COLUMNS = ["datetime", "epochs", "east_m_per_h", "north_m_per_h", "speed_m_per_h", "direction_deg",
+                    "east_sigma_m_per_h", "north_sigma_m_per_h", "speed_sigma_m_per_h"]
+
+# Smallest fraction of the bins of a window with solutions
+MIN_COVERAGE = 0.5
+
+# Default standard deviation of the acceleration of the Kalman model (m/s²)
+ACCELERATION = 1e-7
+
+# Relative size of the transients left at the edges of a Kalman chunk
+SETTLE = 1e-3
+
+# Smallest position noise (m): the resolution of the CSV coordinates
+RESOLUTION = 1e-4
+
+# Bins with positions from which the noise of a station is estimated
+NOISE_BINS = 1000
+
+
+def _nanos(value):
+    return int(pd.Timedelta(value).value)
+
+
+def epoch_interval(times):
+    """Return the median spacing (ns, rounded to 0.1 s) of epochs (ns), or None with fewer than two epochs."""
+    spacing = np.diff(np.unique(times))
+    if len(spacing) == 0:
+        return None
+    return max(1, int(round(np.median(spacing) / 1e8))) * 100000000
+
+
+def noise_variance(values):
+    """Return the variance of the noise of a series from the MAD of the differences of its values (NaN gaps skipped)."""
+    diff = np.diff(values[np.isfinite(values)])
+    if len(diff) == 0:
+        return np.nan
+    mad = np.median(np.abs(diff - np.median(diff)))
+    return max((1.4826 * mad) ** 2 / 2, RESOLUTION ** 2)
+
+
+# -----------------------------------------------------------------------------
+# Bins
+# -----------------------------------------------------------------------------
+
+class _Grid:
+    """Regular bins of projected positions: the first bin index (since the origin) and per-bin arrays."""
+
+    FIELDS = ("count", "east", "north", "var_east", "var_north")
+
+    def __init__(self, first, **arrays):
+        self.first = first
+        for name in self.FIELDS:
+            setattr(self, name, arrays[name])
+
+    def __len__(self):
+        return len(self.count)
+
+    @property
+    def end(self):
+        return self.first + len(self)
+
+    @classmethod
+    def from_epochs(cls, bins, east, north, var_east, var_north):
+        first = int(bins[0])
+        index = bins - first
+        size = int(index[-1]) + 1
+        count = np.bincount(index, minlength=size)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            arrays = {
+                "count": count,
+                "east": np.bincount(index, east, size) / count,
+                "north": np.bincount(index, north, size) / count,
+                # Variance of the mean of the epochs of a bin
+                "var_east": np.bincount(index, var_east, size) / count ** 2,
+                "var_north": np.bincount(index, var_north, size) / count ** 2,
+            }
+        return cls(first, **arrays)
+
+    def append(self, other):
+        """Return the bins of self followed by those of other (later), with empty bins between."""
+        if len(self) == 0:
+            return other
+        gap = other.first - self.end
+        arrays = {}
+        for name in self.FIELDS:
+            fill = np.zeros(gap, dtype=np.int64) if name == "count" else np.full(gap, np.nan)
+            arrays[name] = np.concatenate([getattr(self, name), fill, getattr(other, name)])
+        return _Grid(self.first, **arrays)
+
+    def since(self, first):
+        """Return the bins from index first on."""
+        skip = max(0, first - self.first)
+        return _Grid(self.first + skip, **{name: getattr(self, name)[skip:] for name in self.FIELDS})
+
+
+def _window_sums(values, half):
+    """Return the sum of values over the window of half-width half bins centred on each bin."""
+    cumsum = np.r_[0.0, np.cumsum(values)]
+    index = np.arange(len(values))
+    return cumsum[np.minimum(index + half + 1, len(values))] - cumsum[np.maximum(index - half, 0)]
+
+
+def _filled(values):
+    """Return values with their NaN gaps linearly interpolated."""
+    present = np.isfinite(values)
+    if present.all() or not present.any():
+        return values
+    index = np.arange(len(values))
+    return np.interp(index, index[present], values[present])
+
+
+def _noise(values, variances):
+    """Return the noise variance of bins: the median of their known variances, or that of the differences of values."""
+    known = np.isfinite(values) & np.isfinite(variances)
+    noise = np.median(variances[known]) if known.any() else noise_variance(values)
+    return max(noise, RESOLUTION ** 2) if np.isfinite(noise) else RESOLUTION ** 2
+
+
+def _variances(variances, noise):
+    """Return the variances of the bins, the noise variance where unknown."""
+    return np.maximum(np.where(np.isfinite(variances), variances, noise), RESOLUTION ** 2)
+
+
+# -----------------------------------------------------------------------------
+# Methods: velocity (m per bin) and its variance at every bin
+# -----------------------------------------------------------------------------
+
+def lsq_slope(values, variances, half):
+    """
+    Return the weighted least-squares slope (per bin) of values over a
+    window of 2 half + 1 bins centred on each bin, and its variance.
+    """
+    present = np.isfinite(values)
+    weight = np.where(present, 1.0 / variances, 0.0)
+    # Small offsets and bin indices keep the prefix sums accurate
+    y = np.where(present, values - values[present][0], 0.0) if present.any() else np.zeros(len(values))
+    k = np.arange(len(values), dtype=np.float64)
+
+    s_w = _window_sums(weight, half)
+    s_wk = _window_sums(weight * k, half)
+    s_wkk = _window_sums(weight * k * k, half)
+    s_wy = _window_sums(weight * y, half)
+    s_wky = _window_sums(weight * k * y, half)
+
+    # Moments about the centre of each window
+    s_wx = s_wk - k * s_w
+    s_wxx = s_wkk - 2 * k * s_wk + k * k * s_w
+    s_wxy = s_wky - k * s_wy
+    with np.errstate(divide="ignore", invalid="ignore"):
+        determinant = s_w * s_wxx - s_wx ** 2
+        slope = (s_w * s_wxy - s_wx * s_wy) / determinant
+        variance = s_w / determinant
+    return slope, variance
+
+
+def savgol_slope(values, variances, half, polyorder=2):
+    """
+    Return the Savitzky-Golay derivative (per bin) of values over a window
+    of 2 half + 1 bins (gaps interpolated), and its variance.
+    """
+    coeffs = signal.savgol_coeffs(2 * half + 1, polyorder, deriv=1, use="conv")
+    slope = signal.oaconvolve(_filled(values), coeffs, mode="same")
+    variance = signal.oaconvolve(variances, coeffs ** 2, mode="same")
+    return slope, variance
+
+
+def kalman_model(interval, variance, acceleration=ACCELERATION):
+    """
+    Return the steady-state constant-velocity Kalman filter and smoother of
+    positions with a noise variance (m²) every interval (s).
+
+    Returns
+    -------
+    dict with filter (A, K: x[k] = A x[k-1] + K z[k]), smoother gain G,
+    noise variance R, smoothed covariance P (steady state) and settle (bins
+    until transients fall below SETTLE).
+    """
+    transition = np.array([[1.0, interval], [0.0, 1.0]])
+    observation = np.array([[1.0, 0.0]])
+    process = acceleration ** 2 * np.array([[interval ** 4 / 4, interval ** 3 / 2], [interval ** 3 / 2, interval ** 2]])
+    prior = linalg.solve_discrete_are(transition.T, observation.T, process, np.array([[variance]]))
+    gain = prior @ observation.T / (observation @ prior @ observation.T + variance)
+    posterior = (np.eye(2) - gain @ observation) @ prior
+    system = (np.eye(2) - gain @ observation) @ transition
+    smoother = posterior @ transition.T @ linalg.inv(prior)
+    smoothed = linalg.solve_discrete_lyapunov(smoother, posterior - smoother @ prior @ smoother.T)
+    radius = max(np.abs(linalg.eigvals(system)).max(), np.abs(linalg.eigvals(smoother)).max())
+    settle = int(np.ceil(np.log(SETTLE) / np.log(radius))) if radius > 0 else 1
+    return {"A": system, "K": gain, "G": smoother, "F": transition, "R": variance, "P": smoothed, "settle": settle}
+
+
+def _lfilter_state(A, B, u, output):
+    """Run x[k] = A x[k-1] + B u[k] (u: inputs by row) with lfilter and return row output of x."""
+    result = np.zeros(u.shape[1])
+    for i in range(u.shape[0]):
+        b, a = signal.ss2tf(A, B, A, B, input=i)
+        zi = signal.lfilter_zi(b[output], a) * u[i, 0]
+        result += signal.lfilter(b[output], a, u[i], zi=zi)[0]
+    return result
+
+
+def kalman_slope(values, model):
+    """Return the Kalman-smoothed velocity (per second) of values (gaps interpolated)."""
+    z = _filled(values)[np.newaxis, :]
+    position = _lfilter_state(model["A"], model["K"], z, 0)
+    velocity = _lfilter_state(model["A"], model["K"], z, 1)
+    # Backward pass on the reversed filtered states
+    states = np.vstack([position, velocity])[:, ::-1]
+    mixing = np.eye(2) - model["G"] @ model["F"]
+    return _lfilter_state(model["G"], mixing, np.ascontiguousarray(states), 1)[::-1]
+
+
+def kalman_variance(variances, model):
+    """
+    Return the variance (per second²) of the velocity of kalman_slope at
+    every bin, from the noise variance (m²) of every bin.
+
+    With the gains of the model (steady state for its noise variance R), the
+    smoothed velocity is a linear filter of the positions: its variance due
+    to the position noise is the convolution of the variances with the
+    squared impulse response. The acceleration of the model (the rest of the
+    steady-state P[1, 1]) is a prior on the motion, not an error of the
+    positions, and is left out.
+    """
+    # The response falls below SETTLE after settle bins, and no output needs more bins than there are
+    reach = min(model["settle"], len(variances))
+    impulse = np.zeros(2 * reach + 1)
+    impulse[reach] = 1.0
+    response = kalman_slope(impulse, model) ** 2
+    return signal.oaconvolve(variances, response, mode="same")
+
+
+# -----------------------------------------------------------------------------
+# Chunked evaluation
+# -----------------------------------------------------------------------------
+
+class _Estimator:
+    """Velocities of one station at every step, from bins fed in time order."""
+
+    def __init__(self, method, window, step, interval, acceleration, polyorder):
+        if method not in METHODS:
+            raise ValueError("Unknown method {0:s} (expected one of {1:s})".format(method, ", ".join(METHODS)))
+        self.method = method
+        self.window = _nanos(window)
+        self.step_ns = _nanos(step)
+        self.interval = None if interval is None else _nanos(interval)
+        self.acceleration = acceleration
+        self.polyorder = polyorder
+        self.origin = None
+        self.start = None          # first bin of the station
+        self.next = None           # next bin with an output
+        self.grid = None
+        self.noise = None          # noise variances (east, north) of the station, and its Kalman models
+        self.models = None
+        self.windows = 0           # outputs so far, and those with enough coverage
+        self.covered = 0
+
+    def bins(self, times):
+        """Return the index of the bins (centred on multiples of interval since the origin) of epochs (ns)."""
+        if self.origin is None:
+            if self.interval is None:
+                # A single epoch (the station has no other) gets 1 s bins
+                self.interval = epoch_interval(times) or _nanos("1s")
+            self.step = max(1, self.step_ns // self.interval)
+            self.half = max(1, self.window // self.interval // 2)
+            step = self.step * self.interval
+            self.origin = times[0] // step * step
+        return (times - self.origin + self.interval // 2) // self.interval
+
+    def add(self, grid):
+        if self.grid is None:
+            self.grid = grid
+            self.start = grid.first
+            self.next = -(-grid.first // self.step) * self.step
+        else:
+            self.grid = self.grid.append(grid)
+
+    def estimate_noise(self, final):
+        """
+        Estimate the noise of the station once, from its first NOISE_BINS
+        bins with positions (all of them if final), and return whether it is.
+        """
+        grid = self.grid
+        present = np.flatnonzero(np.isfinite(grid.east) & np.isfinite(grid.north))
+        if len(present) < NOISE_BINS and not final:
+            return False
+        end = present[NOISE_BINS - 1] + 1 if len(present) >= NOISE_BINS else len(grid)
+        self.noise = (_noise(grid.east[:end], grid.var_east[:end]), _noise(grid.north[:end], grid.var_north[:end]))
+        if self.method == "kalman":
+            self.models = [kalman_model(self.interval / 1e9, noise, self.acceleration) for noise in self.noise]
+        return True
+
+    def evaluate(self, final=False):
+        """Return the velocities that the bins received so far determine."""
+        grid = self.grid
+        if grid is None or len(grid) == 0 or (self.noise is None and not self.estimate_noise(final)):
+            return pd.DataFrame(columns=VELOCITY_COLUMNS)
+        seconds = self.interval / 1e9
+        var_east = _variances(grid.var_east, self.noise[0])
+        var_north = _variances(grid.var_north, self.noise[1])
+
+        if self.method == "kalman":
+            reach, rate = max(self.half, *(model["settle"] for model in self.models)), 1.0
+            estimates = [(kalman_slope(values, model), kalman_variance(variances, model))
+                         for values, variances, model in ((grid.east, var_east, self.models[0]),
+                                                          (grid.north, var_north, self.models[1]))]
+        else:
+            reach, rate = self.half, 1.0 / seconds
+            if self.method == "lsq":
+                estimates = [lsq_slope(grid.east, var_east, self.half), lsq_slope(grid.north, var_north, self.half)]
+            else:
+                estimates = [savgol_slope(grid.east, var_east, self.half, self.polyorder),
+                             savgol_slope(grid.north, var_north, self.half, self.polyorder)]
+
+        # Outputs whose bins (up to reach) have all been received
+        last = grid.end - 1 if final else grid.end - 1 - reach
+        centres = np.arange(self.next, last + 1, self.step)
+        index = centres - grid.first
+        present = (grid.count > 0).astype(np.float64)
+        coverage = _window_sums(present, self.half)[index] / (2 * self.half + 1)
+        epochs = _window_sums(grid.count.astype(np.float64), self.half)[index]
+        last_data = grid.first + np.flatnonzero(grid.count)[-1] if present.any() else grid.first
+        self.windows += len(centres)
+        self.covered += np.count_nonzero(coverage >= MIN_COVERAGE)
+        valid = (coverage >= MIN_COVERAGE) & (centres - reach >= self.start)
+        if final:
+            valid &= centres + reach <= last_data
+
+        (east, var_e), (north, var_n) = estimates
+        east = np.where(valid, east[index] * rate * 3600, np.nan)
+        north = np.where(valid, north[index] * rate * 3600, np.nan)
+        sigma_east = np.sqrt(var_e[index]) * rate * 3600
+        sigma_north = np.sqrt(var_n[index]) * rate * 3600
+        speed = np.hypot(east, north)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sigma_speed = np.sqrt((east * sigma_east) ** 2 + (north * sigma_north) ** 2) / speed
+
+        if len(centres):
+            self.next = int(centres[-1]) + self.step
+        self.grid = grid.since(self.next - max(reach, self.half))
+        return pd.DataFrame({
+            "datetime": pd.to_datetime(self.origin + centres * self.interval, unit="ns"),
+            "epochs": epochs.astype(np.int64),
+            "east_m_per_h": east,
+            "north_m_per_h": north,
+            "speed_m_per_h": speed,
+            "direction_deg": np.where(valid, azimuth(east, north), np.nan),
+            "east_sigma_m_per_h": np.where(valid, sigma_east, np.nan),
+            "north_sigma_m_per_h": np.where(valid, sigma_north, np.nan),
+            "speed_sigma_m_per_h": np.where(valid, sigma_speed, np.nan),
+        })
+
+
+def velocity_chunks(chunks, method="lsq", window="1h", step="10min", interval=None, sigmas=None,
+                    acceleration=ACCELERATION, polyorder=2, reference=None):
+    """
+    Return the velocities of a station read in chunks.
+
+    Parameters
+    ----------
+    chunks : iterable of DataFrame
+        Solutions in time order, with datetime, latitude and longitude
+        columns (e.g. ppp_store.iter_station).
+    method : str
+        "lsq", "savgol" or "kalman".
+    window, step, interval : str or Timedelta
+        Window of each velocity, time between velocities, and bin size
+        (default: the median spacing of the epochs of the first chunk).
+    sigmas : tuple of str
+        1-sigma columns (m) of the north and east positions, if any.
+    acceleration : float
+        Standard deviation of the acceleration of the Kalman model (m/s²).
+    polyorder : int
+        Order of the Savitzky-Golay polynomial.
+    reference : tuple of float
+        Origin of the projection (default: first position).
+
+    Returns
+    -------
+    DataFrame with VELOCITY_COLUMNS.
+    """
+    estimator = _Estimator(method, window, step, interval, acceleration, polyorder)
+    frames = []
+    pending = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        chunk = chunk.sort_values("datetime", kind="stable")
+        lat = chunk[LATITUDE].to_numpy(dtype=np.float64)
+        lon = chunk[LONGITUDE].to_numpy(dtype=np.float64)
+        if reference is None:
+            reference = (lat[0], lon[0], 0.0)
+        east, north, _ = to_enu(lat, lon, reference=reference)
+        epochs = {
+            "time": chunk["datetime"].to_numpy(dtype="datetime64[ns]").astype(np.int64),
+            "east": east,
+            "north": north,
+            "var_north": chunk[sigmas[0]].to_numpy(dtype=np.float64) ** 2 if sigmas else np.full(len(lat), np.nan),
+            "var_east": chunk[sigmas[1]].to_numpy(dtype=np.float64) ** 2 if sigmas else np.full(len(lat), np.nan),
+        }
+        if pending is not None:
+            epochs = {name: np.concatenate([pending[name], values]) for name, values in epochs.items()}
+        if estimator.interval is None and epoch_interval(epochs["time"]) is None:
+            # The bin size is inferred from the spacing of the epochs: wait for a second one
+            pending = epochs
+            continue
+
+        # The last bin may continue in the next chunk
+        bins = estimator.bins(epochs["time"])
+        done = bins < bins[-1]
+        pending = {name: values[~done] for name, values in epochs.items()}
+        if done.any():
+            estimator.add(_Grid.from_epochs(bins[done], *(epochs[name][done] for name in _Grid.FIELDS[1:])))
+            frames.append(estimator.evaluate())
+
+    if pending is not None and len(pending["time"]):
+        bins = estimator.bins(pending["time"])
+        estimator.add(_Grid.from_epochs(bins, *(pending[name] for name in _Grid.FIELDS[1:])))
+    frames.append(estimator.evaluate(final=True))
+    if estimator.windows and not estimator.covered:
+        warnings.warn("No window ({0}) has {1:.0%} of its {2:g} s bins with solutions: all velocities are NaN"
+                      .format(window, MIN_COVERAGE, estimator.interval / 1e9))
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return pd.DataFrame(columns=VELOCITY_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def station_velocity(path_csv, method="lsq", window="1h", step="10min", interval=None, sigmas=None,
+                     acceleration=ACCELERATION, polyorder=2, start=None, end=None, days=1):
+    """
+    Return the velocities of a merged CSV (or its Parquet store), read days
+    days at a time; see velocity_chunks for the parameters.
+    """
+    columns = [LATITUDE, LONGITUDE] + (list(sigmas) if sigmas else [])
+    chunks = iter_station(path_csv, columns, start, end, days=days, rows=days * 86400)
+    return velocity_chunks(chunks, method, window, step, interval, sigmas, acceleration, polyorder)
+
+
+# -----------------------------------------------------------------------------
+# Command line
+# -----------------------------------------------------------------------------
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Estimate sub-daily velocities of kinematic CSRS-PPP solutions")
+    parser.add_argument("station", help="Merged CSV of the solutions (its Parquet store is used if there is one)")
+    parser.add_argument("output", help="CSV of the velocities")
+    parser.add_argument("--method", choices=METHODS, default="lsq", help="Estimator (default=lsq)")
+    parser.add_argument("--window", type=str, default="1h", help="Window of each velocity (default=1h)")
+    parser.add_argument("--step", type=str, default="10min", help="Time between velocities (default=10min)")
+    parser.add_argument("--interval", type=str,
+                        help="Bin size of the positions (default=median spacing of the first epochs)")
+    parser.add_argument("--sigmas", type=str,
+                        help="Comma-separated 1-sigma columns (m) of the north and east positions")
+    parser.add_argument("--acceleration", type=float, default=ACCELERATION,
+                        help="Acceleration standard deviation of the Kalman model in m/s^2 (default={})".format(
+                            ACCELERATION))
+    parser.add_argument("--polyorder", type=int, default=2, help="Savitzky-Golay polynomial order (default=2)")
+    parser.add_argument("--start", type=str, help="First date (YYYY-MM-DD)")
+    parser.add_argument("--end", type=str, help="End date (YYYY-MM-DD, excluded)")
+    parser.add_argument("--days", type=int, default=1, help="Days read at a time (default=1)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sigmas = tuple(name.strip() for name in args.sigmas.split(",")) if args.sigmas else None
+    velocities = station_velocity(args.station, args.method, args.window, args.step, args.interval, sigmas,
+                                  args.acceleration, args.polyorder, args.start, args.end, args.days)
+    velocities.to_csv(args.output, index=False)
+    print("{} velocities written to {}".format(len(velocities), args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming decimation, windowing and thinning of RINEX observation files.
+
+Daily 1 Hz observation files are much larger than CSRS-PPP needs for daily
+positions. filter_rinex copies a RINEX 2.xx or 3.xx observation file line by
+line, keeping only
+
+    * epochs on multiples of an interval (e.g. 30 s),
+    * epochs within a time window,
+    * satellites of some constellations,
+    * some observables (e.g. code and phase only),
+
+and rewrites the header to match. The file is never held in memory, so the
+filter can run in front of the compression of an upload (see
+csrs_ppp_upload.prepare_upload).
+
+Example:
+
+    python3 rinex_filter.py belcher_upper_20220619.obs filtered.obs --decimate 30 --systems GR \
+        --observables "C*,L*"
+"""
+
+import argparse
+import datetime
+import fnmatch
+import math
+import sys
+from collections import namedtuple
+
+RinexFilter = namedtuple("RinexFilter", ["interval", "start", "end", "systems", "observables"],
+                         defaults=[None, None, None, None, None])
+RinexFilter.__doc__ = ("Epochs and observations kept: interval (s), start and end (datetime, GPS time), "
+                       "systems (RINEX system letters, e.g. 'GR') and observables (fnmatch patterns of "
+                       "observation codes, e.g. ('C*', 'L*')).")
+
+# Header records that no longer hold once epochs or observables are dropped
+_DROPPED_RECORDS = ("TIME OF LAST OBS", "# OF SATELLITES", "PRN / # OF OBS")
+
+
+def is_active(spec):
+    """Return True if spec filters anything."""
+    return spec is not None and any(value for value in spec)
+
+
+def filter_params(spec):
+    """Return a JSON-serialisable description of a filter, for job parameters and cache keys."""
+    if not is_active(spec):
+        return None
+    return {
+        "interval": spec.interval,
+        "start": spec.start.isoformat() if spec.start else None,
+        "end": spec.end.isoformat() if spec.end else None,
+        "systems": "".join(sorted(spec.systems)) if spec.systems else None,
+        "observables": sorted(spec.observables) if spec.observables else None,
+    }
+
+
+def _label(line):
+    return line[60:].strip()
+
+
+def _epoch_time(year, month, day, hour, minute, seconds):
+    if year < 100:
+        year += 2000 if year < 80 else 1900
+    return datetime.datetime(year, month, day, hour, minute) + datetime.timedelta(seconds=seconds)
+
+
+def _first_obs_line(line, spec):
+    """Return the TIME OF FIRST OBS record moved to the first epoch kept by spec."""
+    values = line[:43].split()
+    first = _epoch_time(*(int(v) for v in values[:5]), float(values[5]))
+    if spec.start and spec.start > first:
+        first = spec.start
+    if spec.interval:
+        midnight = datetime.datetime(first.year, first.month, first.day)
+        seconds = (first - midnight).total_seconds()
+        first = midnight + datetime.timedelta(seconds=math.ceil(seconds / spec.interval - 1e-6) * spec.interval)
+    return "{0:6d}{1:6d}{2:6d}{3:6d}{4:6d}{5:13.7f}{6:s}".format(
+        first.year, first.month, first.day, first.hour, first.minute,
+        first.second + first.microsecond / 1e6, line[43:])
+
+
+def _keep_epoch(time, spec):
+    if spec.start and time < spec.start:
+        return False
+    if spec.end and time > spec.end:
+        return False
+    if spec.interval:
+        seconds = time.hour * 3600 + time.minute * 60 + time.second + time.microsecond / 1e6
+        if abs(seconds - round(seconds / spec.interval) * spec.interval) > 0.005:
+            return False
+    return True
+
+
+def _keep_observable(code, spec):
+    return not spec.observables or any(fnmatch.fnmatchcase(code, pattern) for pattern in spec.observables)
+
+
+def _keep_system(system, spec):
+    return not spec.systems or (system or "G") in spec.systems
+
+
+def _fields(line, count, offset=0):
+    """Split the 16-character observation fields of a record."""
+    line = line.rstrip("\r\n")
+    return [line[offset + 16 * i:offset + 16 * (i + 1)].ljust(16) for i in range(count)]
+
+
+# -----------------------------------------------------------------------------
+# RINEX 3
+# -----------------------------------------------------------------------------
+
+def _filter_v3(lines, header, spec):
+    # Observation types of each system
+    types = {}
+    system = None
+    for line in header:
+        if _label(line) == "SYS / # / OBS TYPES":
+            if line[0] != " ":
+                system = line[0]
+                types[system] = []
+            types[system] += line[7:58].split()
+    keep = {s: [i for i, code in enumerate(codes) if _keep_observable(code, spec)]
+            for s, codes in types.items() if _keep_system(s, spec)}
+
+    written_types = False
+    for line in header:
+        label = _label(line)
+        if label in _DROPPED_RECORDS:
+            continue
+        if label == "SYS / # / OBS TYPES":
+            if not written_types:
+                written_types = True
+                for s, indices in keep.items():
+                    codes = [types[s][i] for i in indices]
+                    for i in range(0, len(codes), 13):
+                        prefix = "{0:1s}  {1:3d}".format(s, len(codes)) if i == 0 else " " * 6
+                        yield "{0:<60s}SYS / # / OBS TYPES\n".format(
+                            prefix + "".join(" {0:3s}".format(c) for c in codes[i:i + 13]))
+            continue
+        if label == "SYS / PHASE SHIFT" and line[0] != " ":
+            code = line[2:5].strip()
+            if line[0] not in keep or (code and not _keep_observable(code, spec)):
+                continue
+        if label == "INTERVAL" and spec.interval:
+            line = "{0:10.3f}{1:50s}INTERVAL\n".format(spec.interval, "")
+        if label == "TIME OF FIRST OBS" and (spec.interval or spec.start):
+            line = _first_obs_line(line, spec)
+        yield line
+
+    lines = iter(lines)
+    for line in lines:
+        if not line.startswith(">"):
+            continue
+        flag = int(line[31:32] or 0)
+        count = int(line[32:35])
+        if 2 <= flag <= 5:
+            # Event: count special records follow
+            yield line
+            for _ in range(count):
+                yield next(lines)
+            continue
+
+        records = [next(lines) for _ in range(count)]
+        time = _epoch_time(int(line[2:6]), int(line[7:9]), int(line[10:12]), int(line[13:15]), int(line[16:18]),
+                           float(line[18:29]))
+        if not _keep_epoch(time, spec):
+            continue
+        kept = []
+        for record in records:
+            s = record[0]
+            if s not in keep:
+                continue
+            fields = _fields(record, len(types[s]), 3)
+            kept.append((record[:3] + "".join(fields[i] for i in keep[s])).rstrip() + "\n")
+        if kept:
+            yield line[:32] + "{0:3d}".format(len(kept)) + line[35:]
+            for record in kept:
+                yield record
+
+
+# -----------------------------------------------------------------------------
+# RINEX 2
+# -----------------------------------------------------------------------------
+
+def _satellites(line, lines, count):
+    """Return the satellites of a RINEX 2 epoch record, reading continuation lines as needed."""
+    satellites = []
+    while True:
+        for i in range(12):
+            if len(satellites) == count:
+                return satellites
+            satellites.append(line[32 + 3 * i:35 + 3 * i])
+        line = next(lines)
+
+
+def _filter_v2(lines, header, spec):
+    types = []
+    for line in header:
+        if _label(line) == "# / TYPES OF OBSERV":
+            types += line[6:60].split()
+    indices = [i for i, code in enumerate(types) if _keep_observable(code, spec)]
+    codes = [types[i] for i in indices]
+
+    written_types = False
+    for line in header:
+        label = _label(line)
+        if label in _DROPPED_RECORDS:
+            continue
+        if label == "# / TYPES OF OBSERV":
+            if not written_types:
+                written_types = True
+                for i in range(0, max(len(codes), 1), 9):
+                    prefix = "{0:6d}".format(len(codes)) if i == 0 else " " * 6
+                    yield "{0:<60s}# / TYPES OF OBSERV\n".format(
+                        prefix + "".join("{0:>6s}".format(c) for c in codes[i:i + 9]))
+            continue
+        if label == "INTERVAL" and spec.interval:
+            line = "{0:10.3f}{1:50s}INTERVAL\n".format(spec.interval, "")
+        if label == "TIME OF FIRST OBS" and (spec.interval or spec.start):
+            line = _first_obs_line(line, spec)
+        yield line
+
+    lines_per_sat = max(1, math.ceil(len(types) / 5))
+    lines = iter(lines)
+    for line in lines:
+        if len(line) < 32 or not line[28].isdigit():
+            continue
+        flag = int(line[28])
+        count = int(line[29:32])
+        if 2 <= flag <= 5:
+            yield line
+            for _ in range(count):
+                yield next(lines)
+            continue
+
+        satellites = _satellites(line, lines, count)
+        records = [[next(lines) for _ in range(lines_per_sat)] for _ in satellites]
+        time = _epoch_time(int(line[1:3]), int(line[4:6]), int(line[7:9]), int(line[10:12]), int(line[13:15]),
+                           float(line[15:26]))
+        if not _keep_epoch(time, spec):
+            continue
+
+        kept = []
+        for sat, record in zip(satellites, records):
+            if not _keep_system(sat[0].strip(), spec):
+                continue
+            fields = [field for part in record for field in _fields(part, 5)][:len(types)]
+            fields = [fields[i] for i in indices]
+            kept.append((sat, ["".join(fields[i:i + 5]).rstrip() + "\n" for i in range(0, max(len(fields), 1), 5)]))
+        if not kept:
+            continue
+
+        clock = line[68:80].rstrip("\r\n") if len(line) > 68 else ""
+        sats = [sat for sat, _ in kept]
+        head = line[:29] + "{0:3d}".format(len(sats)) + "".join(sats[:12])
+        yield (head.ljust(68) + clock).rstrip() + "\n"
+        for i in range(12, len(sats), 12):
+            yield " " * 32 + "".join(sats[i:i + 12]) + "\n"
+        for _, record in kept:
+            for part in record:
+                yield part
+
+
+# -----------------------------------------------------------------------------
+# Files
+# -----------------------------------------------------------------------------
+
+def filter_lines(lines, spec):
+    """Yield the lines of a RINEX observation file (an iterable of str) filtered by spec."""
+    lines = iter(lines)
+    header = []
+    for line in lines:
+        header.append(line)
+        if _label(line) == "END OF HEADER":
+            break
+    version = float(header[0][:9]) if header else 0.0
+    if version >= 3:
+        yield from _filter_v3(lines, header, spec)
+    else:
+        yield from _filter_v2(lines, header, spec)
+
+
+def filter_rinex(source, target, spec):
+    """
+    Copy a RINEX observation file from source to target (binary file
+    objects), filtered by spec. Returns the number of bytes written.
+    """
+    lines = (line.decode("ascii", errors="replace") for line in source)
+    written = 0
+    for line in filter_lines(lines, spec):
+        data = line.encode("ascii", errors="replace")
+        target.write(data)
+        written += len(data)
+    return written
+
+
+# -----------------------------------------------------------------------------
+# Command line
+# -----------------------------------------------------------------------------
+
+def add_filter_arguments(parser):
+    """Add the filter options to an argparse parser."""
+    parser.add_argument("--decimate", type=float, help="Keep only epochs on multiples of this interval (s)")
+    parser.add_argument("--start", type=datetime.datetime.fromisoformat,
+                        help="Drop epochs before this time (GPS time, YYYY-MM-DDTHH:MM:SS)")
+    parser.add_argument("--end", type=datetime.datetime.fromisoformat,
+                        help="Drop epochs after this time (GPS time, YYYY-MM-DDTHH:MM:SS)")
+    parser.add_argument("--systems", type=str.upper, help="Constellations kept (RINEX letters, e.g. GR)")
+    parser.add_argument("--observables", type=str,
+                        help="Comma-separated observation codes kept, wildcards allowed (e.g. \"C*,L*\")")
+
+
+def filter_from_args(args):
+    """Return the RinexFilter of parsed filter options, or None if they filter nothing."""
+    observables = tuple(code.strip() for code in args.observables.split(",")) if args.observables else None
+    spec = RinexFilter(args.decimate, args.start, args.end, args.systems, observables)
+    return spec if is_active(spec) else None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Decimate, window and thin a RINEX observation file")
+    parser.add_argument("source", help="RINEX observation file")
+    parser.add_argument("target", help="Filtered RINEX observation file")
+    add_filter_arguments(parser)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    spec = filter_from_args(args) or RinexFilter()
+    with open(args.source, "rb") as source, open(args.target, "wb") as target:
+        written = filter_rinex(source, target, spec)
+    print("{} -> {} ({} bytes)".format(args.source, args.target, written))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,25 +12,22 @@ import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
 import matplotlib.dates as mdates
 import cartopy.crs as ccrs
-import pyproj
+from ppp_compare import compare
+from ppp_store import load_station
 
 
 # -----------------------------------------------------------------------------
 # Plot concatenated output data
 # -----------------------------------------------------------------------------
 
-# Load data
-df1 = pd.read_csv("/Users/adam/Desktop/gnss/data/lowell_corner/lowell_corner_kinematic.csv", index_col=False)
-df2 = pd.read_csv("/Users/adam/Desktop/gnss/data/lowell_corner/lowell_corner_static.csv", index_col=False)
-
-# Add date column
-df1["date"] = pd.to_datetime(df1["year"] * 1000 + df1["day_of_year"], format="%Y%j")
-df2["date"] = pd.to_datetime(df2["year"] * 1000 + df2["day_of_year"], format="%Y%j")
-
-
 start = "2022-05-31"
 stop = "2022-06-08"
 
+# Load data (only the dates plotted, from the Parquet stores if there are any), with a date column
+columns = ["latitude_decimal_degree", "longitude_decimal_degree"]
+df1 = load_station("/Users/adam/Desktop/gnss/data/lowell_corner/lowell_corner_kinematic.csv", columns, start, stop)
+df2 = load_station("/Users/adam/Desktop/gnss/data/lowell_corner/lowell_corner_static.csv", columns, start, stop)
+
 # Subset by date
 df1 = df1[(df1["date"] > start) & (df1["date"] < stop)]
 df2 = df2[(df2["date"] > start) & (df2["date"] < stop)]
@@ -96,14 +93,13 @@ df2 = pd.read_csv("/Users/adam/Desktop/gnss/data/statistics/lowell_corner_stats_
 df1["date"] = pd.to_datetime(df1["date"].astype(str), format="%Y-%m-%d")
 df2["date"] = pd.to_datetime(df2["date"].astype(str), format="%Y-%m-%d")
 
-# Create empty data frame
-df3 = pd.DataFrame()
-df3["date"] = df1["date"]
-df3["delta"] = df1["distance"] - df2["distance"]
+# Join on date (not row position): delta = df1 - df2
+# Difference of the daily displacements (distance_m of ppp_stats.py), in cm
+df3 = compare(df1, df2, on="date", columns=["distance_m"])
+df3["delta"] = df3["distance_m_delta"] * 100
 
-df4 = pd.DataFrame()
-df4["date"] = df1["date"]
-df4["delta"] = df1["distance"] - df2["distance"]
+df4 = compare(df1, df2, on="date", columns=["distance_m"])
+df4["delta"] = df4["distance_m_delta"] * 100
 
 
 
@@ -136,23 +132,21 @@ df2 = pd.read_csv("/Users/adam/Desktop/gnss/data/statistics/lowell_corner_stats_
 df1["date"] = pd.to_datetime(df1["date"].astype(str), format="%Y-%m-%d")
 df2["date"] = pd.to_datetime(df2["date"].astype(str), format="%Y-%m-%d")
 
-# Create empty data frame
-df3 = pd.DataFrame()
-df3["date"] = df1["date"]
-df3["delta"] = df1["distance"] - df2["distance"]
+# Join on date (not row position): delta = df1 - df2
+# Difference of the daily displacements (distance_m of ppp_stats.py), in cm
+df3 = compare(df1, df2, on="date", columns=["distance_m"])
+df3["delta"] = df3["distance_m_delta"] * 100
 
-# Create empty data frame
-df4 = pd.DataFrame()
-df4["date"] = df1["date"]
-df4["delta"] = df1["distance"] - df2["distance"]
+df4 = compare(df1, df2, on="date", columns=["distance_m"])
+df4["delta"] = df4["distance_m_delta"] * 100
     
 
 # Daily displacement
 fig, ax = plt.subplots(figsize=(10,5))
 ax.grid(ls="dotted")
-sns.lineplot(x="date", y="distance", data=df1, color="#0173b2", errorbar=None, label="Static Mean")
-sns.lineplot(x="date", y="distance", data=df2, color="#de8f05", errorbar=None, label="Kinematic Mean")
-ax.set(xlabel=None, ylabel="Static - Kinematic Δ (cm)")
+sns.lineplot(x="date", y="distance_m", data=df1, color="#0173b2", errorbar=None, label="Static Mean")
+sns.lineplot(x="date", y="distance_m", data=df2, color="#de8f05", errorbar=None, label="Kinematic Mean")
+ax.set(xlabel=None, ylabel="Daily displacement (m)")
 plt.xticks(rotation=45, horizontalalignment="center")
 ax.xaxis.set_major_locator(mdates.MonthLocator(interval=interval))
 sns.despine()
@@ -190,50 +184,22 @@ df1.columns
 df1["date"] = pd.to_datetime(df1["date"].astype(str), format="%Y-%m-%d")
 df2["date"] = pd.to_datetime(df2["date"].astype(str), format="%Y-%m-%d")
 
-# Create empty data frame
-df3 = pd.DataFrame()
-df3["date"] = df1["date"]
-df3["lat1"] = df1["latitude_decimal_degree"] 
-df3["lon1"] = df1["longitude_decimal_degree"]
-df3["lat2"] = df2["latitude_decimal_degree"] 
-df3["lon2"] = df2["longitude_decimal_degree"]
+# Join on date and calculate the horizontal distance between the static and kinematic positions, in cm
+df3 = compare(df1, df2, on="date")
+df3["distance"] = df3["distance_m"] * 100
 
-# Initialize pyproj with appropriate ellipsoid
-geodesic = pyproj.Geod(ellps="WGS84")
-    
-# Calculate forward azimuth and great circle distance between modelled coordinates
-direction, back_azimuth, df3["distance"] = geodesic.inv(df3["lon1"].tolist(), 
-                                                       df3["lat1"].tolist(),
-                                                       df3["lon2"].tolist(), 
-                                                       df3["lat2"].tolist())
-df3["distance"] = df3["distance"] * 100
-
-
-# Create empty data frame
-df4 = pd.DataFrame()
-df4["date"] = df1["date"]
-df4["delta"] = df1["distance"] - df2["distance"]
-df4["lat1"] = df1["latitude_decimal_degree"] 
-df4["lon1"] = df1["longitude_decimal_degree"]
-df4["lat2"] = df2["latitude_decimal_degree"] 
-df4["lon2"] = df2["longitude_decimal_degree"]
-
-# Calculate forward azimuth and great circle distance between modelled coordinates
-direction, back_azimuth, df4["distance"] = geodesic.inv(df4["lon1"].tolist(), 
-                                                       df4["lat1"].tolist(),
-                                                       df4["lon2"].tolist(), 
-                                                       df4["lat2"].tolist())
-
-df4["distance"] = df4["distance"] * 100
+df4 = compare(df1, df2, on="date", columns=["distance_m", "speed_m_per_h"])
+df4["delta"] = df4["distance_m_delta"] * 100
+df4["distance"] = df4["distance_m"] * 100
 
 # Delta
 fig, ax = plt.subplots(figsize=(10,5))
 ax.grid(ls="dotted")
-sns.lineplot(x="date", y="speed", data=df1, label="Lowell Upper Speed")
-sns.lineplot(x="date", y="speed", data=df2, label="Lowell Corner Speed")
+sns.lineplot(x="date", y="speed_m_per_h", data=df1, label="Lowell Upper Speed")
+sns.lineplot(x="date", y="speed_m_per_h", data=df2, label="Lowell Corner Speed")
 #sns.scatterplot(x="date", y="distance", data=df3, s=25, label="Lowell Upper Delta")
 #sns.scatterplot(x="date", y="distance", data=df4, s=25, label="Lowell Corner Delta")
-ax.set(xlabel=None, ylabel="Static - Kinematic Δ (cm)")
+ax.set(xlabel=None, ylabel="Speed (m h-1)")
 plt.xticks(rotation=45, horizontalalignment="center")
 ax.xaxis.set_major_locator(mdates.MonthLocator(interval=interval))
 sns.despine()
@@ -244,11 +210,11 @@ plt.savefig(path_figures + "lowell_static_kinematic_delta_position.png", dpi=dpi
 # Delta
 fig, ax = plt.subplots(figsize=(10,5))
 ax.grid(ls="dotted")
-sns.lineplot(x="date", y="speed", data=df1, label="Lowell Upper Speed")
-sns.lineplot(x="date", y="speed", data=df2, label="Lowell Corner Speed")
+sns.lineplot(x="date", y="speed_m_per_h", data=df1, label="Lowell Upper Speed")
+sns.lineplot(x="date", y="speed_m_per_h", data=df2, label="Lowell Corner Speed")
 sns.lineplot(x="date", y="distance", data=df3, label="Lowell Upper Delta")
 sns.lineplot(x="date", y="distance", data=df4,  label="Lowell Corner Delta")
-ax.set(xlabel=None, ylabel="Static - Kinematic Δ (cm)")
+ax.set(xlabel=None, ylabel="Speed (m h-1), Static - Kinematic Δ (cm)")
 plt.xticks(rotation=45, horizontalalignment="center")
 ax.xaxis.set_major_locator(mdates.MonthLocator(interval=interval))
 sns.despine()
@@ -256,15 +222,16 @@ ax.legend(loc="center", bbox_to_anchor=(0.5, -0.35), ncol=2)
 plt.savefig(path_figures + "lowell_static_kinematic_delta_position.png", dpi=dpi, transparent=False, bbox_inches="tight")
 
 
-df4["speed"] = df2["speed"]
-df4["displacement"] = df2["distance"]
+# Speed (m/h over the time elapsed between daily positions) and daily displacement (m) of the kinematic solutions
+df4["speed"] = df4["speed_m_per_h_b"]
+df4["displacement"] = df4["distance_m_b"]
 
 import seaborn as sns
 
 fig, ax = plt.subplots(figsize=(10,6))
 ax.grid(ls="dotted")
 sns.regplot(x="displacement", y="distance", data=df4)
-ax.set(xlabel="Speed (cm d-1)", ylabel="Distance (cm)")
+ax.set(xlabel="Daily displacement (m d-1)", ylabel="Distance (cm)")
 
 plt.savefig(path_figures + "speed_displacement_regplot.png", dpi=dpi, transparent=False, bbox_inches="tight")
 
@@ -0,0 +1,40 @@
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+import ppp_store
+
+HEADER = b"latitude_decimal_degree,longitude_decimal_degree,rcvr_clk_ns,year,day_of_year,decimal_hour\n"
+
+
+def rows(day, clock):
+    return [b"80.0,-70.0,%s,2022,%d,%f\n" % (clock, day, hour) for hour in (0.0, 0.5, 1.0)]
+
+
+def test_archives_with_different_inferred_types(tmp_path):
+    store = str(tmp_path / "station.parquet")
+    # pd.read_csv infers int64 for the first archive and float64 for the second
+    ppp_store.write_rows(store, "a_full_output.zip", HEADER, rows(170, b"1"))
+    ppp_store.write_rows(store, "b_full_output.zip", HEADER, rows(171, b"1.5"))
+
+    df = ppp_store.read_store(store)
+    assert len(df) == 6
+    assert df["rcvr_clk_ns"].dtype == "float64"
+    assert df["rcvr_clk_ns"].tolist() == [1.0] * 3 + [1.5] * 3
+    assert df["year"].dtype == "int16"
+    assert len(ppp_store.load_station(str(tmp_path / "station.csv"), ["rcvr_clk_ns"], "2022-06-20")) == 3
+
+
+def test_store_written_with_integer_columns(tmp_path):
+    store = str(tmp_path / "station.parquet")
+    # A file of a store written before the types were fixed, then a float64 one
+    table = ppp_store.to_table(pd.read_csv(io.BytesIO(HEADER + b"".join(rows(170, b"1")))))
+    table = table.set_column(table.schema.get_field_index("rcvr_clk_ns"), "rcvr_clk_ns",
+                             table.column("rcvr_clk_ns").cast(pa.int64()))
+    ds.write_dataset(table, store, format="parquet", partitioning=["date"], partitioning_flavor="hive",
+                     basename_template="a_full_output-{i}.parquet")
+    ppp_store.write_rows(store, "b_full_output.zip", HEADER, rows(171, b"1.5"))
+
+    assert ppp_store.read_store(store)["rcvr_clk_ns"].tolist() == [1.0] * 3 + [1.5] * 3
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ppp_daily import LATITUDE, LONGITUDE
+from ppp_velocity import velocity_chunks
+
+EAST, NORTH = 0.03, 0.05    # m/h
+NOISE = 0.01                # m
+
+
+def solutions(interval=30, days=2, sigma=False):
+    """Positions every interval (s) moving at a constant velocity, with 1 cm of noise and ms timestamp jitter."""
+    rng = np.random.default_rng(0)
+    times = pd.date_range("2024-01-01", periods=days * 86400 // interval, freq="{0:d}s".format(interval))
+    times = times + pd.to_timedelta(rng.integers(-2, 3, len(times)), unit="ms")
+    hours = np.arange(len(times)) * interval / 3600
+    east = EAST * hours + rng.normal(0, NOISE, len(times))
+    north = NORTH * hours + rng.normal(0, NOISE, len(times))
+    df = pd.DataFrame({
+        "datetime": times,
+        LATITUDE: 70.0 + north / 111250.0,
+        LONGITUDE: -50.0 + east / (111250.0 * np.cos(np.radians(70.0))),
+    })
+    if sigma:
+        df["sigma_north"] = df["sigma_east"] = NOISE
+    return df
+
+
+def chunked(df, freq):
+    return [chunk for _, chunk in df.groupby(df["datetime"].dt.floor(freq))]
+
+
+@pytest.mark.parametrize("method", ["lsq", "savgol", "kalman"])
+def test_known_velocity(method):
+    velocities = velocity_chunks(chunked(solutions(), "1D"), method=method).dropna()
+    assert len(velocities) > 250
+    for component, truth in (("east", EAST), ("north", NORTH)):
+        values = velocities[component + "_m_per_h"]
+        sigma = velocities[component + "_sigma_m_per_h"].median()
+        assert abs(values.mean() - truth) < sigma
+        # The sigma is that of the position noise: the scatter about the true velocity
+        assert 0.7 < sigma / np.sqrt(np.mean((values - truth) ** 2)) < 1.4
+
+
+@pytest.mark.parametrize("method", ["lsq", "savgol", "kalman"])
+@pytest.mark.parametrize("sigmas", [None, ("sigma_north", "sigma_east")])
+def test_chunked_as_single(method, sigmas):
+    df = solutions(sigma=sigmas is not None)
+    single = velocity_chunks([df], method=method, sigmas=sigmas)
+    chunks = velocity_chunks(chunked(df, "7h"), method=method, sigmas=sigmas)
+    pd.testing.assert_frame_equal(chunks[["datetime", "epochs"]], single[["datetime", "epochs"]])
+    # The Kalman filters restart at every chunk, with transients below SETTLE of the velocity
+    atol = 2e-4 if method == "kalman" else 1e-9
+    columns = [name for name in single.columns if name.endswith("_m_per_h")]
+    pd.testing.assert_frame_equal(chunks[columns], single[columns], check_exact=False, rtol=0, atol=atol)
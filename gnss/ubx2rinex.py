@@ -0,0 +1,576 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Native conversion of u-blox logs (UBX) to RINEX 3.04.
+
+Raw measurements (UBX-RXM-RAWX) are written to a RINEX observation file and
+GPS LNAV ephemerides decoded from the navigation data subframes
+(UBX-RXM-SFRBX) to a RINEX navigation file, without RTKLIB.
+
+The log is read in chunks; UBX frames are located and their checksums
+verified with NumPy over the whole chunk at once, and the measurement blocks
+of every RAWX frame in the chunk are gathered into one structured array.
+Epochs can be decimated to a coarser interval while converting.
+
+The conversion makes two passes over the log: the first collects the
+observation types, GLONASS frequency channels, first and last epochs and the
+ephemerides needed for the header and navigation file; the second writes the
+observations.
+
+Example:
+
+    python3 ubx2rinex.py belcher_upper_20220619.ubx -d RINEX/ --interval 30
+"""
+
+import argparse
+import datetime
+import math
+import os
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Largest UBX frame: sync (2), class and id (2), length (2), payload, checksum (2)
+MAX_FRAME = 65535 + 8
+
+RXM = 0x02
+RAWX = 0x15
+SFRBX = 0x13
+
+GPS_EPOCH = datetime.datetime(1980, 1, 6)
+WEEK_SECONDS = 604800
+
+# RINEX system of each UBX gnssId
+SYSTEMS = {0: "G", 1: "S", 2: "E", 3: "C", 5: "J", 6: "R"}
+
+# Order of the systems in the header and in each epoch
+SYSTEM_ORDER = "GRECJS"
+
+# RINEX band and attribute of each (gnssId, sigId)
+SIGNALS = {
+    (0, 0): "1C", (0, 3): "2L", (0, 4): "2S", (0, 6): "5I", (0, 7): "5Q",
+    (1, 0): "1C",
+    (2, 0): "1C", (2, 1): "1B", (2, 3): "5I", (2, 4): "5Q", (2, 5): "7I", (2, 6): "7Q",
+    (3, 0): "2I", (3, 1): "2I", (3, 2): "7I", (3, 3): "7I", (3, 5): "1P", (3, 7): "5P",
+    (5, 0): "1C", (5, 1): "1Z", (5, 4): "2S", (5, 5): "2L", (5, 8): "5I", (5, 9): "5Q",
+    (6, 0): "1C", (6, 2): "2C",
+}
+
+# Lookup tables indexed by gnssId (and sigId)
+_KNOWN = np.zeros((256, 256), dtype=bool)
+for _gnss, _sig in SIGNALS:
+    _KNOWN[_gnss, _sig] = True
+_RANK = np.full(256, len(SYSTEM_ORDER), dtype=np.int64)
+for _gnss, _system in SYSTEMS.items():
+    _RANK[_gnss] = SYSTEM_ORDER.index(_system)
+
+# Measurement block of a RAWX frame
+RAWX_MEAS = np.dtype([("pr", "<f8"), ("cp", "<f8"), ("do", "<f4"), ("gnss", "u1"), ("sv", "u1"), ("sig", "u1"),
+                      ("freq", "u1"), ("lock", "<u2"), ("cno", "u1"), ("prstd", "u1"), ("cpstd", "u1"),
+                      ("dostd", "u1"), ("trk", "u1"), ("reserved", "u1")])
+
+# RAWX trkStat bits
+PR_VALID = 0x01
+CP_VALID = 0x02
+HALF_CYCLE = 0x04
+
+# GPS user range accuracy (m) of each URA index
+URA = (2.4, 3.4, 4.85, 6.85, 9.65, 13.65, 24.0, 48.0, 96.0, 192.0, 384.0, 768.0, 1536.0, 3072.0, 6144.0)
+
+
+# -----------------------------------------------------------------------------
+# Frames
+# -----------------------------------------------------------------------------
+
+def _frames(buf):
+    """
+    Return the start offsets and payload lengths of the valid UBX frames
+    wholly inside buf.
+    """
+    n = len(buf)
+    starts = np.flatnonzero((buf[:-1] == 0xB5) & (buf[1:] == 0x62))
+    starts = starts[starts + 6 <= n]
+    lengths = buf[starts + 4].astype(np.int64) | (buf[starts + 5].astype(np.int64) << 8)
+    complete = starts + 8 + lengths <= n
+    starts, lengths = starts[complete], lengths[complete]
+
+    # Fletcher checksum over class, id, length and payload, from prefix sums
+    values = buf.astype(np.int64)
+    s1 = np.concatenate(([0], np.cumsum(values)))
+    s2 = np.concatenate(([0], np.cumsum(values * np.arange(n, dtype=np.int64))))
+    a = starts + 2
+    b = starts + 6 + lengths
+    sum_a = s1[b] - s1[a]
+    ck_a = sum_a & 0xFF
+    ck_b = (b * sum_a - (s2[b] - s2[a])) & 0xFF
+    valid = (ck_a == buf[b]) & (ck_b == buf[b + 1])
+    starts, lengths = starts[valid], lengths[valid]
+
+    # Drop the (rare) valid-looking frames found inside another frame
+    keep = np.ones(len(starts), dtype=bool)
+    end = 0
+    for i, (start, length) in enumerate(zip(starts.tolist(), lengths.tolist())):
+        if start < end:
+            keep[i] = False
+        else:
+            end = start + 8 + length
+    return starts[keep], lengths[keep]
+
+
+def frame_chunks(fileobj, chunk_size=CHUNK_SIZE):
+    """
+    Read a UBX log in chunks.
+
+    Yields (buf, starts, lengths, classes, ids) for each chunk, where buf is
+    a uint8 array and the other arrays describe the valid frames wholly
+    inside it. Bytes of a frame cut by the end of a chunk are carried over
+    to the next one.
+    """
+    carry = b""
+    while True:
+        data = fileobj.read(chunk_size)
+        eof = not data
+        data = carry + data
+        if not data:
+            return
+        buf = np.frombuffer(data, dtype=np.uint8)
+        starts, lengths = _frames(buf)
+        if len(starts):
+            yield buf, starts, lengths, buf[starts + 2], buf[starts + 3]
+        if eof:
+            return
+        consumed = int(starts[-1] + 8 + lengths[-1]) if len(starts) else 0
+        carry = data[max(consumed, len(data) - MAX_FRAME):]
+
+
+def _gather(buf, offsets, size):
+    """Return the size bytes at each offset of buf as a (len(offsets), size) array."""
+    return buf[offsets[:, None] + np.arange(size)]
+
+
+# -----------------------------------------------------------------------------
+# RXM-RAWX
+# -----------------------------------------------------------------------------
+
+def decode_rawx(buf, starts, lengths):
+    """
+    Decode the RAWX frames of a chunk.
+
+    Returns (epochs, meas, epoch_index): epochs is a structured array of GPS
+    time (s since the GPS epoch), week, leap seconds and their validity; meas
+    holds every measurement block and epoch_index the epoch of each.
+    """
+    payload = starts + 6
+    header = _gather(buf, payload, 16)
+    tow = header[:, 0:8].copy().view("<f8").ravel()
+    week = header[:, 8:10].copy().view("<u2").ravel().astype(np.int64)
+    leaps = header[:, 10].view(np.int8)
+    nmeas = header[:, 11].astype(np.int64)
+    rec_stat = header[:, 12]
+
+    ok = lengths == 16 + 32 * nmeas
+    payload, tow, week, leaps, nmeas, rec_stat = (x[ok] for x in (payload, tow, week, leaps, nmeas, rec_stat))
+
+    epochs = np.empty(len(payload), dtype=[("time", "f8"), ("week", "i8"), ("leaps", "i1"), ("leaps_valid", "?")])
+    epochs["time"] = week * WEEK_SECONDS + tow
+    epochs["week"] = week
+    epochs["leaps"] = leaps
+    epochs["leaps_valid"] = (rec_stat & 0x01).astype(bool)
+
+    epoch_index = np.repeat(np.arange(len(payload)), nmeas)
+    first = np.repeat(np.cumsum(nmeas) - nmeas, nmeas)
+    offsets = np.repeat(payload + 16, nmeas) + 32 * (np.arange(len(epoch_index)) - first)
+    blocks = np.ascontiguousarray(_gather(buf, offsets, 32))
+    meas = blocks.view(RAWX_MEAS).ravel()
+    return epochs, meas, epoch_index
+
+
+def decimate(times, interval, tolerance=0.005):
+    """Return a mask of the times that fall on multiples of interval seconds."""
+    if not interval:
+        return np.ones(len(times), dtype=bool)
+    return np.abs(times - np.round(times / interval) * interval) <= tolerance
+
+
+def rawx_chunks(fileobj, interval=None):
+    """
+    Yield (epochs, meas, epoch_index) for the RAWX frames of each chunk of a
+    log, keeping only the epochs on the interval grid and the measurements
+    of known signals.
+    """
+    for buf, starts, lengths, classes, ids in frame_chunks(fileobj):
+        rawx = (classes == RXM) & (ids == RAWX)
+        if not rawx.any():
+            continue
+        epochs, meas, epoch_index = decode_rawx(buf, starts[rawx], lengths[rawx])
+        keep = decimate(epochs["time"], interval)
+        mask = keep[epoch_index] & _KNOWN[meas["gnss"], meas["sig"]]
+        yield epochs, meas[mask], epoch_index[mask]
+
+
+def satellite(gnss, sv):
+    """Return the RINEX satellite number (e.g. G05) of a UBX gnssId and svId, or None."""
+    system = SYSTEMS.get(gnss)
+    if system is None:
+        return None
+    if system == "S":
+        sv -= 100
+    if system == "R" and sv == 255:
+        return None
+    return "{0:s}{1:02d}".format(system, sv)
+
+
+def gps_datetime(seconds):
+    """Return the datetime of a GPS time in seconds since the GPS epoch."""
+    return GPS_EPOCH + datetime.timedelta(seconds=seconds)
+
+
+# -----------------------------------------------------------------------------
+# RXM-SFRBX: GPS LNAV ephemerides
+# -----------------------------------------------------------------------------
+
+def _bits(data, pos, length):
+    """Return the unsigned integer of length bits at bit pos of an int holding a 240-bit subframe."""
+    return (data >> (240 - pos - length)) & ((1 << length) - 1)
+
+
+def _sbits(data, pos, length):
+    value = _bits(data, pos, length)
+    return value - (1 << length) if value >> (length - 1) else value
+
+
+def decode_subframe(data):
+    """
+    Decode GPS LNAV subframes 1-3, given as an int of ten 24-bit words.
+
+    Returns (subframe id, dict of fields) or (subframe id, None).
+    """
+    sid = _bits(data, 43, 3)
+    tow = _bits(data, 24, 17) * 6.0
+    if sid == 1:
+        return sid, {
+            "tow": tow, "week": _bits(data, 48, 10), "code": _bits(data, 58, 2), "sva": _bits(data, 60, 4),
+            "svh": _bits(data, 64, 6), "iodc": (_bits(data, 70, 2) << 8) + _bits(data, 168, 8),
+            "flag": _bits(data, 72, 1), "tgd": _sbits(data, 160, 8) * 2.0 ** -31,
+            "toc": _bits(data, 176, 16) * 16.0, "f2": _sbits(data, 192, 8) * 2.0 ** -55,
+            "f1": _sbits(data, 200, 16) * 2.0 ** -43, "f0": _sbits(data, 216, 22) * 2.0 ** -31,
+        }
+    if sid == 2:
+        return sid, {
+            "iode": _bits(data, 48, 8), "crs": _sbits(data, 56, 16) * 2.0 ** -5,
+            "deln": _sbits(data, 72, 16) * 2.0 ** -43 * math.pi, "M0": _sbits(data, 88, 32) * 2.0 ** -31 * math.pi,
+            "cuc": _sbits(data, 120, 16) * 2.0 ** -29, "e": _bits(data, 136, 32) * 2.0 ** -33,
+            "cus": _sbits(data, 168, 16) * 2.0 ** -29, "sqrtA": _bits(data, 184, 32) * 2.0 ** -19,
+            "toes": _bits(data, 216, 16) * 16.0, "fit": 4.0 if _bits(data, 232, 1) == 0 else 8.0,
+        }
+    if sid == 3:
+        return sid, {
+            "cic": _sbits(data, 48, 16) * 2.0 ** -29, "OMG0": _sbits(data, 64, 32) * 2.0 ** -31 * math.pi,
+            "cis": _sbits(data, 96, 16) * 2.0 ** -29, "i0": _sbits(data, 112, 32) * 2.0 ** -31 * math.pi,
+            "crc": _sbits(data, 144, 16) * 2.0 ** -5, "omg": _sbits(data, 160, 32) * 2.0 ** -31 * math.pi,
+            "OMGd": _sbits(data, 192, 24) * 2.0 ** -43 * math.pi, "iode": _bits(data, 216, 8),
+            "idot": _sbits(data, 224, 14) * 2.0 ** -43 * math.pi,
+        }
+    return sid, None
+
+
+class EphemerisCollector:
+    """Assemble GPS ephemerides from the SFRBX frames of a log."""
+
+    def __init__(self):
+        self.subframes = defaultdict(dict)
+        self.ephemerides = {}
+
+    def add_chunk(self, buf, starts, lengths, week):
+        """Decode the GPS L1 C/A SFRBX frames of a chunk; week is the current full GPS week."""
+        for start, length in zip(starts.tolist(), lengths.tolist()):
+            payload = bytes(buf[start + 6:start + 6 + length])
+            gnss, sv, num_words = payload[0], payload[1], payload[4]
+            if gnss != 0 or num_words != 10 or length != 8 + 4 * num_words:
+                continue
+            words = np.frombuffer(payload, dtype="<u4", count=10, offset=8)
+            data = 0
+            for word in words.tolist():
+                data = (data << 24) | ((word >> 6) & 0xFFFFFF)
+            if _bits(data, 0, 8) != 0x8B:
+                continue
+            sid, fields = decode_subframe(data)
+            if fields is None:
+                continue
+            frames = self.subframes[sv]
+            frames[sid] = fields
+            self._complete(sv, frames, week)
+
+    def _complete(self, sv, frames, week):
+        if not all(sid in frames for sid in (1, 2, 3)):
+            return
+        sf1, sf2, sf3 = frames[1], frames[2], frames[3]
+        if not sf2["iode"] == sf3["iode"] == sf1["iodc"] & 0xFF:
+            return
+        # Full week from the 10-bit broadcast week and the receiver week
+        full_week = sf1["week"] + 1024 * round((week - sf1["week"]) / 1024)
+        eph = dict(sf1, **sf2)
+        eph.update(sf3)
+        eph["week"] = full_week
+        self.ephemerides[(sv, eph["iode"], eph["toes"])] = eph
+
+
+def _nav_time(week, seconds):
+    t = gps_datetime(week * WEEK_SECONDS + seconds)
+    return "{0:04d} {1:02d} {2:02d} {3:02d} {4:02d} {5:02d}".format(t.year, t.month, t.day, t.hour, t.minute,
+                                                                     t.second)
+
+
+def _d19(*values):
+    return "".join("{0:19.12E}".format(value) for value in values)
+
+
+def write_nav(path, ephemerides, leaps=None, program="ubx2rinex.py"):
+    """Write GPS ephemerides to a RINEX 3.04 navigation file."""
+    lines = [_header_line("{0:9.2f}{1:11s}{2:<20s}{3:<20s}".format(3.04, "", "N: GNSS NAV DATA", "G: GPS"),
+                          "RINEX VERSION / TYPE"),
+             _header_line(_pgm_line(program), "PGM / RUN BY / DATE")]
+    if leaps is not None:
+        lines.append(_header_line("{0:6d}".format(leaps), "LEAP SECONDS"))
+    lines.append(_header_line("", "END OF HEADER"))
+
+    for (sv, _, _), eph in sorted(ephemerides.items(), key=lambda item: (item[1]["week"], item[1]["toc"],
+                                                                        item[0][0])):
+        accuracy = URA[eph["sva"]] if eph["sva"] < len(URA) else URA[-1]
+        lines.append("G{0:02d} {1:s}{2:s}".format(sv, _nav_time(eph["week"], eph["toc"]),
+                                                   _d19(eph["f0"], eph["f1"], eph["f2"])))
+        for orbit in ((eph["iode"], eph["crs"], eph["deln"], eph["M0"]),
+                      (eph["cuc"], eph["e"], eph["cus"], eph["sqrtA"]),
+                      (eph["toes"], eph["cic"], eph["OMG0"], eph["cis"]),
+                      (eph["i0"], eph["crc"], eph["omg"], eph["OMGd"]),
+                      (eph["idot"], eph["code"], eph["week"], eph["flag"]),
+                      (accuracy, eph["svh"], eph["tgd"], eph["iodc"]),
+                      (eph["tow"], eph["fit"])):
+            lines.append("    " + _d19(*orbit))
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+# -----------------------------------------------------------------------------
+# Observations
+# -----------------------------------------------------------------------------
+
+def _header_line(content, label):
+    return "{0:<60s}{1:s}".format(content[:60], label)
+
+
+def _pgm_line(program):
+    return "{0:<20s}{1:<20s}{2:<20s}".format(program, "", datetime.datetime.utcnow().strftime("%Y%m%d %H%M%S UTC"))
+
+
+def _time_fields(seconds):
+    """Return (datetime to the second, seconds with fraction) of a GPS time, rounded to 0.1 microsecond."""
+    seconds = round(seconds, 7)
+    whole = math.floor(seconds)
+    t = gps_datetime(whole)
+    return t, t.second + (seconds - whole)
+
+
+class ScanResult:
+    """Header information collected by the first pass over a log."""
+
+    def __init__(self):
+        self.codes = defaultdict(set)
+        self.glonass = {}
+        self.first = None
+        self.last = None
+        self.epochs = 0
+        self.leaps = None
+        self.week = None
+        self.ephemerides = EphemerisCollector()
+
+    def obs_types(self):
+        """Return the observation types of each system, in RINEX order."""
+        types = {}
+        for system in SYSTEM_ORDER:
+            codes = sorted(self.codes.get(system, ()))
+            if codes:
+                types[system] = [kind + code for code in codes for kind in "CLDS"]
+        return types
+
+
+def scan(fileobj, interval=None):
+    """First pass: collect the observation types, epochs, GLONASS channels and GPS ephemerides of a log."""
+    result = ScanResult()
+    for buf, starts, lengths, classes, ids in frame_chunks(fileobj):
+        rawx = (classes == RXM) & (ids == RAWX)
+        if rawx.any():
+            epochs, meas, epoch_index = decode_rawx(buf, starts[rawx], lengths[rawx])
+            if len(epochs):
+                result.week = int(epochs["week"][-1])
+                valid = epochs["leaps_valid"]
+                if valid.any():
+                    result.leaps = int(epochs["leaps"][valid][-1])
+            keep = decimate(epochs["time"], interval)
+            kept = epochs["time"][keep]
+            if len(kept):
+                result.first = kept[0] if result.first is None else min(result.first, kept[0])
+                result.last = kept[-1] if result.last is None else max(result.last, kept[-1])
+                result.epochs += len(kept)
+            meas = meas[keep[epoch_index]]
+            pairs = np.unique(np.stack([meas["gnss"], meas["sig"]], axis=1), axis=0) if len(meas) else ()
+            for gnss, sig in pairs:
+                code = SIGNALS.get((int(gnss), int(sig)))
+                if code is not None:
+                    result.codes[SYSTEMS[int(gnss)]].add(code)
+            glonass = meas[(meas["gnss"] == 6) & (meas["sv"] != 255)]
+            for sv, freq in zip(glonass["sv"].tolist(), glonass["freq"].tolist()):
+                result.glonass[sv] = freq - 7
+
+        sfrbx = (classes == RXM) & (ids == SFRBX)
+        if sfrbx.any() and result.week is not None:
+            result.ephemerides.add_chunk(buf, starts[sfrbx], lengths[sfrbx], result.week)
+    return result
+
+
+def obs_header(info, marker, interval=None, program="ubx2rinex.py"):
+    """Return the lines of a RINEX 3.04 observation header."""
+    lines = [
+        _header_line("{0:9.2f}{1:11s}{2:<20s}{3:<20s}".format(3.04, "", "OBSERVATION DATA", "M"),
+                     "RINEX VERSION / TYPE"),
+        _header_line(_pgm_line(program), "PGM / RUN BY / DATE"),
+        _header_line(marker, "MARKER NAME"),
+        _header_line("GEODETIC", "MARKER TYPE"),
+        _header_line("", "OBSERVER / AGENCY"),
+        _header_line("{0:<20s}{1:<20s}{2:<20s}".format("", "U-BLOX", ""), "REC # / TYPE / VERS"),
+        _header_line("", "ANT # / TYPE"),
+        _header_line("{0:14.4f}{1:14.4f}{2:14.4f}".format(0.0, 0.0, 0.0), "APPROX POSITION XYZ"),
+        _header_line("{0:14.4f}{1:14.4f}{2:14.4f}".format(0.0, 0.0, 0.0), "ANTENNA: DELTA H/E/N"),
+    ]
+    for system, types in info.obs_types().items():
+        for i in range(0, len(types), 13):
+            prefix = "{0:1s}  {1:3d}".format(system, len(types)) if i == 0 else " " * 6
+            lines.append(_header_line(prefix + "".join(" {0:3s}".format(t) for t in types[i:i + 13]),
+                                      "SYS / # / OBS TYPES"))
+    lines.append(_header_line("DBHZ", "SIGNAL STRENGTH UNIT"))
+    if interval:
+        lines.append(_header_line("{0:10.3f}".format(interval), "INTERVAL"))
+    for label, seconds in (("TIME OF FIRST OBS", info.first), ("TIME OF LAST OBS", info.last)):
+        t, sec = _time_fields(seconds)
+        lines.append(_header_line("{0:6d}{1:6d}{2:6d}{3:6d}{4:6d}{5:13.7f}     GPS".format(
+            t.year, t.month, t.day, t.hour, t.minute, sec), label))
+    for system, types in info.obs_types().items():
+        for t in types:
+            if t[0] == "L":
+                lines.append(_header_line("{0:1s} {1:3s} {2:8.5f}".format(system, t, 0.0), "SYS / PHASE SHIFT"))
+    if "R" in info.obs_types():
+        slots = sorted(info.glonass.items())
+        for i in range(0, max(len(slots), 1), 8):
+            prefix = "{0:3d} ".format(len(slots)) if i == 0 else " " * 4
+            lines.append(_header_line(prefix + "".join("R{0:02d} {1:2d} ".format(sv, k) for sv, k in slots[i:i + 8]),
+                                      "GLONASS SLOT / FRQ #"))
+        lines.append(_header_line(" C1C    0.000 C1P    0.000 C2C    0.000 C2P    0.000", "GLONASS COD/PHS/BIS"))
+    if info.leaps is not None:
+        lines.append(_header_line("{0:6d}".format(info.leaps), "LEAP SECONDS"))
+    lines.append(_header_line("", "END OF HEADER"))
+    return lines
+
+
+def _obs_field(value, lli=0, ssi=0):
+    return "{0:14.3f}{1:1s}{2:1s}".format(value, str(lli) if lli else " ", str(ssi) if ssi else " ")
+
+
+def write_obs(fileobj, out, info, interval=None):
+    """Second pass: write the epochs of a log to an open RINEX observation file (after its header)."""
+    columns = {system: {t: i for i, t in enumerate(types)} for system, types in info.obs_types().items()}
+    prev_lock = {}
+    blank = " " * 16
+
+    for epochs, meas, epoch_index in rawx_chunks(fileobj, interval):
+        order = np.lexsort((meas["sig"], meas["sv"], _RANK[meas["gnss"]], epoch_index))
+        meas, epoch_index = meas[order], epoch_index[order]
+        bounds = np.flatnonzero(np.diff(epoch_index)) + 1
+        for group in np.split(np.arange(len(meas)), bounds):
+            if not len(group):
+                continue
+            rows = {}
+            for m in meas[group].tolist():
+                pr, cp, do, gnss, sv, sig, freq, lock, cno, _, _, _, trk, _ = m
+                sat = satellite(gnss, sv)
+                if sat is None:
+                    continue
+                code = SIGNALS[(gnss, sig)]
+                fields = rows.setdefault(sat, [blank] * len(columns[sat[0]]))
+                index = columns[sat[0]]
+                ssi = min(max(int(cno / 6), 1), 9)
+                if trk & PR_VALID:
+                    fields[index["C" + code]] = _obs_field(pr, 0, ssi)
+                    fields[index["D" + code]] = _obs_field(do)
+                if trk & CP_VALID:
+                    key = (gnss, sv, sig)
+                    lli = 1 if key in prev_lock and lock < prev_lock[key] else 0
+                    if not trk & HALF_CYCLE:
+                        lli |= 2
+                    prev_lock[key] = lock
+                    fields[index["L" + code]] = _obs_field(cp, lli, ssi)
+                fields[index["S" + code]] = _obs_field(cno)
+            if not rows:
+                continue
+            t, sec = _time_fields(epochs["time"][epoch_index[group[0]]])
+            out.write("> {0:4d} {1:02d} {2:02d} {3:02d} {4:02d}{5:11.7f}  0{6:3d}\n".format(
+                t.year, t.month, t.day, t.hour, t.minute, sec, len(rows)))
+            for sat, fields in rows.items():
+                out.write((sat + "".join(fields)).rstrip() + "\n")
+
+
+def convert(ubx_file, output_path, interval=None, marker=None, program="ubx2rinex.py"):
+    """
+    Convert a UBX log to RINEX 3.04 observation (.obs) and GPS navigation
+    (.nav) files in output_path.
+
+    Returns (obs path, nav path or None). Raises ValueError if the log holds
+    no raw measurements.
+    """
+    name = os.path.splitext(os.path.basename(ubx_file))[0]
+    marker = marker or name[:4].upper()
+    with open(ubx_file, "rb") as f:
+        info = scan(f, interval)
+    if not info.epochs:
+        raise ValueError("No UBX-RXM-RAWX measurements in {0:s}".format(ubx_file))
+
+    os.makedirs(output_path, exist_ok=True)
+    obs_file = os.path.join(output_path, name + ".obs")
+    with open(ubx_file, "rb") as f, open(obs_file, "w") as out:
+        out.write("\n".join(obs_header(info, marker, interval, program)) + "\n")
+        write_obs(f, out, info, interval)
+
+    nav_file = None
+    if info.ephemerides.ephemerides:
+        nav_file = os.path.join(output_path, name + ".nav")
+        write_nav(nav_file, info.ephemerides.ephemerides, info.leaps, program)
+    return obs_file, nav_file
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Convert u-blox logs (UBX-RXM-RAWX/SFRBX) to RINEX 3.04")
+    parser.add_argument("ubx_files", nargs="+", help="UBX log files")
+    parser.add_argument("-d", "--output_path", type=str, default=".", help="Output directory (default=\".\")")
+    parser.add_argument("--interval", type=float, help="Keep only epochs on multiples of this interval (s)")
+    parser.add_argument("--marker", type=str, help="Marker name (default=first 4 characters of the file name)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    status = 0
+    for ubx_file in args.ubx_files:
+        try:
+            obs_file, nav_file = convert(ubx_file, args.output_path, args.interval, args.marker)
+        except (OSError, ValueError) as e:
+            print("{}: {}".format(ubx_file, e), file=sys.stderr)
+            status = 1
+            continue
+        print("{} -> {}{}".format(ubx_file, obs_file, "" if nav_file is None else ", " + nav_file))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,15 +11,23 @@ Code to:
 """
 
 import glob
+import os
 import zipfile
 import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
 import matplotlib.dates as mdates
-import pyproj
+import ppp_daily
+import ppp_merge
+import ppp_stats
+import ppp_store
+import ppp_velocity
+from ppp_coverage import CoverageIndex
 
 # -----------------------------------------------------------------------------
 # Configuration
@@ -71,21 +79,8 @@ filename = "lowell_corner"
 filename = "milne_1"
 filename = "milne_2"
 
-# -----------------------------------------------------------------------------
-# Execute functions
-# -----------------------------------------------------------------------------
-
-# Process data
-process_ppp(path_data,filename)
-
-# Check data
-check_data(path_data, filename)
-
-# Calculate statistics
-calculate_stats(path_data, filename)
-
-# Produce plots
-plot_graphs(path_data,path_figures,"lowell_upper","lowell_corner")
+# Stations ingested at once
+stations = ["belcher_lower", "belcher_upper", "lowell_upper", "lowell_corner", "milne_1", "milne_2"]
 
 # -----------------------------------------------------------------------------
 # Function: Unzip and concatenate CSRS-PPP outputs
@@ -93,60 +88,117 @@ plot_graphs(path_data,path_figures,"lowell_upper","lowell_corner")
 def process_ppp(path_data, filename):
     
     path_input = "{}{}/".format(path_data,filename)
-    path_output = "{}ppp/".format(path_input)
-    
-    # Create output path if required 
-    try:
-        Path(path_output).mkdir(parents=True, exist_ok=False)
-    except FileExistsError:
-        print("{} already exists".format(path_output))
-    else:
-        print("{} folder was created".format(path_output))
     
-    # Unzip files
+    # Concatenate the CSV members of the zip files, streamed without extracting anything
     files = sorted(glob.glob(path_input + "*.zip"))
-    for file in files: 
-        with zipfile.ZipFile(file) as item: # Treat the file as a zip
-            item.extractall(path_output)  # Extract it in the working directory
-       
-    # Concatenate CSV files
-    files = sorted(glob.glob(path_output + "*.csv"))
-    with open(path_input + filename + ".csv", "w") as outfile:
-        for i, file in enumerate(files):
-            with open(file, 'r') as infile:
-                if i != 0:
-                    infile.readline()  # Throw away header on all but first file
-                # Block copy rest of file from input to output without parsing
-                shutil.copyfileobj(infile, outfile)
-                print("{} has been imported.".format(file))
+    header = True
+    with open(path_input + filename + ".csv", "wb") as outfile:
+        for file in files:
+            with zipfile.ZipFile(file) as item:
+                names = sorted(name for name in item.namelist() if name.lower().endswith(".csv"))
+                for name in names:
+                    with item.open(name) as infile:
+                        if not header:
+                            infile.readline()  # Throw away header on all but first file
+                        header = False
+                        # Block copy rest of file from input to output without parsing
+                        shutil.copyfileobj(infile, outfile)
+                    print("{}/{} has been imported.".format(file, name))
 
 # -----------------------------------------------------------------------------
-# Function: Perform quality control of concatenated CSV
+# Function: Incrementally merge new CSRS-PPP outputs
 # -----------------------------------------------------------------------------
-def check_data(path_data, filename):
 
-    # Load concatenated CSV file
-    df = pd.read_csv("{}{}/{}.csv".format(path_data,filename,filename), index_col=False)
-    
-    # Add date column
-    df["date"] = pd.to_datetime(df["year"] * 1000 + df["day_of_year"], format="%Y%j")
-    
-    # Set data date range
-    data_start = df.date.min()
-    data_end = df.date.max()
-    
-    # Set date as index
-    df = df.set_index("date")
-    
-    # Find missing dates
-    data_gaps = pd.date_range(start=data_start, end=data_end).difference(df.index).format(formatter=lambda x: x.strftime("%Y-%m-%d"))
-    return(data_gaps)
+def coverage_path(path_data):
+    """Return the coverage index (ppp_coverage.py) shared by the stations of path_data."""
+    return path_data + "ppp_coverage.sqlite"
+
+def open_station(path_data, filename, coverage):
+    """
+    Load the manifest of a station and return a dict of its paths, manifest,
+    coverage index and the zip files not merged yet (see ppp_merge.py: the
+    CSV is rebuilt from scratch if a zip merged before has changed or gone,
+    or if the CSV, Parquet store or coverage records no longer match).
+    """
+    path_input = "{}{}/".format(path_data,filename)
+    files = sorted(glob.glob(path_input + "*.zip"))
+    return ppp_merge.open_station(path_input + filename + ".csv", files, coverage, filename)
+
+def update_ppp(path_data, filename):
+    """
+    Merge the CSV members of zip files not merged yet into <filename>.csv.
+    Returns the zips and rows merged and the time and size of the work.
+    """
+    start = time.perf_counter()
+    merged = {"filename": filename, "pid": os.getpid(), "files": 0, "rows": 0, "bytes": 0}
+    with CoverageIndex(coverage_path(path_data)) as coverage:
+        station = open_station(path_data, filename, coverage)
+        for file in station["new"]:
+            header, rows = ppp_merge.read_rows(file)
+            ppp_merge.add_zip(station, file, header, rows)
+            merged["files"] += 1
+            merged["rows"] += len(rows)
+            merged["bytes"] += os.path.getsize(file)
+    merged["seconds"] = time.perf_counter() - start
+    return merged
+
+# -----------------------------------------------------------------------------
+# Function: Ingest the zip files of several stations in parallel
+# -----------------------------------------------------------------------------
+
+def ingest_stations(path_data, filenames, jobs=None):
+    """
+    Merge the new zip files of several stations into their CSVs.
+
+    Each station is updated by update_ppp on its own worker of a pool of jobs
+    processes (default: one per core, at most one per station): reading,
+    merging, the Parquet store and the coverage index of a station all run
+    on its worker, and only the counts come back, so the ingest takes about
+    as long as the largest station. Prints the rows/s and MB/s of each
+    station.
+    """
+    start = time.perf_counter()
+    merged = {}
+    with ProcessPoolExecutor(max_workers=jobs or min(os.cpu_count(), max(len(filenames), 1))) as executor:
+        futures = [executor.submit(update_ppp, path_data, filename) for filename in filenames]
+        for future in as_completed(futures):
+            result = future.result()
+            merged[result["filename"]] = result["rows"]
+            print("{} (worker {}): {} files, {} rows in {:.1f} sec ({:.0f} rows/s, {:.1f} MB/s)".format(
+                result["filename"], result["pid"], result["files"], result["rows"], result["seconds"],
+                result["rows"] / max(result["seconds"], 1e-9), result["bytes"] / 1e6 / max(result["seconds"], 1e-9)))
+    print("{} stations in {:.1f} sec".format(len(filenames), time.perf_counter() - start))
+    return merged
+
+# -----------------------------------------------------------------------------
+# Function: Perform quality control of concatenated CSV
+# -----------------------------------------------------------------------------
+def check_data(path_data, filename, freq="D", min_epochs=1):
+
+    # Find missing days (freq="h": hours) from the coverage index written at ingest; periods with fewer than
+    # min_epochs epochs count as missing
+    with CoverageIndex(coverage_path(path_data)) as coverage:
+        if filename in coverage.stations():
+            data_gaps = coverage.missing(filename, freq=freq, min_epochs=min_epochs)
+        else:
+            data_gaps = None
+    if data_gaps is None:
+        # Not ingested by update_ppp or ingest_stations (e.g. concatenated by process_ppp): count the epochs of the
+        # Parquet store or CSV in a temporary in-memory index
+        path_csv = "{}{}/{}.csv".format(path_data, filename, filename)
+        with CoverageIndex(":memory:") as scan:
+            for i, chunk in enumerate(ppp_store.iter_station(path_csv, columns=[])):
+                scan.add(filename, str(i), chunk["datetime"].to_numpy())
+            data_gaps = scan.missing(filename, freq=freq, min_epochs=min_epochs)
+    return(data_gaps.strftime("%Y-%m-%d" if freq == "D" else "%Y-%m-%d %H:00").tolist())
 
 # -----------------------------------------------------------------------------
 # Function: Calculate statistics
 # -----------------------------------------------------------------------------
 
-def calculate_stats(path_data, filename):
+def calculate_stats(path_data, filename, mode="last"):
+    # filename may also be a list of stations, processed at once
+    # mode is the daily position: "last", "mean", "median" or "robust" (sigma-clipped mean)
 
     path_output = "{}statistics/".format(path_data)
     
@@ -158,50 +210,40 @@ def calculate_stats(path_data, filename):
     else:
         print("{} folder was created".format(path_output))
 
-    # Load concatenated CSV file
-    df1 = pd.read_csv("{}{}/{}.csv".format(path_data,filename,filename), index_col=False)
-    
-    # Add date column
-    df1["date"] = pd.to_datetime(df1["year"] * 1000 + df1["day_of_year"], format="%Y%j")
-    
-    # Create empty data frame
-    df2 = pd.DataFrame() 
-    
-    # Group by date and select last row of each day
-    df2 = df1.groupby("date").tail(1)
-    """
-    # Aggregate data by day
-    df2 = df1.groupby("date").agg(latitude_decimal_degree=("latitude_decimal_degree", "mean"),
-                                  longitude_decimal_degree=("longitude_decimal_degree", "mean"))
-    """
-    # Reset dataframe index
-    df2 = df2.reset_index()
-    
-    # Initialize pyproj with appropriate ellipsoid
-    geodesic = pyproj.Geod(ellps="WGS84")
-        
-    # Calculate forward azimuth and great circle distance between modelled coordinates
-    df2["direction"], back_azimuth, df2["distance"] = geodesic.inv(df2["longitude_decimal_degree"].shift().tolist(), 
-                                                                   df2["latitude_decimal_degree"].shift().tolist(),
-                                                                   df2["longitude_decimal_degree"].tolist(), 
-                                                                   df2["latitude_decimal_degree"].tolist())
-    
-    # Convert distance from metres to centimenters
-    df2["distance"] = df2["distance"] * 100.0
-    
-    # Calculate cumulative distance traveled
-    df2["distance_csum"] = df2["distance"].cumsum()
-    
-    # Convert azimuth from (-180° to 180°) to (0° to 360°)
-    df2["direction"] = (df2["direction"] + 360) % 360
-    
-    # Calculate speed
-    df2["speed"] = df2["distance"] / 24
+    # Reduce concatenated CSV files (from their Parquet stores if they have one) to one row per day, a week at a time:
+    # last, mean, median, robust mean and sigma of latitude, longitude and height
+    filenames = [filename] if isinstance(filename, str) else list(filename)
+    dailies = {}
+    for name in filenames:
+        chunks = ppp_store.iter_station("{}{}/{}.csv".format(path_data,name,name), list(ppp_daily.COLUMNS))
+        dailies[name] = ppp_daily.reduce_chunks(chunks)
+        dailies[name].to_csv("{}{}_daily.csv".format(path_output,name), index=False)
     
-    #df2["distance"] = df2["distance"] / 100000.0
+    # Daily direction (°), distance and cumulative distance (m) and speed (m/h) of every station at once
+    stats = ppp_stats.position_stats(dailies, mode)
     
     # Export to CSV
-    df2.to_csv("{}{}_stats.csv".format(path_output,filename))
+    for name, df in stats.groupby("station", observed=True):
+        df.drop(columns="station").to_csv("{}{}_stats.csv".format(path_output,name), index=False)
+
+# -----------------------------------------------------------------------------
+# Function: Calculate sub-daily velocities
+# -----------------------------------------------------------------------------
+
+def calculate_velocity(path_data, filename, method="lsq", window="1h", step="10min", interval=None):
+    # filename may also be a list of stations
+    # method is "lsq" (rolling least-squares slope), "savgol" (Savitzky-Golay) or "kalman" (smoother)
+    # interval is the bin size of the positions, e.g. "30s" (default: median spacing of the solutions)
+
+    path_output = "{}statistics/".format(path_data)
+    Path(path_output).mkdir(parents=True, exist_ok=True)
+
+    # Velocity (m/h) and its uncertainty over each window, every step, reading each station a day at a time
+    filenames = [filename] if isinstance(filename, str) else list(filename)
+    for name in filenames:
+        df = ppp_velocity.station_velocity("{}{}/{}.csv".format(path_data,name,name), method, window, step,
+                                           interval)
+        df.to_csv("{}{}_velocity_{}.csv".format(path_output,name,method), index=False)
 
 # -----------------------------------------------------------------------------
 # Function: Plot speed & distance
@@ -224,16 +266,12 @@ def plot_graphs(path_data,path_figures,filename1,filename2):
     # Convert datetimes
     df1["date"] = pd.to_datetime(df1["date"].astype(str), format="%Y-%m-%d")
     df2["date"] = pd.to_datetime(df2["date"].astype(str), format="%Y-%m-%d")
-    df1["distance"] = df1["distance"] / 100.0
-    df2["distance"] = df2["distance"] / 100.0
-    df1["distance_csum"] = df1["distance_csum"] / 100.0
-    df2["distance_csum"] = df2["distance_csum"] / 100.0
 
     # Daily displacement
     fig, ax = plt.subplots(figsize=(10,5))
     ax.grid(ls="dotted")
-    sns.lineplot(x="date", y="distance", data=df1, errorbar=None, label="Belcher Upper")
-    sns.lineplot(x="date", y="distance", data=df2, errorbar=None, label="Belcher Lower")
+    sns.lineplot(x="date", y="distance_m", data=df1, errorbar=None, label="Belcher Upper")
+    sns.lineplot(x="date", y="distance_m", data=df2, errorbar=None, label="Belcher Lower")
     ax.set(xlabel=None, ylabel="Daily Displacement (m)")
     plt.xticks(rotation=45, horizontalalignment="right")
     ax.xaxis.set_major_locator(mdates.MonthLocator(interval=interval))
@@ -245,8 +283,8 @@ def plot_graphs(path_data,path_figures,filename1,filename2):
     # Cumulative Distance
     fig, ax = plt.subplots(figsize=(10,5))
     ax.grid(ls="dotted")
-    sns.lineplot(x="date", y="distance_csum", data=df1, errorbar=None, label="Belcher Upper")
-    sns.lineplot(x="date", y="distance_csum", data=df2, errorbar=None, label="Belcher Lower")
+    sns.lineplot(x="date", y="distance_csum_m", data=df1, errorbar=None, label="Belcher Upper")
+    sns.lineplot(x="date", y="distance_csum_m", data=df2, errorbar=None, label="Belcher Lower")
     ax.set(xlabel=None, ylabel="Cumulative Distance (m)")
     plt.xticks(rotation=45, horizontalalignment="right")
     ax.xaxis.set_major_locator(mdates.MonthLocator(interval=interval))
@@ -255,20 +293,23 @@ def plot_graphs(path_data,path_figures,filename1,filename2):
     ax.legend(loc="center", bbox_to_anchor=(0.5, -0.35), ncol=2)
     plt.savefig("{}{}_distance.png".format(path_figures,filename1), dpi=dpi, transparent=False, bbox_inches="tight")
 
+# -----------------------------------------------------------------------------
+# Execute functions
+# -----------------------------------------------------------------------------
 
+if __name__ == "__main__":
 
+    # Process data of every station (only zip files not merged yet; process_ppp rebuilds the CSV)
+    ingest_stations(path_data, stations)
 
+    # Check data
+    check_data(path_data, filename)
 
+    # Calculate statistics of every station
+    calculate_stats(path_data, stations)
 
+    # Calculate hourly velocities of every station
+    calculate_velocity(path_data, stations)
 
-
-
-
-
-
-
-
-
-
-
-
+    # Produce plots
+    plot_graphs(path_data,path_figures,"lowell_upper","lowell_corner")